@@ -1,44 +1,116 @@
 from utils.train import train_model
 from utils.functions import data_processing 
-import pandas as pd
+from utils.etapas import archivo, cache_etapas
+from utils.lectura import leer_csv
+from utils.recursos import recursos_entrenamiento
 
 '''UNICAMENTE USARÉ ESTE main SI HAY QUE REENTRENAR EL MODELO CON NUEVAS ESTADÍSTICAS. HAY OTRO MAIN UNICAMENTE DEDICADO A PREDECIR'''
 
+#Para saber qué etapa tarda o gasta la memoria se puede ejecutar con la traza activada: TRAZA_PIPELINE=traza.jsonl python main.py
+#Cada método de data_processing y train_model escribe su tiempo, memoria y tamaño de entradas y salida (ver utils/instrumentacion.py)
+
 #Instancio la clase data_processing
 data_processing = data_processing()
 
-#Carga de datos
-df_datos_generales = pd.read_csv('data/raw_files/datos_generales_fx.csv')
-df_estadisticas = pd.read_csv('data/raw_files/df_estadisticas.csv')
-df_alineaciones = pd.read_csv('data/raw_files/datos_alineaciones.csv')
-df_lesionados = pd.read_csv('data/raw_files/datos_lesionados.csv')
-df_dicc_equipos = pd.read_csv('data/raw_files/df_dicc_equipos.csv')
-cuotas = data_processing.ruta_cuotas()
-
-
-#Procesado de datos
-
-#Procesamiento datos generales de partidos
-df_datos_generales_procesado = data_processing.procesado_datos_generales(df_datos_generales)
-
-#Procesamiento de las estadisticas de los partidos
-df_estadisticas_procesado = data_processing.procesado_estadisticas(df_estadisticas)
-#Procesamiento de las alineaciones de los partidos
-df_alineaciones_procesado = data_processing.procesado_titulares(df_alineaciones)
-#Procesamiento de los lesionados de los partidos
-df_lesionados_procesado = data_processing.procesado_lesionados(df_lesionados)
-#Procesamiento de los datos de las cuotas
-df_cuotas_procesado = data_processing.procesado_cuotas(cuotas,df_dicc_equipos)
-#Unión de los 4 dataframes anteriores, y realización de limpieza e imputación de missings si los hubiera
-df_union_procesado = data_processing.creacion_df_final(df_lesionados=df_lesionados_procesado, 
-                                                       df_alineaciones=df_alineaciones_procesado,
-                                                        df_datos_partidos=df_datos_generales_procesado,
-                                                        df_estadisticas=df_estadisticas_procesado,
-                                                        df_cuotas = df_cuotas_procesado)
-#Creación de nuevas variables interesantes para el desempeño del modelo
-df_final = data_processing.creacion_nuevas_variables(df_union_procesado)
-
-df_final.to_csv('data/processed_files/df_datos_completos.csv', index=False)
+#Si solo ha llegado una jornada nueva, se pone a True para añadir los partidos nuevos a df_datos_completos.parquet sin reconstruirlo
+#entero. En data/raw_files/nuevos tienen que estar únicamente las filas nuevas de cada archivo en bruto (con el mismo nombre) y
+#las filas nuevas también se tienen que añadir al final de los archivos de data/raw_files
+actualizacion_incremental = False
+
+#Variables de forma opcionales (ver data_processing.variables_forma), por ejemplo {'ventanas': [3, 5, 10, 0.3]} para la suma de los
+#3, 5 y 10 partidos anteriores y la media exponencial de todos. Con None el dataset es el de siempre
+variables_forma = None
+
+#Con True se añaden las variables de alineación (ver utils/alineaciones.py): diez columnas por partido con la fuerza de los titulares
+#y de los lesionados de cada equipo y los titulares habituales que faltan. El modelo se entrena con ellas en vez de con una columna
+#por jugador, y pasa de miles de columnas a unas decenas
+variables_alineacion = False
+
+#Con True XGBoost crea las matrices de entrenamiento en memoria externa (páginas en data/cache/dmatrix), para cuando el dataset no
+#cabe en RAM. Es más lento, así que solo merece la pena si no hay memoria
+memoria_externa_xgb = False
+
+#tree_method de XGBoost. Con None el de XGBoost por defecto, el del modelo de siempre, y durante la búsqueda las matrices de
+#entrenamiento de cada fold se guardan en data/cache/dmatrix (se borran al terminar). Con 'hist' entrena con histogramas: las matrices ya cuantizadas solo se reutilizan en memoria y
+#no se escriben en disco, y el modelo cambia
+tree_method_xgb = None
+
+#Núcleos y memoria (MB) que puede usar el entrenamiento, con None todos los del proceso y la memoria disponible. Se reparten entre
+#los procesos de la búsqueda de hiperparámetros y los hilos de XGBoost de cada ajuste (ver utils/recursos.py)
+nucleos_entrenamiento = None
+memoria_entrenamiento_mb = None
+
+#Lee las alineaciones y los lesionados por bloques, solo con fixture_id y el id del jugador, en vez de cargar los csv enteros. El
+#resultado es el mismo, pero la memoria ya no crece con el tamaño de los archivos en bruto (ver data_processing.pivot_disperso_bloques)
+lectura_por_bloques = True
+
+if actualizacion_incremental:
+    #Carga del dataset ya procesado y de las filas nuevas
+    df_final = data_processing.cargar_dataset('data/processed_files/df_datos_completos.parquet')
+    df_datos_generales = leer_csv('data/raw_files/nuevos/datos_generales_fx.csv')
+    df_estadisticas = leer_csv('data/raw_files/nuevos/df_estadisticas.csv')
+    df_alineaciones = leer_csv('data/raw_files/nuevos/datos_alineaciones.csv')
+    df_lesionados = leer_csv('data/raw_files/nuevos/datos_lesionados.csv')
+    df_dicc_equipos = leer_csv('data/raw_files/df_dicc_equipos.csv')
+    #Cuotas de la temporada actual, que es la única que cambia
+    cuotas = data_processing.ruta_cuotas()[-2:]
+
+    #Añade solo los partidos nuevos y recalcula las variables de los equipos que los juegan
+    df_final = data_processing.actualizacion_incremental(df_final, df_datos_generales, df_estadisticas, df_alineaciones,
+                                                         df_lesionados, cuotas, df_dicc_equipos)
+else:
+    #El pipeline se declara como etapas con caché en disco (ver utils/etapas.py). Cada etapa se identifica por el contenido de sus
+    #archivos de entrada, las etapas de las que depende y su código, así que solo se recalculan las que han cambiado y las que
+    #dependen de ellas. Nada se ejecuta hasta pedir el valor de df_final
+    etapas = cache_etapas('data/cache/etapas')
+
+    #Carga de datos
+    df_datos_generales = etapas.etapa('lectura_datos_generales', leer_csv, archivo('data/raw_files/datos_generales_fx.csv'))
+    df_estadisticas = etapas.etapa('lectura_estadisticas', leer_csv, archivo('data/raw_files/df_estadisticas.csv'))
+    if lectura_por_bloques:
+        #procesado_titulares y procesado_lesionados reciben la ruta y leen el csv por bloques
+        df_alineaciones = archivo('data/raw_files/datos_alineaciones.csv')
+        df_lesionados = archivo('data/raw_files/datos_lesionados.csv')
+    else:
+        df_alineaciones = etapas.etapa('lectura_alineaciones', leer_csv, archivo('data/raw_files/datos_alineaciones.csv'))
+        df_lesionados = etapas.etapa('lectura_lesionados', leer_csv, archivo('data/raw_files/datos_lesionados.csv'))
+    df_dicc_equipos = etapas.etapa('lectura_equipos', leer_csv, archivo('data/raw_files/df_dicc_equipos.csv'))
+    cuotas = [archivo(ruta) for ruta in data_processing.ruta_cuotas()]
+
+
+    #Procesado de datos
+
+    #Procesamiento datos generales de partidos
+    df_datos_generales_procesado = etapas.etapa('procesado_datos_generales', data_processing.procesado_datos_generales, df_datos_generales)
+
+    #Procesamiento de las estadisticas de los partidos
+    df_estadisticas_procesado = etapas.etapa('procesado_estadisticas', data_processing.procesado_estadisticas, df_estadisticas)
+    #Procesamiento de las alineaciones de los partidos
+    df_alineaciones_procesado = etapas.etapa('procesado_titulares', data_processing.procesado_titulares, df_alineaciones)
+    #Procesamiento de los lesionados de los partidos
+    df_lesionados_procesado = etapas.etapa('procesado_lesionados', data_processing.procesado_lesionados, df_lesionados)
+    #Procesamiento de los datos de las cuotas
+    df_cuotas_procesado = etapas.etapa('procesado_cuotas', data_processing.procesado_cuotas, cuotas, df_dicc_equipos)
+    #Unión de los 4 dataframes anteriores, y realización de limpieza e imputación de missings si los hubiera
+    df_union_procesado = etapas.etapa('creacion_df_final', data_processing.creacion_df_final,
+                                      df_lesionados=df_lesionados_procesado,
+                                      df_alineaciones=df_alineaciones_procesado,
+                                      df_datos_partidos=df_datos_generales_procesado,
+                                      df_estadisticas=df_estadisticas_procesado,
+                                      df_cuotas=df_cuotas_procesado)
+    #Creación de nuevas variables interesantes para el desempeño del modelo
+    df_final = etapas.etapa('creacion_nuevas_variables', data_processing.creacion_nuevas_variables, df_union_procesado,
+                            forma=variables_forma, alineacion=variables_alineacion)
+
+    etapa_df_final = df_final
+    df_final = etapa_df_final.valor()
+    print('Etapas:', ', '.join(f'{nombre} ({origen})' for nombre, origen in etapas.registro))
+
+data_processing.guardar_dataset(df_final, 'data/processed_files/df_datos_completos.parquet')
+
+#Creación del feature store con la forma de cada equipo, para predecir sin tener que recorrer todo el histórico
+store = data_processing.creacion_feature_store(df_final)
+store.guardar('data/processed_files/feature_store.pkl')
 #Creación de datos nuevos. 
 #Para crear los datos nuevos hay que darle valor a una serie de variables. Se muestra un ejemplo, varían por partido, y no es necesario pasar una lista completa de lesionados
 #y alineaciones pero mejorará el desempeño del modelo. Los nombres del estadio y el árbitro deben estar correctos y 100% igual escritos. Para sacarlos se puede llamar a las funciones 
@@ -59,15 +131,22 @@ ids_titulares = [
    47044,380261,104916,47332,47053,107158,47065,162249,47553,323935,22098
 ]
 
-datos_nuevos = data_processing.creacion_datos_nuevos(df_final,id_equipo_local, id_equipo_visitante,odd_1, odd_x, odd_2, arbitro, estadio, season, ids_lesionados, ids_titulares)
+datos_nuevos = data_processing.creacion_datos_nuevos(store,id_equipo_local, id_equipo_visitante,odd_1, odd_x, odd_2, arbitro, estadio, season, ids_lesionados, ids_titulares)
 
 #Instancio la clase entrenamiento del modelo
 train_model = train_model()
 
-train_model.train_xgbc(df_final) #Realizará la exportación también de un .pkl que importaremos para realizar la predicción
-
-#Importación del modelo
-modelo = train_model.importar_modelo('model/football_predictor.pkl')
+#El entrenamiento también es una etapa: si no han cambiado los datos, los hiperparámetros ni el código, se carga el modelo de la caché.
+#Con la actualización incremental df_final es un dataframe, y su clave se calcula con su contenido
+etapas = cache_etapas('data/cache/etapas')
+entrada_entrenamiento = df_final if actualizacion_incremental else etapa_df_final
+modelo = etapas.etapa('train_xgbc', train_model.train_xgbc, entrada_entrenamiento, guardar=False,
+                      memoria_externa=memoria_externa_xgb, tree_method=tree_method_xgb,
+                      recursos=recursos_entrenamiento(nucleos_entrenamiento, memoria_entrenamiento_mb)).valor()
+train_model.guardar_modelo(modelo, 'model/football_predictor.pkl')
+
+#Exportación del modelo ligero que usa main_only_predict.py para predecir sin cargar el modelo completo
+train_model.exportar_modelo_ligero(modelo, 'model/football_predictor')
 
 #Prediccion
 train_model.prediccion_modelo(modelo, datos_nuevos)
@@ -0,0 +1,35 @@
+from utils.benchmark import benchmark, comparar_resultados
+import os
+import pandas as pd
+
+'''ESTE MAIN MIDE EL TIEMPO Y LA MEMORIA DE CADA ETAPA DEL PIPELINE CON DATOS SINTÉTICOS A VARIAS ESCALAS, SIN CONEXIÓN A LA API.
+LOS DATOS DE CADA ESCALA SE GENERAN LA PRIMERA VEZ EN data/benchmark/x<escala> Y SE REUTILIZAN EN LAS SIGUIENTES EJECUCIONES'''
+
+#Escalas respecto a los datos actuales (1 = unos 7.000 partidos y 15.000 jugadores). Con 100 la generación y las etapas pesadas
+#(creacion_df_final, train_xgbc) pueden tardar horas o quedarse sin memoria, por eso los resultados se guardan tras cada etapa
+escalas = [1, 10, 100]
+
+#None para todas las etapas, o una lista con algunas de utils.benchmark.ETAPAS (las etapas de las que dependen se ejecutan igual)
+etapas = None
+
+#Con True se comparan también los ajustes por hora de varios repartos de núcleos entre procesos de la búsqueda e hilos de XGBoost.
+#repartos_recursos es una lista de (procesos, hilos_xgb), con None 1, 2, 4... procesos y el resto de núcleos como hilos
+comparar_recursos = False
+repartos_recursos = None
+
+ruta_resultados = 'data/benchmark/resultados.json'
+#Resultados de referencia con los que comparar, por ejemplo los de la rama principal. None para no comparar
+ruta_referencia = None
+
+if os.path.exists(ruta_resultados):
+    os.replace(ruta_resultados, ruta_resultados.replace('.json', '_anterior.json'))
+
+prueba = benchmark(ruta_resultados, etapas=etapas, recursos=comparar_recursos, repartos=repartos_recursos)
+resultados = prueba.ejecutar(escalas)
+print(resultados[['escala', 'etapa', 'tiempo_s', 'memoria_pico_mb', 'filas', 'columnas', 'error']].to_string(index=False))
+if comparar_recursos:
+    print(pd.DataFrame(prueba.resultados_recursos).to_string(index=False))
+
+if ruta_referencia is not None:
+    comparacion = comparar_resultados(ruta_referencia, ruta_resultados)
+    print(comparacion.loc[comparacion['regresion'], ['escala', 'etapa', 'ratio_tiempo', 'ratio_memoria', 'error_nueva']].to_string(index=False))
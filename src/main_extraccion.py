@@ -0,0 +1,10 @@
+from utils.extraccion import cliente_api, extraccion_datos
+
+'''ESTE MAIN DESCARGA DE LA API LOS ARCHIVOS EN BRUTO DE data/raw_files (LO QUE HACÍA EL NOTEBOOK DE EXTRACCIÓN). LAS RESPUESTAS SE
+GUARDAN EN data/cache/api, ASÍ QUE VOLVER A EJECUTARLO SOLO PIDE LOS PARTIDOS NUEVOS'''
+
+#La clave de RapidAPI se lee de la variable de entorno RAPIDAPI_KEY: RAPIDAPI_KEY=... python main_extraccion.py
+#peticiones_por_segundo tiene que estar por debajo del límite del plan contratado. n_hilos son las peticiones en vuelo a la vez
+cliente = cliente_api(peticiones_por_segundo=5, rafaga=5, n_hilos=8)
+
+print(extraccion_datos(cliente).extraccion_completa('data/raw_files'))
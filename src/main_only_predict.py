@@ -1,12 +1,24 @@
-from utils.train import train_model
 from utils.functions import data_processing 
+from utils.feature_store import feature_store
+from utils.modelo_ligero import modelo_ligero, mostrar_prediccion
+from utils.escenarios import escenarios_dudosos, simulador_escenarios
+import os
 import pandas as pd
 
 '''ESTE MAIN ESTA DEDICADO ÚNICAMENTE A LA PREDICCIÓN DE RESULTADOS'''
 
-#Carga de datos
+#Instacia de la clase data_preprocessing
+data_processing = data_processing()
+
+#Carga de datos. El feature store ya tiene la forma de cada equipo, no hace falta leer el dataset procesado. Si no está creado,
+#se crea leyendo del parquet solo las columnas necesarias
 
-df_final = pd.read_csv('data/processed_files/df_datos_completos.csv')
+if os.path.exists('data/processed_files/feature_store.pkl'):
+    store = feature_store.cargar('data/processed_files/feature_store.pkl')
+else:
+    columnas = data_processing.columnas_dataset('data/processed_files/df_datos_completos.parquet')
+    df_final = data_processing.cargar_dataset('data/processed_files/df_datos_completos.parquet', data_processing.columnas_prediccion(columnas))
+    store = data_processing.creacion_feature_store(df_final, columnas)
 
 #Creación de datos nuevos. 
 #Para crear los datos nuevos hay que darle valor a una serie de variables. Se muestra un ejemplo, varían por partido, y no es necesario pasar una lista completa de lesionados
@@ -27,24 +39,33 @@ ids_titulares = [
  181421,46746,47579,47448,46653,47574,46662,67939,64309,1825,
  1926,47445,47435,19026,47566,2032,47432,47277,67955,182504,47427
 ]
-#Instacia de la clase data_preprocessing
-data_processing = data_processing()
-
 #Creación de datos nuevos
-datos_nuevos = data_processing.creacion_datos_nuevos(df_final,id_equipo_local, id_equipo_visitante,odd_1, odd_x, odd_2, arbitro, estadio, season, ids_lesionados, ids_titulares)
+datos_nuevos = data_processing.creacion_datos_nuevos(store,id_equipo_local, id_equipo_visitante,odd_1, odd_x, odd_2, arbitro, estadio, season, ids_lesionados, ids_titulares)
 
 #Entrenamiento del modelo. La línea de código estará comentada, se descomentará para poder reentrenar cuando haya datos nuevos
 
-#Instacia de la clase train_model
-train_model = train_model()
-
-#Importación del modelo
+#Importación del modelo. Se usa el modelo ligero exportado en main.py, que carga en memoria solo lo necesario y no importa
+#sklearn ni xgboost. Si no existe se importa el modelo completo, que necesita train_model y todas sus librerías
 
-modelo = train_model.importar_modelo('model/football_predictor.pkl')
+if os.path.exists('model/football_predictor'):
+    modelo = modelo_ligero.cargar('model/football_predictor')
+else:
+    from utils.train import train_model
+    modelo = train_model().importar_modelo('model/football_predictor.pkl')
 
 #Prediccion
 
-train_model.prediccion_modelo(modelo, datos_nuevos)
+mostrar_prediccion(modelo, datos_nuevos)
+
+#Escenarios de alineación: ids de titulares en duda. Se predicen todas las combinaciones de dudosos que no juegan (pasan a
+#lesionados) de una vez y se muestra cuánto cambia cada probabilidad respecto a la alineación de arriba. Vacío para no simularlos
+dudosos = []
+
+if dudosos:
+    partido = {'id_equipo_local': id_equipo_local, 'id_equipo_visitante': id_equipo_visitante, 'odd_1': odd_1, 'odd_x': odd_x,
+               'odd_2': odd_2, 'arbitro': arbitro, 'estadio': estadio, 'season': season, 'ids_lesionados': ids_lesionados,
+               'ids_titulares': ids_titulares}
+    print(simulador_escenarios(store, modelo).predecir(partido, escenarios_dudosos(dudosos)).to_string(index=False))
 
 
 
@@ -0,0 +1,32 @@
+from utils.cache_predicciones import cache_predicciones
+from utils.servicio import servicio_prediccion
+import os
+
+'''ESTE MAIN ARRANCA UN SERVICIO EN LOCAL QUE SE QUEDA ESCUCHANDO PETICIONES DE PREDICCIÓN. EL MODELO Y EL FEATURE STORE SE CARGAN UNA
+SOLA VEZ AL ARRANCAR, ASÍ QUE CADA PREDICCIÓN SOLO CUESTA CREAR LOS DATOS NUEVOS Y PREDECIR'''
+
+#Se usa el modelo ligero exportado en main.py, si no existe el .pkl completo. El feature store también se crea en main.py
+ruta_modelo = 'model/football_predictor' if os.path.exists('model/football_predictor') else 'model/football_predictor.pkl'
+ruta_store = 'data/processed_files/feature_store.pkl'
+
+#Un proceso por núcleo. Las peticiones que llegan a la vez se agrupan en lotes de hasta 64 partidos
+#Los partidos que ya se han predicho con este modelo y este store se responden de la caché: hasta 10.000 en memoria, una hora como
+#mucho, y también en disco para que duren entre reinicios. Al reentrenar cambian los archivos y con ellos la versión de la caché
+cache = cache_predicciones(capacidad=10000, ttl_s=3600, ubicacion='data/cache/predicciones')
+
+#Dentro del if porque los procesos del pool (forkserver o spawn, ver utils/servicio.contexto_procesos) importan este script, y si
+#no cada uno arrancaría otro servicio
+if __name__ == '__main__':
+    servicio = servicio_prediccion(ruta_modelo, ruta_store, host='127.0.0.1', puerto=8000, cache=cache)
+    direccion = servicio.iniciar()
+    print(f'Servicio de predicción escuchando en {direccion}')
+
+    #Ejemplo de petición (Lugo - Real Zaragoza). Para varios partidos a la vez se manda {"partidos": [partido1, partido2, ...]}
+    # curl -X POST http://127.0.0.1:8000/prediccion -d '{"id_equipo_local": 716, "id_equipo_visitante": 732, "odd_1": 3.6, "odd_x": 3,
+    #   "odd_2": 2.25, "arbitro": "Raul Martin Gonzalez Frances, Spain", "estadio": "Anxo Carro", "season": 2022,
+    #   "ids_lesionados": [2352, 47379], "ids_titulares": [15575, 47190, 46765]}'
+
+    try:
+        servicio.hilo_servidor.join()
+    except KeyboardInterrupt:
+        servicio.detener()
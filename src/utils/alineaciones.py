@@ -0,0 +1,226 @@
+import numpy as np
+import pandas as pd
+
+
+#Variables de alineación que se crean para cada lado del partido ('<variable>_local' y '<variable>_away'), ver
+#fuerza_alineaciones.variables. Con ellas el modelo no necesita una columna les-/titu- por cada jugador del histórico
+VARIABLES_ALINEACION = ['fuerza_titulares', 'fuerza_lesionados', 'lesionados', 'habituales_ausentes', 'disponibilidad']
+
+#Partidos ficticios con impacto 0 que se suman a los de cada jugador, para que el impacto de los que tienen pocos partidos no sea extremo
+PARTIDOS_SUAVIZADO = 5
+#Un jugador es titular habitual si ha sido titular en al menos esta fracción de los partidos anteriores de su equipo en la temporada...
+UMBRAL_HABITUAL = 0.5
+#...y su equipo ya ha jugado al menos estos partidos en la temporada
+MINIMO_PARTIDOS = 3
+#Fecha con la que se calculan las variables de los partidos nuevos, posterior a todo el histórico
+FECHA_FUTURA = 2**32 - 1
+
+
+def columnas_alineacion():
+    return [f'{variable}_{lado}' for lado in ['local', 'away'] for variable in VARIABLES_ALINEACION]
+
+
+def tiene_variables_alineacion(columnas):
+    '''True si columnas (de un dataset o de un modelo) tienen las variables de alineación, es decir, si el modelo usa estas
+    variables en lugar de las columnas les-/titu- de cada jugador'''
+    return set(columnas_alineacion()).issubset(columnas)
+
+
+class acumulado_previo():
+    '''Suma por clave (por ejemplo por jugador, o por equipo y temporada) de los valores de los eventos anteriores a una fecha. Los
+    eventos se ordenan una sola vez por clave y fecha y se acumulan, así que cualquier número de consultas son dos búsquedas
+    binarias vectorizadas. claves es una lista de arrays enteros (una por columna de la clave) y valores una matriz eventos x valores'''
+
+    def __init__(self, claves, fechas, valores):
+        claves = [np.asarray(columna) for columna in claves]
+        #Las claves de varias columnas se convierten en un único entero. Un MultiIndex pasa por tuplas en cada búsqueda
+        self.niveles = [np.unique(columna) for columna in claves]
+        self.combinadas, primeros, codigos = np.unique(self.combinar(claves), return_index=True, return_inverse=True)
+        self.claves = [columna[primeros] for columna in claves]
+
+        valores = np.asarray(valores, dtype=float).reshape(len(codigos), -1)
+        #Clave y fecha en un único entero: los eventos de cada clave quedan seguidos y ordenados por fecha
+        compuesto = codigos.astype(np.int64) * 2**32 + np.asarray(fechas, dtype=np.int64)
+        orden = np.argsort(compuesto, kind='stable')
+        self.compuesto = compuesto[orden]
+        self.acumulado = np.vstack([np.zeros((1, valores.shape[1])), np.cumsum(valores[orden], axis=0)])
+
+    def combinar(self, claves):
+        '''Posición de cada columna de la clave en su nivel, combinadas en un entero. -1 si algún valor no está en su nivel'''
+        n = len(claves[0])
+        combinada, conocida = np.zeros(n, dtype=np.int64), np.ones(n, dtype=bool)
+        for nivel, columna in zip(self.niveles, claves):
+            if len(nivel) == 0:
+                return np.full(n, -1, dtype=np.int64)
+            posiciones = np.minimum(np.searchsorted(nivel, columna), len(nivel) - 1)
+            conocida &= nivel[posiciones] == columna
+            combinada = combinada * len(nivel) + posiciones
+        return np.where(conocida, combinada, -1)
+
+    def codigos(self, claves):
+        '''Código de cada clave en la tabla, -1 si no tiene ningún evento'''
+        combinadas = self.combinar([np.asarray(columna) for columna in claves])
+        if len(self.combinadas) == 0:
+            return np.full(len(combinadas), -1, dtype=np.int64)
+        posiciones = np.minimum(np.searchsorted(self.combinadas, combinadas), len(self.combinadas) - 1)
+        return np.where((combinadas >= 0) & (self.combinadas[posiciones] == combinadas), posiciones, -1)
+
+    def previo(self, claves, fechas):
+        '''Suma de los valores de los eventos de cada clave con fecha estrictamente anterior a la de la consulta (0 si la clave no
+        tiene eventos)'''
+        codigos = self.codigos(claves)
+        base = np.maximum(codigos, 0).astype(np.int64) * 2**32
+        inicio = np.searchsorted(self.compuesto, base, side='left')
+        fin = np.searchsorted(self.compuesto, base + np.asarray(fechas, dtype=np.int64), side='left')
+        suma = self.acumulado[fin] - self.acumulado[inicio]
+        suma[codigos < 0] = 0
+        return suma
+
+    def total(self, claves):
+        '''Suma de los valores de todos los eventos de cada clave'''
+        return self.previo(claves, np.full(len(claves[0]), FECHA_FUTURA))
+
+    def resumen(self):
+        '''La misma tabla con un único evento por clave con el total de sus valores. Solo sirve para consultas posteriores a todo el
+        histórico, como las de los partidos nuevos, y ocupa una fila por clave en vez de una por evento'''
+        codigos = self.compuesto >> 32
+        ultimos = np.flatnonzero(np.r_[codigos[1:] != codigos[:-1], True]) if len(codigos) else np.zeros(0, dtype=int)
+        primeros = np.r_[0, ultimos[:-1] + 1] if len(codigos) else ultimos
+        totales = self.acumulado[ultimos + 1] - self.acumulado[primeros]
+        return acumulado_previo([columna[codigos[ultimos]] for columna in self.claves], self.compuesto[ultimos] & (2**32 - 1), totales)
+
+
+class fuerza_alineaciones():
+    '''Tabla por jugador con la que se calculan las variables de alineación de cualquier partido a partir de sus titulares y
+    lesionados, con búsquedas vectorizadas y solo con la información anterior al partido:
+
+    - impacto de cada jugador: diferencia de goles de su equipo en los partidos anteriores en los que fue titular, dividida entre
+      esos partidos más PARTIDOS_SUAVIZADO
+    - titularidades de cada jugador con cada equipo en cada temporada, y partidos de cada equipo en cada temporada, para saber qué
+      fracción de los partidos de su equipo ha sido titular (y si es titular habitual)
+    - plantillas: jugadores que han sido titulares con cada equipo en cada temporada
+
+    Las alineaciones y los lesionados no dicen de qué equipo es cada jugador. Se asigna al lado (local o visitante) con cuyo equipo
+    ha aparecido más veces esa temporada o, si empatan, en todo el histórico, contando solo los partidos anteriores (ver
+    lado_jugadores). Se crea con desde_historico y
+    para predecir se guarda en el feature_store su resumen, que es una fila por jugador y equipo'''
+
+    def __init__(self, impacto, titularidades, partidos_equipo, plantillas, apariciones_temporada, apariciones_total):
+        self.impacto = impacto
+        self.titularidades = titularidades
+        self.partidos_equipo = partidos_equipo
+        self.plantillas = plantillas
+        self.apariciones_temporada = apariciones_temporada
+        self.apariciones_total = apariciones_total
+
+    @classmethod
+    def desde_historico(cls, partidos, apariciones):
+        '''partidos tiene una fila por partido con id_equipo_local, id_equipo_visitante, season, fecha_timestamp, goles_local y
+        goles_visitante. apariciones tiene una fila por jugador titular o lesionado en cada partido: fila (posición del partido en
+        partidos), id_jugador y titular (False si está lesionado)'''
+        filas = apariciones['fila'].to_numpy()
+        jugadores = apariciones['id_jugador'].to_numpy()
+        local, visitante, season, fechas = [partidos[columna].to_numpy() for columna in
+                                             ['id_equipo_local', 'id_equipo_visitante', 'season', 'fecha_timestamp']]
+
+        #Cada aparición cuenta para los dos equipos del partido. El equipo del jugador aparece en todos sus partidos y los rivales cambian.
+        #Con la fecha de cada partido, para que el lado de una aparición solo dependa de los partidos anteriores
+        candidatos_jugador, candidatos_equipo = np.tile(jugadores, 2), np.r_[local[filas], visitante[filas]]
+        candidatos_season, candidatos_fecha, unos = np.tile(season[filas], 2), np.tile(fechas[filas], 2), np.ones(2 * len(filas))
+        apariciones_temporada = acumulado_previo([candidatos_jugador, candidatos_season, candidatos_equipo], candidatos_fecha, unos)
+        apariciones_total = acumulado_previo([candidatos_jugador, candidatos_equipo], candidatos_fecha, unos)
+        tabla = cls(None, None, None, None, apariciones_temporada, apariciones_total)
+
+        #Titularidades de cada jugador con el lado que se le asigna
+        lados = tabla.lado_jugadores(filas, jugadores, local, visitante, season, fechas)
+        titulares = apariciones['titular'].to_numpy(dtype=bool) & (lados >= 0)
+        filas, jugadores, lados = filas[titulares], jugadores[titulares], lados[titulares]
+        equipos = np.where(lados == 0, local[filas], visitante[filas])
+        diferencia = (partidos['goles_local'].to_numpy(dtype=float) - partidos['goles_visitante'].to_numpy(dtype=float))[filas]
+        diferencia = np.where(lados == 0, diferencia, -diferencia)
+
+        tabla.impacto = acumulado_previo([jugadores], fechas[filas], np.c_[diferencia, np.ones(len(filas))])
+        tabla.titularidades = acumulado_previo([jugadores, equipos, season[filas]], fechas[filas], np.ones(len(filas)))
+        tabla.partidos_equipo = acumulado_previo([np.r_[local, visitante], np.r_[season, season]], np.r_[fechas, fechas],
+                                                 np.ones(2 * len(partidos)))
+        tabla.plantillas = pd.DataFrame({'id_jugador': jugadores, 'id_equipo': equipos, 'season': season[filas]}).drop_duplicates()
+        return tabla
+
+    def resumen(self):
+        '''Copia con las tablas acumuladas reducidas a su total por clave, para guardar en el feature_store y calcular las variables
+        de partidos posteriores a todo el histórico'''
+        return fuerza_alineaciones(self.impacto.resumen(), self.titularidades.resumen(), self.partidos_equipo.resumen(),
+                                   self.plantillas, self.apariciones_temporada.resumen(), self.apariciones_total.resumen())
+
+    def lado_jugadores(self, filas, jugadores, local, visitante, season, fechas):
+        '''Lado de cada aparición (0 local, 1 visitante): el del equipo con el que el jugador ha aparecido más veces esa temporada
+        y, si empatan, en todo el histórico, en los partidos anteriores a la fecha del partido. El propio partido cuenta igual para
+        los dos equipos, así que no cambia el lado. -1 si tampoco así se puede saber (por ejemplo el primer partido de un jugador)'''
+        fecha = fechas[filas]
+        temporada_local = self.apariciones_temporada.previo([jugadores, season[filas], local[filas]], fecha)[:, 0]
+        temporada_visitante = self.apariciones_temporada.previo([jugadores, season[filas], visitante[filas]], fecha)[:, 0]
+        total_local = self.apariciones_total.previo([jugadores, local[filas]], fecha)[:, 0]
+        total_visitante = self.apariciones_total.previo([jugadores, visitante[filas]], fecha)[:, 0]
+        return np.select([temporada_local > temporada_visitante, temporada_local < temporada_visitante,
+                          total_local > total_visitante, total_local < total_visitante], [0, 1, 0, 1], default=-1)
+
+    def variables(self, partidos, apariciones):
+        '''Variables de alineación de cada partido de partidos (id_equipo_local, id_equipo_visitante, season y fecha_timestamp), con
+        sus titulares y lesionados en apariciones (fila, id_jugador, titular). Para cada lado:
+
+        - fuerza_titulares: impacto medio de sus titulares
+        - fuerza_lesionados: suma del impacto de sus lesionados
+        - lesionados: número de lesionados
+        - habituales_ausentes: titulares habituales de su equipo en la temporada que no son titulares en el partido
+        - disponibilidad: fracción de las titularidades habituales de su equipo que suman los titulares del partido (la suma de la
+          fracción de partidos en los que ha sido titular cada uno entre la de toda la plantilla)
+
+        Devuelve un dataframe con una fila por partido y las columnas de columnas_alineacion()'''
+        n = len(partidos)
+        local, visitante, season, fechas = [partidos[columna].to_numpy() for columna in
+                                             ['id_equipo_local', 'id_equipo_visitante', 'season', 'fecha_timestamp']]
+        filas = apariciones['fila'].to_numpy(dtype=np.int64)
+        jugadores = apariciones['id_jugador'].to_numpy()
+        titular = apariciones['titular'].to_numpy(dtype=bool)
+
+        #Cada partido tiene dos grupos (equipo del partido), 2 * fila + lado
+        lados = self.lado_jugadores(filas, jugadores, local, visitante, season, fechas)
+        conocidos = lados >= 0
+        filas, jugadores, titular, lados = filas[conocidos], jugadores[conocidos], titular[conocidos], lados[conocidos]
+        grupos = 2 * filas + lados
+        equipos_grupo = np.c_[local, visitante].ravel()
+        season_grupo, fechas_grupo = np.repeat(season, 2), np.repeat(fechas, 2)
+
+        suma, partidos_jugador = self.impacto.previo([jugadores], fechas[filas]).T
+        impacto = suma / (partidos_jugador + PARTIDOS_SUAVIZADO)
+        #Sin NaN, que no acepta la PCA del pipeline: sin titulares conocidos la fuerza es 0 (un jugador sin histórico)
+        n_titulares = np.bincount(grupos[titular], minlength=2 * n)
+        fuerza_titulares = np.bincount(grupos[titular], impacto[titular], minlength=2 * n) / np.maximum(n_titulares, 1)
+        fuerza_lesionados = np.bincount(grupos[~titular], impacto[~titular], minlength=2 * n)
+        lesionados = np.bincount(grupos[~titular], minlength=2 * n)
+
+        #Plantilla de cada grupo con la fracción de partidos anteriores de la temporada en los que ha sido titular cada jugador
+        df_grupos = pd.DataFrame({'grupo': np.arange(2 * n), 'id_equipo': equipos_grupo, 'season': season_grupo})
+        df_plantilla = df_grupos.merge(self.plantillas, on=['id_equipo', 'season'])
+        grupo_plantilla = df_plantilla['grupo'].to_numpy()
+        partidos_previos = self.partidos_equipo.previo([equipos_grupo, season_grupo], fechas_grupo)[:, 0]
+        titularidades = self.titularidades.previo([df_plantilla['id_jugador'].to_numpy(), df_plantilla['id_equipo'].to_numpy(),
+                                                   df_plantilla['season'].to_numpy()], fechas_grupo[grupo_plantilla])[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraccion = np.nan_to_num(titularidades / partidos_previos[grupo_plantilla])
+        habitual = (fraccion >= UMBRAL_HABITUAL) & (partidos_previos[grupo_plantilla] >= MINIMO_PARTIDOS)
+
+        #Jugadores de la plantilla que son titulares en el partido
+        titulares_grupo = acumulado_previo([grupos[titular], jugadores[titular]], np.zeros(titular.sum()), np.ones(titular.sum()))
+        es_titular = titulares_grupo.codigos([grupo_plantilla, df_plantilla['id_jugador'].to_numpy()]) >= 0
+        habituales_ausentes = np.bincount(grupo_plantilla, habitual & ~es_titular, minlength=2 * n)
+        #Sin titularidades previas en la temporada (sus primeros partidos) no falta nadie: disponibilidad 1
+        habituales = np.bincount(grupo_plantilla, fraccion, minlength=2 * n)
+        disponibles = np.bincount(grupo_plantilla, fraccion * es_titular, minlength=2 * n)
+        disponibilidad = np.where(habituales > 0, disponibles / np.where(habituales > 0, habituales, 1), 1.0)
+
+        valores = {'fuerza_titulares': fuerza_titulares, 'fuerza_lesionados': fuerza_lesionados, 'lesionados': lesionados,
+                   'habituales_ausentes': habituales_ausentes, 'disponibilidad': disponibilidad}
+        return pd.DataFrame({f'{variable}_{lado}': valores[variable].reshape(n, 2)[:, posicion].astype(float)
+                             for posicion, lado in enumerate(['local', 'away']) for variable in VARIABLES_ALINEACION},
+                            index=partidos.index)
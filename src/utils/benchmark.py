@@ -0,0 +1,399 @@
+import gc
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from utils.functions import ESTADISTICAS, data_processing
+from utils.instrumentacion import dimensiones, memoria_rss_mb, pico_memoria_mb, reiniciar_pico_memoria
+from utils.lectura import leer_csv
+
+
+#Escalas respecto a los datos actuales (unos 7.000 partidos y 15.000 jugadores en el diccionario)
+ESCALAS = (1, 10, 100)
+
+#Etapas que se miden, en orden, con las etapas de cuya salida depende cada una
+ETAPAS = {'lectura': [],
+          'procesado_datos_generales': ['lectura'],
+          'procesado_estadisticas': ['lectura'],
+          'procesado_lesionados': ['lectura'],
+          'procesado_titulares': ['lectura'],
+          'procesado_cuotas': ['lectura'],
+          'creacion_df_final': ['procesado_datos_generales', 'procesado_estadisticas', 'procesado_lesionados', 'procesado_titulares',
+                                'procesado_cuotas'],
+          'creacion_nuevas_variables': ['creacion_df_final'],
+          'fuga_variables_alineacion': ['creacion_nuevas_variables'],
+          'creacion_datos_nuevos': ['creacion_nuevas_variables'],
+          'train_xgbc': ['creacion_nuevas_variables'],
+          'prediccion_modelo': ['train_xgbc', 'creacion_datos_nuevos']}
+
+#Una sola combinación de hiperparámetros: el benchmark mide cómo escala un ajuste, no la búsqueda completa
+PARAMETROS_BENCHMARK = {
+    'pca__n_components': [25],
+    'xgb__n_estimators': [100],
+    'xgb__learning_rate': [0.1],
+    'xgb__max_depth': [6],
+    'xgb__subsample': [0.8],
+    'xgb__colsample_bytree': [0.6]
+}
+
+#Grid pequeño para comparar repartos de núcleos (train_model.comparar_recursos): 8 candidatos x 3 folds = 24 ajustes, suficientes
+#para ocupar varios procesos
+PARAMETROS_RECURSOS = {**PARAMETROS_BENCHMARK,
+                       'xgb__max_depth': [4, 6],
+                       'xgb__subsample': [0.6, 0.8],
+                       'xgb__colsample_bytree': [0.5, 0.6]}
+
+#Medias de las estadísticas de cada equipo en un partido, para generarlas con una Poisson
+MEDIAS_ESTADISTICAS = {'shots_on_goal': 4.3, 'shots_off_goal': 5.0, 'blocked_shots': 2.8, 'fouls': 13.5, 'corners': 4.8,
+                       'offsides': 2.0, 'yellow_cards': 2.6, 'red_cards': 0.12, 'goalkeeper_saves': 3.0}
+
+
+def generar_datos_sinteticos(ruta, escala=1, semilla=0, temporadas=range(2014, 2023), equipos_liga=20, plantilla=40,
+                             renovacion=0.3):
+    '''Genera en la carpeta ruta los mismos archivos en bruto que data/raw_files (datos_generales_fx, df_estadisticas,
+    datos_alineaciones, datos_lesionados, df_dicc_equipos, df_diccionario_jugadores y Cuotas/<liga>-<temporada>.csv), con las
+    mismas columnas y los mismos defectos que devuelve la API: nulos en vez de ceros, posesión como '64%', tarjetas como texto
+    con algún valor erróneo, partidos sin árbitro ni estadísticas, etc.
+
+    Con escala=1 hay 2 ligas de equipos_liga equipos a doble vuelta durante las temporadas dadas (unos 7.000 partidos) y
+    plantillas de plantilla jugadores por equipo y temporada (unas 15.000 filas en el diccionario), de las que cada temporada
+    se renueva la fracción renovacion. Cada escala multiplica el número de ligas, y con él partidos, equipos y jugadores.
+    Devuelve un diccionario con el tamaño de los datos generados, que también se guarda en ruta/metadatos.json'''
+    rng = np.random.default_rng(semilla)
+    temporadas = list(temporadas)
+    n_ligas = 2 * escala
+    os.makedirs(os.path.join(ruta, 'Cuotas'), exist_ok=True)
+
+    #Equipos: cada liga tiene siempre los mismos equipos, con un nivel que decide los resultados y las cuotas
+    ids_equipos = 1000 + np.arange(n_ligas * equipos_liga)
+    nivel_equipo = dict(zip(ids_equipos, rng.normal(0, 0.35, len(ids_equipos))))
+    pd.DataFrame({'equipo_jugador': [f'Equipo {id_equipo}' for id_equipo in ids_equipos],
+                  'id_equipo': ids_equipos}).to_csv(os.path.join(ruta, 'df_dicc_equipos.csv'), index=False)
+
+    #Plantillas por equipo y temporada: cada temporada se sustituye una parte de la plantilla por jugadores nuevos
+    siguiente_id = 1
+    plantillas = {}
+    for id_equipo in ids_equipos:
+        jugadores = np.arange(siguiente_id, siguiente_id + plantilla)
+        siguiente_id += plantilla
+        for temporada in temporadas:
+            plantillas[(id_equipo, temporada)] = jugadores
+            n_nuevos = int(round(plantilla * renovacion))
+            salen = rng.choice(plantilla, n_nuevos, replace=False)
+            jugadores = jugadores.copy()
+            jugadores[salen] = np.arange(siguiente_id, siguiente_id + n_nuevos)
+            siguiente_id += n_nuevos
+    claves = list(plantillas)
+    matriz_plantillas = np.stack([plantillas[clave] for clave in claves])
+    posicion_plantilla = {clave: i for i, clave in enumerate(claves)}
+    pd.DataFrame({'id_jugador': matriz_plantillas.ravel(),
+                  'nombre_jugador': [f'Jugador {id_jugador}' for id_jugador in matriz_plantillas.ravel()],
+                  'equipo_jugador': np.repeat([f'Equipo {id_equipo}' for id_equipo, _ in claves], plantilla),
+                  'id_equipo': np.repeat([id_equipo for id_equipo, _ in claves], plantilla),
+                  'temporada_equipo': np.repeat([temporada for _, temporada in claves], plantilla)}).to_csv(
+        os.path.join(ruta, 'df_diccionario_jugadores.csv'), index=False)
+
+    #Calendario: todos contra todos a doble vuelta en cada liga y temporada, repartido entre agosto y mayo
+    local, visitante = np.meshgrid(np.arange(equipos_liga), np.arange(equipos_liga), indexing='ij')
+    distintos = local != visitante
+    local, visitante = local[distintos], visitante[distintos]
+    partidos = []
+    for liga in range(n_ligas):
+        equipos = ids_equipos[liga * equipos_liga:(liga + 1) * equipos_liga]
+        for temporada in temporadas:
+            inicio = datetime(temporada, 8, 12, tzinfo=timezone.utc).timestamp()
+            fechas = np.sort(inicio + rng.uniform(0, 290 * 86400, len(local))).astype(np.int64) // 900 * 900
+            orden = rng.permutation(len(local))
+            partidos.append(pd.DataFrame({'liga': f'L{liga:03d}', 'id_equipo_local': equipos[local[orden]],
+                                          'id_equipo_visitante': equipos[visitante[orden]], 'fecha_timestamp': fechas,
+                                          'season': temporada}))
+    df_partidos = pd.concat(partidos, ignore_index=True)
+    n = len(df_partidos)
+    df_partidos['fixture_id'] = 100000 + np.arange(n)
+
+    #Resultados con ventaja de campo y el nivel de cada equipo
+    diferencia = df_partidos['id_equipo_local'].map(nivel_equipo).to_numpy() - df_partidos['id_equipo_visitante'].map(nivel_equipo).to_numpy()
+    media_local, media_visitante = np.exp(0.3 + diferencia / 2), np.exp(0.1 - diferencia / 2)
+    goles_local, goles_visitante = rng.poisson(media_local), rng.poisson(media_visitante)
+    df_partidos['goles_local'], df_partidos['goles_visitante'] = goles_local, goles_visitante
+    df_partidos['resultado'] = np.select([goles_local > goles_visitante, goles_local < goles_visitante], [1, 2], 0)
+    #Algún partido del que la API no devuelve ni árbitro ni estadísticas
+    sin_datos = rng.random(n) < 0.003
+    arbitros = np.array([f'Arbitro {i}' for i in range(65 * n_ligas)], dtype=object)
+    df_partidos['arbitro'] = np.where(sin_datos, None, arbitros[rng.integers(0, len(arbitros), n)])
+    df_partidos['goles_descanso_local'] = np.where(rng.random(n) < 0.003, np.nan, rng.binomial(goles_local, 0.45))
+    df_partidos['goles_descanso_visitante'] = np.where(rng.random(n) < 0.003, np.nan, rng.binomial(goles_visitante, 0.45))
+    df_partidos['estadio'] = 'Estadio ' + df_partidos['id_equipo_local'].astype(str)
+    df_partidos[['id_equipo_local', 'id_equipo_visitante', 'goles_local', 'goles_visitante', 'resultado', 'arbitro', 'fixture_id',
+                 'fecha_timestamp', 'goles_descanso_local', 'goles_descanso_visitante', 'estadio', 'season']].to_csv(
+        os.path.join(ruta, 'datos_generales_fx.csv'), index=False)
+
+    #Estadísticas: la API devuelve null cuando el valor es 0, y además falta alguna estadística suelta
+    estadisticas = {}
+    for lado, ventaja in [('local', 1.1), ('away', 0.9)]:
+        for estadistica, media in MEDIAS_ESTADISTICAS.items():
+            estadisticas[f'{estadistica}_{lado}'] = rng.poisson(media * ventaja, n).astype(float)
+        estadisticas[f'total_shots_{lado}'] = (estadisticas[f'shots_on_goal_{lado}'] + estadisticas[f'shots_off_goal_{lado}'] +
+                                               estadisticas[f'blocked_shots_{lado}'])
+        estadisticas[f'shots_insidebox_{lado}'] = rng.binomial(estadisticas[f'total_shots_{lado}'].astype(int), 0.62).astype(float)
+        estadisticas[f'shots_outsidebox_{lado}'] = estadisticas[f'total_shots_{lado}'] - estadisticas[f'shots_insidebox_{lado}']
+        estadisticas[f'pass_precision_{lado}'] = np.round(rng.normal(400 * ventaja, 80, n)).clip(150)
+    df_estadisticas = pd.DataFrame({columna: np.where((valores == 0) | (rng.random(n) < 0.02), np.nan, valores)
+                                    for columna, valores in estadisticas.items()})
+    posesion = np.round(rng.normal(50, 9, n)).clip(20, 80).astype(int)
+    sin_posesion = rng.random(n) < 0.13
+    df_estadisticas['ball_possession_local'] = np.where(sin_posesion, None, pd.Series(posesion).astype(str) + '%')
+    df_estadisticas['ball_possession_away'] = np.where(sin_posesion, None, pd.Series(100 - posesion).astype(str) + '%')
+    for lado in ['local', 'away']:
+        tarjetas = df_estadisticas[f'yellow_cards_{lado}']
+        tarjetas = tarjetas.map(lambda valor: None if np.isnan(valor) else str(int(valor))).astype(object)
+        #Algún valor erróneo con porcentaje, que procesado_estadisticas elimina
+        tarjetas[rng.random(n) < 0.0005] = '5%'
+        df_estadisticas[f'yellow_cards_{lado}'] = tarjetas
+    df_estadisticas.loc[sin_datos, :] = np.nan
+    df_estadisticas['fixture_id_2'] = df_partidos['fixture_id']
+    columnas = [f'{estadistica}_{lado}' for estadistica in ESTADISTICAS[:-1] for lado in ['local', 'away']]
+    df_estadisticas[columnas + ['pass_precision_local', 'pass_precision_away', 'fixture_id_2']].to_csv(
+        os.path.join(ruta, 'df_estadisticas.csv'), index=False)
+
+    #Alineaciones: 11 titulares de la plantilla de cada equipo en esa temporada
+    filas_local = np.array([posicion_plantilla[clave] for clave in zip(df_partidos['id_equipo_local'], df_partidos['season'])])
+    filas_visitante = np.array([posicion_plantilla[clave] for clave in zip(df_partidos['id_equipo_visitante'], df_partidos['season'])])
+    titulares = []
+    for filas in [filas_local, filas_visitante]:
+        elegidos = np.argpartition(rng.random((n, plantilla)), 11, axis=1)[:, :11]
+        titulares.append(matriz_plantillas[filas[:, None], elegidos])
+    titulares = np.concatenate(titulares, axis=1)
+    pd.DataFrame({'fixture_id': np.repeat(df_partidos['fixture_id'].to_numpy(), 22),
+                  'id_jugador_titular': titulares.ravel().astype(float),
+                  'name_jugador_titular': [f'Jugador {id_jugador}' for id_jugador in titulares.ravel()]}).to_csv(
+        os.path.join(ruta, 'datos_alineaciones.csv'), index=False)
+
+    #Lesionados: solo se tienen de uno de cada diez partidos, y de esos unos 7 por partido entre los dos equipos
+    con_lesionados = np.flatnonzero(rng.random(n) < 0.1)
+    n_lesionados = rng.poisson(7, len(con_lesionados)).clip(1, plantilla)
+    partidos_lesionados = np.repeat(con_lesionados, n_lesionados)
+    lado_visitante = rng.random(len(partidos_lesionados)) < 0.5
+    filas = np.where(lado_visitante, filas_visitante[partidos_lesionados], filas_local[partidos_lesionados])
+    lesionados = matriz_plantillas[filas, rng.integers(0, plantilla, len(filas))]
+    df_lesionados = pd.DataFrame({'fixture_id': df_partidos['fixture_id'].to_numpy()[partidos_lesionados], 'id_lesionado': lesionados,
+                                  'name_lesionado': [f'Jugador {id_jugador}' for id_jugador in lesionados]})
+    df_lesionados.drop_duplicates(subset=['fixture_id', 'id_lesionado']).to_csv(os.path.join(ruta, 'datos_lesionados.csv'), index=False)
+
+    #Cuotas de Bet365 a partir de las probabilidades de cada resultado, un archivo por liga y temporada
+    prob_local = 1 / (1 + np.exp(-(0.35 + 1.6 * diferencia)))
+    prob_empate = 0.27 * np.exp(-np.abs(diferencia))
+    prob_local = prob_local * (1 - prob_empate)
+    prob_visitante = 1 - prob_local - prob_empate
+    margen = 1.05
+    df_cuotas = pd.DataFrame({'Div': df_partidos['liga'],
+                              'Date': pd.to_datetime(df_partidos['fecha_timestamp'], unit='s').dt.strftime('%d/%m/%Y'),
+                              'HomeTeam': 'Equipo ' + df_partidos['id_equipo_local'].astype(str),
+                              'AwayTeam': 'Equipo ' + df_partidos['id_equipo_visitante'].astype(str),
+                              'FTHG': goles_local, 'FTAG': goles_visitante,
+                              'FTR': np.select([goles_local > goles_visitante, goles_local < goles_visitante], ['H', 'A'], 'D'),
+                              'B365H': np.round(1 / (prob_local * margen), 2), 'B365D': np.round(1 / (prob_empate * margen), 2),
+                              'B365A': np.round(1 / (prob_visitante * margen), 2), 'season': df_partidos['season']})
+    for (liga, temporada), df_archivo in df_cuotas.groupby(['Div', 'season']):
+        df_archivo.drop(columns='season').to_csv(os.path.join(ruta, 'Cuotas', f'{liga}-{temporada}.csv'), index=False)
+
+    metadatos = {'escala': escala, 'semilla': semilla, 'n_partidos': n, 'n_equipos': len(ids_equipos),
+                 'n_filas_diccionario_jugadores': int(matriz_plantillas.size), 'n_jugadores': int(siguiente_id - 1),
+                 'n_titulares': int(titulares.size), 'n_lesionados': len(df_lesionados)}
+    with open(os.path.join(ruta, 'metadatos.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(metadatos, archivo, indent=2)
+    return metadatos
+
+
+def entorno():
+    '''Versiones y máquina en la que se ejecuta el benchmark, para poder comparar resultados'''
+    import scipy
+    import sklearn
+    import xgboost
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'fecha': datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'scipy': scipy.__version__, 'sklearn': sklearn.__version__,
+            'xgboost': xgboost.__version__, 'sistema': platform.platform(), 'n_cpus': os.cpu_count(),
+            'pico_memoria_por_etapa': reiniciar_pico_memoria()}
+
+
+class benchmark():
+    '''Mide el tiempo y la memoria de cada etapa del pipeline (ETAPAS) con datos sintéticos a varias escalas, sin conexión a la
+    API. Los datos de cada escala se generan una vez en ruta_datos/x<escala> con generar_datos_sinteticos y se reutilizan en
+    las siguientes ejecuciones. Por cada escala y etapa se guarda el tiempo real, el tiempo de CPU, el pico de memoria residente
+    durante la etapa (por encima de la memoria al empezarla) y las filas y columnas de su salida. Los resultados se escriben en
+    ruta_resultados (JSON) después de cada etapa, así que si una escala se queda sin memoria se conservan los anteriores. El
+    tiempo de CPU y la memoria son los del proceso principal, sin los procesos que lance joblib. Con recursos=True, en cada escala
+    se comparan además los repartos de núcleos entre procesos e hilos de XGBoost (repartos, por defecto los de
+    train_model.comparar_recursos) con PARAMETROS_RECURSOS, y los ajustes por hora de cada uno se guardan en el apartado recursos del JSON'''
+
+    def __init__(self, ruta_resultados='data/benchmark/resultados.json', ruta_datos='data/benchmark', semilla=0, etapas=None,
+                 parametros=None, recursos=False, repartos=None):
+        self.ruta_resultados = ruta_resultados
+        self.ruta_datos = ruta_datos
+        self.semilla = semilla
+        #Las etapas pedidas y todas aquellas de las que dependen
+        necesarias = set(ETAPAS if etapas is None else etapas)
+        pendientes = list(necesarias)
+        while pendientes:
+            for entrada in ETAPAS[pendientes.pop()]:
+                if entrada not in necesarias:
+                    necesarias.add(entrada)
+                    pendientes.append(entrada)
+        self.etapas = [etapa for etapa in ETAPAS if etapa in necesarias]
+        self.parametros = PARAMETROS_BENCHMARK if parametros is None else parametros
+        self.resultados = []
+        self.recursos = recursos
+        self.repartos = repartos
+        self.resultados_recursos = []
+        self.entorno = entorno()
+
+    def datos(self, escala):
+        ruta = os.path.join(self.ruta_datos, f'x{escala}')
+        if not os.path.exists(os.path.join(ruta, 'metadatos.json')):
+            generar_datos_sinteticos(ruta, escala, self.semilla)
+        with open(os.path.join(ruta, 'metadatos.json'), encoding='utf-8') as archivo:
+            return ruta, json.load(archivo)
+
+    def medir(self, escala, etapa, funcion):
+        '''Ejecuta funcion midiendo su tiempo y memoria, añade el resultado y lo guarda. Si falla se guarda el error y devuelve None'''
+        gc.collect()
+        reiniciar_pico_memoria()
+        memoria_inicial = memoria_rss_mb()
+        inicio, inicio_cpu = time.perf_counter(), time.process_time()
+        error, salida = None, None
+        try:
+            salida = funcion()
+        except (Exception, MemoryError) as excepcion:
+            error = f'{type(excepcion).__name__}: {excepcion}'
+        tiempo, tiempo_cpu = time.perf_counter() - inicio, time.process_time() - inicio_cpu
+        pico = pico_memoria_mb()
+        filas, columnas = dimensiones(salida)
+
+        self.resultados.append({'escala': escala, 'etapa': etapa, 'tiempo_s': round(tiempo, 4), 'tiempo_cpu_s': round(tiempo_cpu, 4),
+                                'memoria_pico_mb': round(pico - memoria_inicial, 1), 'memoria_pico_total_mb': round(pico, 1),
+                                'filas': filas, 'columnas': columnas, 'error': error})
+        self.guardar()
+        return salida
+
+    def ejecutar_escala(self, escala):
+        '''Ejecuta todas las etapas con los datos de la escala dada. Una etapa cuyas entradas han fallado se marca como no ejecutada'''
+        from utils.train import train_model
+
+        ruta, metadatos = self.datos(escala)
+        processing, entrenamiento = data_processing(), train_model()
+        salidas = {}
+
+        def lectura():
+            return {'datos_generales': leer_csv(os.path.join(ruta, 'datos_generales_fx.csv')),
+                    'estadisticas': leer_csv(os.path.join(ruta, 'df_estadisticas.csv')),
+                    'alineaciones': leer_csv(os.path.join(ruta, 'datos_alineaciones.csv')),
+                    'lesionados': leer_csv(os.path.join(ruta, 'datos_lesionados.csv')),
+                    'equipos': leer_csv(os.path.join(ruta, 'df_dicc_equipos.csv'))}
+
+        def procesado_cuotas():
+            equipos = salidas['lectura']['equipos']['equipo_jugador']
+            return processing.procesado_cuotas(sorted(glob.glob(os.path.join(ruta, 'Cuotas', '*.csv'))), salidas['lectura']['equipos'],
+                                               ruta_cache=None, equivalencias=dict(zip(equipos, equipos)))
+
+        def creacion_df_final():
+            return processing.creacion_df_final(df_lesionados=salidas['procesado_lesionados'],
+                                                df_alineaciones=salidas['procesado_titulares'],
+                                                df_datos_partidos=salidas['procesado_datos_generales'],
+                                                df_estadisticas=salidas['procesado_estadisticas'],
+                                                df_cuotas=salidas['procesado_cuotas'])
+
+        def fuga_variables_alineacion():
+            #Las variables de alineación de un partido no pueden cambiar al añadir partidos posteriores. Si cambian, la etapa falla y
+            #comparar_resultados la marca como regresión
+            comparacion = processing.fuga_variables_alineacion(salidas['creacion_nuevas_variables'])
+            if comparacion['filas_distintas'].sum() > 0:
+                raise ValueError(f'Variables de alineación que usan partidos posteriores:\n{comparacion.to_string(index=False)}')
+            return comparacion
+
+        def creacion_datos_nuevos():
+            #El último partido del histórico, con los titulares y lesionados que tuvo
+            df_final = salidas['creacion_nuevas_variables']
+            partido = df_final.iloc[-1]
+            alineaciones, lesionados = salidas['lectura']['alineaciones'], salidas['lectura']['lesionados']
+            ids_titulares = alineaciones.loc[alineaciones['fixture_id'] == partido['fixture_id'], 'id_jugador_titular']
+            ids_lesionados = lesionados.loc[lesionados['fixture_id'] == partido['fixture_id'], 'id_lesionado']
+            return processing.creacion_datos_nuevos(df_final, partido['id_equipo_local'], partido['id_equipo_visitante'],
+                                                    partido['odd_1'], partido['odd_x'], partido['odd_2'], partido['arbitro'],
+                                                    partido['estadio'], partido['season'], ids_lesionados, ids_titulares)
+
+        funciones = {
+            'lectura': lectura,
+            'procesado_datos_generales': lambda: processing.procesado_datos_generales(salidas['lectura']['datos_generales'].copy()),
+            'procesado_estadisticas': lambda: processing.procesado_estadisticas(salidas['lectura']['estadisticas'].copy()),
+            'procesado_lesionados': lambda: processing.procesado_lesionados(salidas['lectura']['lesionados']),
+            'procesado_titulares': lambda: processing.procesado_titulares(salidas['lectura']['alineaciones']),
+            'procesado_cuotas': procesado_cuotas,
+            'creacion_df_final': creacion_df_final,
+            'creacion_nuevas_variables': lambda: processing.creacion_nuevas_variables(salidas['creacion_df_final']),
+            'fuga_variables_alineacion': fuga_variables_alineacion,
+            'creacion_datos_nuevos': creacion_datos_nuevos,
+            'train_xgbc': lambda: entrenamiento.train_xgbc(salidas['creacion_nuevas_variables'], guardar=False, parametros=self.parametros),
+            'prediccion_modelo': lambda: entrenamiento.prediccion_modelo_lote(salidas['train_xgbc'], salidas['creacion_datos_nuevos'])
+        }
+
+        for etapa in self.etapas:
+            faltan = [entrada for entrada in ETAPAS[etapa] if salidas.get(entrada) is None]
+            if faltan:
+                self.resultados.append({'escala': escala, 'etapa': etapa, 'error': f'No ejecutada, faltan las salidas de {faltan}'})
+                self.guardar()
+                continue
+            salidas[etapa] = self.medir(escala, etapa, funciones[etapa])
+
+        if self.recursos and salidas.get('creacion_nuevas_variables') is not None:
+            comparacion = entrenamiento.comparar_recursos(salidas['creacion_nuevas_variables'], self.repartos, parametros=PARAMETROS_RECURSOS)
+            self.resultados_recursos.extend({'escala': escala, **fila} for fila in comparacion.to_dict('records'))
+            self.guardar()
+
+        return metadatos
+
+    def ejecutar(self, escalas=ESCALAS):
+        '''Ejecuta todas las escalas y devuelve los resultados como dataframe (una fila por escala y etapa)'''
+        self.metadatos_escalas = {}
+        for escala in escalas:
+            self.metadatos_escalas[escala] = self.ejecutar_escala(escala)
+        self.guardar()
+        return pd.DataFrame(self.resultados)
+
+    def guardar(self):
+        os.makedirs(os.path.dirname(self.ruta_resultados) or '.', exist_ok=True)
+        ruta_temporal = f'{self.ruta_resultados}.tmp'
+        with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({'entorno': self.entorno, 'datos': getattr(self, 'metadatos_escalas', {}), 'resultados': self.resultados,
+                       'recursos': self.resultados_recursos}, archivo, indent=2, default=str)
+        os.replace(ruta_temporal, self.ruta_resultados)
+
+
+def cargar_resultados(ruta):
+    with open(ruta, encoding='utf-8') as archivo:
+        return pd.DataFrame(json.load(archivo)['resultados'])
+
+
+def comparar_resultados(ruta_referencia, ruta_nueva, tolerancia=0.2, tiempo_minimo=0.5, memoria_minima=10):
+    '''Compara dos archivos de resultados del benchmark por escala y etapa. Devuelve el cociente nuevo/referencia de tiempo y de
+    memoria, y marca como regresión las etapas que han empeorado más de tolerancia (0.2 = un 20 %) o que ahora fallan. Las
+    etapas que tardan menos de tiempo_minimo segundos o usan menos de memoria_minima MB no cuentan, su variación es ruido'''
+    columnas = ['escala', 'etapa', 'tiempo_s', 'memoria_pico_mb', 'error']
+    referencia = cargar_resultados(ruta_referencia).reindex(columns=columnas)
+    nueva = cargar_resultados(ruta_nueva).reindex(columns=columnas)
+    df = referencia.merge(nueva, on=['escala', 'etapa'], how='outer', suffixes=('_referencia', '_nueva'))
+
+    df['ratio_tiempo'] = df['tiempo_s_nueva'] / df['tiempo_s_referencia']
+    df['ratio_memoria'] = df['memoria_pico_mb_nueva'] / df['memoria_pico_mb_referencia']
+    df['regresion'] = (((df['ratio_tiempo'] > 1 + tolerancia) & (df['tiempo_s_nueva'] >= tiempo_minimo)) |
+                       ((df['ratio_memoria'] > 1 + tolerancia) & (df['memoria_pico_mb_nueva'] >= memoria_minima)) |
+                       (df['error_nueva'].notna() & df['error_referencia'].isna()))
+    return df
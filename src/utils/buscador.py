@@ -0,0 +1,113 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+
+def normalizar_nombre(nombre):
+    '''Nombre sin acentos, en minúsculas y con cualquier signo de puntuación cambiado por un único espacio'''
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', unidecode(str(nombre)).lower()).split())
+
+
+def trigramas(nombre_normalizado):
+    '''Trigramas del nombre con relleno al principio y al final, así las consultas de una o dos letras también tienen trigramas
+    y los que empiezan igual comparten los trigramas del inicio'''
+    relleno = f'  {nombre_normalizado} '
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+class indice_nombres():
+    '''Índice de trigramas sobre una lista de nombres. Cada nombre va asociado a un valor (su id o su nombre original). Las consultas
+    se puntúan con la similitud de Dice entre trigramas, más una bonificación si el nombre es igual a la consulta, empieza por ella
+    (o alguna de sus palabras) o la contiene'''
+
+    def __init__(self, nombres, valores):
+        self.nombres = list(nombres)
+        self.valores = list(valores)
+        self.normalizados = [normalizar_nombre(nombre) for nombre in self.nombres]
+
+        posiciones_trigrama = {}
+        self.n_trigramas = np.empty(len(self.nombres), dtype=np.int32)
+        for posicion, normalizado in enumerate(self.normalizados):
+            trigramas_nombre = trigramas(normalizado)
+            self.n_trigramas[posicion] = len(trigramas_nombre)
+            for trigrama in trigramas_nombre:
+                posiciones_trigrama.setdefault(trigrama, []).append(posicion)
+        self.posiciones_trigrama = {trigrama: np.array(posiciones, dtype=np.int32) for trigrama, posiciones in posiciones_trigrama.items()}
+
+    def puntuacion(self, consulta_normalizada, posicion, similitud):
+        nombre = self.normalizados[posicion]
+        if nombre == consulta_normalizada:
+            return similitud + 1
+        if nombre.startswith(consulta_normalizada) or f' {consulta_normalizada}' in nombre:
+            return similitud + 0.5
+        if consulta_normalizada in nombre:
+            return similitud + 0.25
+        return similitud
+
+    def buscar(self, consulta, n_resultados=5, puntuacion_minima=0.3, n_candidatos=50):
+        '''Devuelve una lista de hasta n_resultados tuplas (nombre, valor, puntuacion) ordenadas de mejor a peor. Solo se puntúan los
+        n_candidatos nombres con más trigramas en común con la consulta'''
+        consulta_normalizada = normalizar_nombre(consulta)
+        trigramas_consulta = [trigrama for trigrama in trigramas(consulta_normalizada) if trigrama in self.posiciones_trigrama]
+        if not trigramas_consulta:
+            return []
+
+        comunes = np.bincount(np.concatenate([self.posiciones_trigrama[trigrama] for trigrama in trigramas_consulta]),
+                              minlength=len(self.nombres))
+        candidatos = np.flatnonzero(comunes)
+        if len(candidatos) > n_candidatos:
+            candidatos = candidatos[np.argpartition(-comunes[candidatos], n_candidatos)[:n_candidatos]]
+        similitudes = 2 * comunes[candidatos] / (len(trigramas(consulta_normalizada)) + self.n_trigramas[candidatos])
+
+        resultados = [(self.nombres[posicion], self.valores[posicion], self.puntuacion(consulta_normalizada, posicion, similitud))
+                      for posicion, similitud in zip(candidatos, similitudes)]
+        resultados = [resultado for resultado in resultados if resultado[2] >= puntuacion_minima]
+        return sorted(resultados, key=lambda resultado: -resultado[2])[:n_resultados]
+
+    def mejor(self, consulta, puntuacion_minima=0.3):
+        '''Valor del nombre que mejor encaja con la consulta, o None si ninguno llega a puntuacion_minima'''
+        resultados = self.buscar(consulta, n_resultados=1, puntuacion_minima=puntuacion_minima)
+        return resultados[0][1] if resultados else None
+
+
+class buscador():
+    '''Índices de búsqueda de equipos, jugadores, árbitros y estadios. Se crea una vez leyendo solo los diccionarios de equipos y
+    jugadores y las columnas arbitro y estadio de los datos generales de los partidos, y después cada búsqueda se hace en memoria'''
+
+    def __init__(self, ruta='data/raw_files'):
+        self.df_jugadores = pd.read_csv(os.path.join(ruta, 'df_diccionario_jugadores.csv'))
+        df_equipos = pd.concat([pd.read_csv(os.path.join(ruta, 'df_dicc_equipos.csv')),
+                                self.df_jugadores[['equipo_jugador', 'id_equipo']]]).drop_duplicates()
+        df_partidos = pd.read_csv(os.path.join(ruta, 'datos_generales_fx.csv'), usecols=['arbitro', 'estadio'])
+
+        self.equipos = indice_nombres(df_equipos['equipo_jugador'], df_equipos['id_equipo'])
+        jugadores = self.df_jugadores.drop_duplicates(subset=['id_jugador', 'nombre_jugador'])
+        self.jugadores = indice_nombres(jugadores['nombre_jugador'], jugadores['id_jugador'])
+        arbitros = df_partidos['arbitro'].dropna().unique()
+        self.arbitros = indice_nombres(arbitros, arbitros)
+        estadios = df_partidos['estadio'].dropna().unique()
+        self.estadios = indice_nombres(estadios, estadios)
+
+        #Plantilla de cada equipo y temporada, para no filtrar el diccionario de jugadores en cada consulta
+        self.plantillas = {clave: df for clave, df in self.df_jugadores.groupby(['id_equipo', 'temporada_equipo'])}
+
+    def indice(self, tipo):
+        indices = {'equipo': self.equipos, 'jugador': self.jugadores, 'arbitro': self.arbitros, 'estadio': self.estadios}
+        if tipo not in indices:
+            raise ValueError(f"tipo tiene que ser 'equipo', 'jugador', 'arbitro' o 'estadio', no '{tipo}'")
+        return indices[tipo]
+
+    def resolver(self, tipo, nombres, puntuacion_minima=0.3):
+        '''Resuelve de una vez una lista de nombres del tipo dado a su mejor coincidencia (id para equipos y jugadores, nombre
+        exacto para árbitros y estadios). Devuelve un dataframe con el nombre buscado, el nombre encontrado, el valor y la puntuación'''
+        indice = self.indice(tipo)
+        filas = []
+        for nombre in nombres:
+            resultados = indice.buscar(nombre, n_resultados=1, puntuacion_minima=puntuacion_minima)
+            filas.append((nombre, *resultados[0]) if resultados else (nombre, None, None, None))
+        return pd.DataFrame(filas, columns=['nombre_buscado', 'nombre', 'valor', 'puntuacion'])
+
+    def plantilla(self, id_equipo, temporada_equipo):
+        return self.plantillas.get((id_equipo, temporada_equipo), self.df_jugadores.iloc[:0])
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+#Versiones ya calculadas de cada modelo y feature store cargados, para no volver a serializarlos en cada consulta
+VERSIONES = weakref.WeakKeyDictionary()
+
+
+def version_objeto(objeto):
+    '''Hash del contenido de un modelo o de un feature_store. Se calcula una vez por objeto: un modelo reentrenado o un store
+    recreado son objetos nuevos y tienen otra versión'''
+    try:
+        return VERSIONES[objeto]
+    except (KeyError, TypeError):
+        pass
+    version = hashlib.sha1(pickle.dumps(objeto, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+    try:
+        VERSIONES[objeto] = version
+    except TypeError:
+        pass
+    return version
+
+
+def version_modelo(modelo, store):
+    '''Versión de una predicción: depende del modelo y también del feature store, porque la forma de los equipos cambia al añadir
+    partidos aunque no se reentrene'''
+    return hashlib.sha1(f'{version_objeto(modelo)}-{version_objeto(store)}'.encode()).hexdigest()[:16]
+
+
+def version_archivos(*rutas):
+    '''Versión a partir del contenido de los archivos de un modelo y un store guardados (una carpeta cuenta con todos sus archivos)'''
+    h = hashlib.sha1()
+    for ruta in rutas:
+        archivos = [ruta] if os.path.isfile(ruta) else sorted(os.path.join(carpeta, nombre) for carpeta, _, nombres in os.walk(ruta)
+                                                               for nombre in nombres)
+        for ruta_archivo in archivos:
+            h.update(os.path.relpath(ruta_archivo, ruta).encode())
+            with open(ruta_archivo, 'rb') as contenido:
+                for bloque in iter(lambda: contenido.read(2**20), b''):
+                    h.update(bloque)
+    return h.hexdigest()[:16]
+
+
+def clave_partido(partido, version):
+    '''Clave canónica de un partido: el mismo partido da la misma clave aunque los ids lleguen en otro orden o como float, o las
+    cuotas como enteros. Los ids NaN se descartan igual que en creacion_datos_nuevos_partes (NaN != NaN)'''
+    canonico = [version,
+                int(partido['id_equipo_local']), int(partido['id_equipo_visitante']),
+                float(partido['odd_1']), float(partido['odd_x']), float(partido['odd_2']),
+                partido['arbitro'] if isinstance(partido['arbitro'], str) else None,
+                partido['estadio'] if isinstance(partido['estadio'], str) else None,
+                int(partido['season']),
+                sorted(int(id_jugador) for id_jugador in partido['ids_lesionados'] if id_jugador == id_jugador),
+                sorted(int(id_jugador) for id_jugador in partido['ids_titulares'] if id_jugador == id_jugador)]
+    return hashlib.sha1(json.dumps(canonico).encode()).hexdigest()
+
+
+class cache_predicciones():
+    '''Caché de predicciones por partido. La clave es el hash canónico de las entradas del partido (clave_partido) y la versión
+    del modelo y el store, así que al reentrenar las predicciones antiguas dejan de coincidir sin tener que borrar nada. En
+    memoria guarda como mucho capacidad predicciones y desaloja las menos usadas (LRU). Con ttl_s las predicciones caducan a los
+    ttl_s segundos. Con ubicacion también se guardan en disco (un JSON por predicción en ubicacion/<versión>), compartidas entre
+    procesos y ejecuciones. Cuenta aciertos de memoria y de disco, fallos, caducadas y desalojadas (ver estadisticas)'''
+
+    def __init__(self, capacidad=10000, ttl_s=None, ubicacion=None):
+        self.capacidad = capacidad
+        self.ttl_s = ttl_s
+        self.ubicacion = ubicacion
+        self.memoria = OrderedDict()
+        self.version_actual = None
+        self.bloqueo = threading.Lock()
+        self.contadores = dict.fromkeys(['aciertos_memoria', 'aciertos_disco', 'fallos', 'caducadas', 'desalojadas'], 0)
+
+    def ruta(self, version, clave):
+        return os.path.join(self.ubicacion, version, clave[:2], f'{clave}.json')
+
+    def leer_disco(self, version, clave):
+        ruta = self.ruta(version, clave)
+        try:
+            if self.ttl_s is not None and time.time() - os.path.getmtime(ruta) > self.ttl_s:
+                return None
+            with open(ruta, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return None
+
+    def guardar_disco(self, version, clave, prediccion):
+        ruta = self.ruta(version, clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        ruta_temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+            #Los valores que vienen de numpy se guardan como números de Python
+            json.dump(prediccion, archivo, default=lambda valor: valor.item())
+        os.replace(ruta_temporal, ruta)
+
+    def obtener(self, partido, version):
+        '''Predicción guardada del partido con esa versión, o None si no está o ha caducado'''
+        clave = clave_partido(partido, version)
+        with self.bloqueo:
+            entrada = self.memoria.get(clave)
+            if entrada is not None:
+                instante, prediccion = entrada
+                if self.ttl_s is None or time.monotonic() - instante <= self.ttl_s:
+                    self.memoria.move_to_end(clave)
+                    self.contadores['aciertos_memoria'] += 1
+                    return prediccion
+                del self.memoria[clave]
+                self.contadores['caducadas'] += 1
+
+        prediccion = self.leer_disco(version, clave) if self.ubicacion is not None else None
+        with self.bloqueo:
+            if prediccion is None:
+                self.contadores['fallos'] += 1
+                return None
+            self.contadores['aciertos_disco'] += 1
+        self.guardar_memoria(version, clave, prediccion)
+        return prediccion
+
+    def guardar_memoria(self, version, clave, prediccion):
+        with self.bloqueo:
+            #Con un modelo nuevo las predicciones del anterior ya no se van a pedir, se liberan de memoria (no del disco)
+            if version != self.version_actual:
+                self.memoria.clear()
+                self.version_actual = version
+            self.memoria[clave] = (time.monotonic(), prediccion)
+            self.memoria.move_to_end(clave)
+            while len(self.memoria) > self.capacidad:
+                self.memoria.popitem(last=False)
+                self.contadores['desalojadas'] += 1
+
+    def guardar(self, partido, version, prediccion):
+        clave = clave_partido(partido, version)
+        self.guardar_memoria(version, clave, prediccion)
+        if self.ubicacion is not None:
+            self.guardar_disco(version, clave, prediccion)
+
+    def predecir(self, partidos, version, funcion):
+        '''Predicciones de partidos (diccionarios con los campos de creacion_datos_nuevos) en el mismo orden. Solo los que no
+        están en la caché se pasan, todos juntos, a funcion, que recibe una lista de partidos y devuelve sus predicciones'''
+        predicciones = [self.obtener(partido, version) for partido in partidos]
+        pendientes = [i for i, prediccion in enumerate(predicciones) if prediccion is None]
+        if pendientes:
+            for i, prediccion in zip(pendientes, funcion([partidos[i] for i in pendientes])):
+                self.guardar(partidos[i], version, prediccion)
+                predicciones[i] = prediccion
+        return predicciones
+
+    def estadisticas(self):
+        with self.bloqueo:
+            consultas = self.contadores['aciertos_memoria'] + self.contadores['aciertos_disco'] + self.contadores['fallos']
+            aciertos = self.contadores['aciertos_memoria'] + self.contadores['aciertos_disco']
+            return {**self.contadores, 'en_memoria': len(self.memoria),
+                    'tasa_aciertos': aciertos / consultas if consultas else None}
+
+    def limpiar(self):
+        '''Vacía la memoria y, si hay caché en disco, borra todas sus versiones'''
+        with self.bloqueo:
+            self.memoria.clear()
+            self.version_actual = None
+        if self.ubicacion is not None and os.path.isdir(self.ubicacion):
+            shutil.rmtree(self.ubicacion)
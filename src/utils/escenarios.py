@@ -0,0 +1,125 @@
+import itertools
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from utils.alineaciones import FECHA_FUTURA, columnas_alineacion
+from utils.feature_store import feature_store
+from utils.functions import data_processing
+from utils.modelo_ligero import modelo_ligero
+
+
+#Cambios que puede tener un escenario respecto al partido base, cada uno una lista de ids de jugadores
+CAMBIOS = ('titulares_fuera', 'titulares_dentro', 'lesionados_fuera', 'lesionados_dentro')
+
+
+def escenarios_dudosos(dudosos, n_ausentes=None, sustitutos=None):
+    '''Escenarios con todas las combinaciones de jugadores dudosos que se pierden el partido: cada ausente deja de ser titular y
+    pasa a lesionado, y si está en sustitutos (id del dudoso -> id del sustituto) su sustituto entra de titular. Con n_ausentes
+    solo las combinaciones de ese número de ausentes, si no todas (de ninguno a todos)'''
+    sustitutos = {} if sustitutos is None else sustitutos
+    tamanos = range(len(dudosos) + 1) if n_ausentes is None else [n_ausentes]
+    escenarios = []
+    for tamano in tamanos:
+        for ausentes in itertools.combinations(dudosos, tamano):
+            escenarios.append({'nombre': 'sin ' + ', '.join(str(id_jugador) for id_jugador in ausentes) if ausentes else 'todos',
+                               'titulares_fuera': list(ausentes),
+                               'lesionados_dentro': list(ausentes),
+                               'titulares_dentro': [sustitutos[id_jugador] for id_jugador in ausentes if id_jugador in sustitutos]})
+    return escenarios
+
+
+class simulador_escenarios():
+    '''Probabilidades de 1/X/2 de un partido con muchas alineaciones distintas. El partido base (un diccionario con los campos de
+    creacion_datos_nuevos) se crea una sola vez con creacion_datos_nuevos_partes, y cada escenario es una lista de cambios sobre
+    él (ver CAMBIOS y escenarios_dudosos). Los titulares y lesionados de todos los escenarios se montan como dos matrices
+    escenario x jugador, copiando la fila base y aplicando todos los cambios de una vez, y todos los escenarios se puntúan con una
+    única llamada a predict_proba. store es el feature_store (o df_partidos) y modelo el modelo entrenado o un modelo_ligero'''
+
+    def __init__(self, store, modelo):
+        self.processing = data_processing()
+        self.store = store if isinstance(store, feature_store) else self.processing.creacion_feature_store(store)
+        self.modelo = modelo
+
+    def alineaciones(self, partido, escenarios):
+        '''Vocabulario de los jugadores que aparecen en el partido o en algún cambio y las matrices booleanas escenario x jugador de
+        titulares y lesionados'''
+        ids_cambios = [np.asarray(escenario.get(cambio, []), dtype=np.int64) for escenario in escenarios for cambio in CAMBIOS]
+        vocabulario = np.unique(np.concatenate([np.asarray(partido['ids_titulares'], dtype=np.int64),
+                                                np.asarray(partido['ids_lesionados'], dtype=np.int64)] + ids_cambios))
+
+        n = len(escenarios)
+        titulares = np.zeros((n, len(vocabulario)), dtype=bool)
+        lesionados = np.zeros((n, len(vocabulario)), dtype=bool)
+        titulares[:, np.searchsorted(vocabulario, np.asarray(partido['ids_titulares'], dtype=np.int64))] = True
+        lesionados[:, np.searchsorted(vocabulario, np.asarray(partido['ids_lesionados'], dtype=np.int64))] = True
+
+        #Posiciones (escenario, jugador) de cada tipo de cambio, para editar las dos matrices con una asignación por tipo
+        for matriz, cambio, valor in [(titulares, 'titulares_fuera', False), (titulares, 'titulares_dentro', True),
+                                      (lesionados, 'lesionados_fuera', False), (lesionados, 'lesionados_dentro', True)]:
+            ids = [np.asarray(escenario.get(cambio, []), dtype=np.int64) for escenario in escenarios]
+            filas = np.repeat(np.arange(n), [len(ids_escenario) for ids_escenario in ids])
+            matriz[filas, np.searchsorted(vocabulario, np.concatenate(ids))] = valor
+
+        return vocabulario, titulares, lesionados
+
+    def partes(self, partido, escenarios):
+        '''Lo mismo que devuelve creacion_datos_nuevos_partes, con una fila por escenario'''
+        base = pd.DataFrame([{campo: partido[campo] for campo in ['id_equipo_local', 'id_equipo_visitante', 'odd_1', 'odd_x', 'odd_2',
+                                                                  'arbitro', 'estadio', 'season']}])
+        base['ids_lesionados'], base['ids_titulares'] = [list(partido['ids_lesionados'])], [list(partido['ids_titulares'])]
+        datos_base, _, columnas_jugadores = self.processing.creacion_datos_nuevos_partes(self.store, base)
+
+        n = len(escenarios)
+        vocabulario, titulares, lesionados = self.alineaciones(partido, escenarios)
+        datos_nuevos = datos_base.iloc[np.zeros(n, dtype=int)].reset_index(drop=True)
+
+        #Las variables de alineación dependen de los titulares y lesionados de cada escenario
+        if self.store.alineaciones is not None:
+            filas_titulares, jugadores_titulares = np.nonzero(titulares)
+            filas_lesionados, jugadores_lesionados = np.nonzero(lesionados)
+            apariciones = pd.DataFrame({'fila': np.r_[filas_lesionados, filas_titulares].astype(np.int64),
+                                        'id_jugador': vocabulario[np.r_[jugadores_lesionados, jugadores_titulares]],
+                                        'titular': np.r_[np.zeros(len(filas_lesionados), dtype=bool), np.ones(len(filas_titulares), dtype=bool)]})
+            partidos = datos_nuevos[['id_equipo_local', 'id_equipo_visitante', 'season']].assign(fecha_timestamp=FECHA_FUTURA)
+            variables = self.store.alineaciones.variables(partidos, apariciones)
+            columnas = columnas_alineacion()
+            datos_nuevos[columnas] = variables[columnas].to_numpy()
+
+        #Columna del modelo de cada jugador del vocabulario como titular y como lesionado. Los que el modelo no conoce se ignoran
+        posicion_columna = self.store.posicion_jugador
+        posicion_titular = np.array([posicion_columna.get(f'titu-{float(id_jugador)}', -1) for id_jugador in vocabulario], dtype=int)
+        posicion_lesionado = np.array([posicion_columna.get(f'les-{int(id_jugador)}', -1) for id_jugador in vocabulario], dtype=int)
+
+        filas, columnas = [], []
+        for matriz, posiciones in [(lesionados, posicion_lesionado), (titulares, posicion_titular)]:
+            filas_matriz, jugadores = np.nonzero(matriz & (posiciones >= 0))
+            filas.append(filas_matriz)
+            columnas.append(posiciones[jugadores])
+        filas, columnas = np.concatenate(filas), np.concatenate(columnas)
+        matriz_jugadores = sparse.csr_matrix((np.ones(len(filas), dtype=np.uint8), (filas, columnas)),
+                                             shape=(n, len(columnas_jugadores)))
+        matriz_jugadores.data[:] = 1
+
+        return datos_nuevos, matriz_jugadores, columnas_jugadores
+
+    def predecir(self, partido, escenarios):
+        '''Predice todos los escenarios con una sola llamada a predict_proba. Devuelve un dataframe con una fila por escenario: su
+        nombre (o su posición), probabilidad de X, 1 y 2, el resultado más probable y la diferencia de cada probabilidad con el
+        partido base sin cambios'''
+        escenarios = [{}] + list(escenarios)
+        datos_nuevos, matriz_jugadores, columnas_jugadores = self.partes(partido, escenarios)
+        if isinstance(self.modelo, modelo_ligero):
+            probabilidades = self.modelo.predict_proba(datos_nuevos, matriz_jugadores, columnas_jugadores)
+        else:
+            probabilidades = self.modelo.predict_proba(
+                self.processing.unir_partes(self.store, datos_nuevos, matriz_jugadores, columnas_jugadores))
+
+        #La primera fila es el partido base, con la que se comparan los escenarios
+        df_escenarios = pd.DataFrame({'escenario': [escenario.get('nombre', i) for i, escenario in enumerate(escenarios[1:])],
+                                      'prob_X': probabilidades[1:, 0],
+                                      'prob_1': probabilidades[1:, 1],
+                                      'prob_2': probabilidades[1:, 2]})
+        df_escenarios['resultado'] = self.modelo.classes_[np.argmax(probabilidades[1:], axis=1)]
+        for i, resultado in enumerate(['X', '1', '2']):
+            df_escenarios[f'dif_prob_{resultado}'] = probabilidades[1:, i] - probabilidades[0, i]
+        return df_escenarios
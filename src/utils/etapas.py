@@ -0,0 +1,204 @@
+import hashlib
+import inspect
+import joblib
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import shutil
+import sys
+import types
+from scipy import sparse
+
+
+#Tipos de las constantes de módulo que forman parte de la versión del código de una etapa
+TIPOS_CONSTANTES = (str, int, float, bool, list, tuple, dict, set, type(None))
+
+
+def huella(objeto):
+    '''Hash del contenido de un objeto, para las claves de las etapas y de memoria_pipeline. Los dataframes con miles de columnas
+    dispersas se recorren columna a columna, en orden, en vez de serializarlos enteros como hace joblib.hash. De cada columna cuenta
+    su nombre, su dtype y sus valores; de las dispersas, también el fill_value y las posiciones de los valores no nulos. Así la
+    huella no depende de cómo agrupe pandas las columnas en bloques internos'''
+    h = hashlib.sha1()
+    if isinstance(objeto, pd.DataFrame):
+        h.update(joblib.hash(objeto.index.to_numpy()).encode())
+        for nombre, columna in objeto.items():
+            valores = columna.array
+            if isinstance(valores, pd.arrays.SparseArray):
+                #repr de la descripción de la columna, joblib.hash de una tupla pequeña por cada una de miles de columnas es lo lento
+                h.update(repr((nombre, str(columna.dtype), valores.fill_value, len(valores))).encode())
+                h.update(valores.sp_values.tobytes())
+                h.update(valores.sp_index.indices.tobytes())
+            else:
+                h.update(repr((nombre, str(columna.dtype))).encode())
+                h.update(joblib.hash(valores).encode())
+    elif isinstance(objeto, pd.Series):
+        h.update(pd.util.hash_pandas_object(objeto).to_numpy().tobytes())
+    elif sparse.issparse(objeto):
+        objeto = objeto.tocsr()
+        for array in (objeto.data, objeto.indices, objeto.indptr, np.asarray(objeto.shape)):
+            h.update(array.tobytes())
+    else:
+        h.update(joblib.hash(objeto).encode())
+    return h.hexdigest()
+
+
+class archivo():
+    '''Archivo de entrada de una etapa. En la clave cuenta su contenido (no su ruta ni su fecha), y a la función de la etapa le
+    llega la ruta'''
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def huella(self):
+        h = hashlib.sha1()
+        with open(self.ruta, 'rb') as contenido:
+            for bloque in iter(lambda: contenido.read(2**20), b''):
+                h.update(bloque)
+        return h.hexdigest()
+
+
+def nombres_usados(codigo):
+    '''Nombres globales y atributos que usa un objeto de código, incluidas las funciones y lambdas que define dentro'''
+    nombres = set(codigo.co_names)
+    for constante in codigo.co_consts:
+        if isinstance(constante, types.CodeType):
+            nombres |= nombres_usados(constante)
+    return nombres
+
+
+def es_del_proyecto(objeto):
+    modulo = getattr(objeto, '__module__', None) or ''
+    return modulo.split('.')[0] in ('utils', '__main__')
+
+
+def version_codigo(funcion):
+    '''Huella del código de una etapa: el código fuente de la función, el de los métodos de su clase que llama, el de las funciones
+    y clases del proyecto que usa (recursivamente) y el valor de las constantes de módulo que lee. Solo cambia si cambia algo que
+    ejecuta la etapa, así que tocar los hiperparámetros de train.py no invalida las etapas de preprocesado'''
+    clase = type(funcion.__self__) if inspect.ismethod(funcion) else None
+    pendientes = [inspect.unwrap(getattr(funcion, '__func__', funcion))]
+    vistos, partes = set(), []
+    while pendientes:
+        objeto = pendientes.pop()
+        if id(objeto) in vistos:
+            continue
+        vistos.add(id(objeto))
+        try:
+            partes.append(inspect.getsource(objeto))
+        except (OSError, TypeError):
+            partes.append(repr(objeto))
+            continue
+
+        if inspect.isclass(objeto):
+            pendientes.extend(valor for valor in vars(objeto).values() if inspect.isfunction(valor))
+            continue
+
+        globales = objeto.__globals__
+        for nombre in sorted(nombres_usados(objeto.__code__)):
+            if clase is not None and inspect.isfunction(getattr(clase, nombre, None)):
+                pendientes.append(inspect.unwrap(getattr(clase, nombre)))
+            elif nombre in globales:
+                valor = globales[nombre]
+                if (inspect.isfunction(valor) or inspect.isclass(valor)) and es_del_proyecto(valor):
+                    pendientes.append(inspect.unwrap(valor))
+                elif isinstance(valor, TIPOS_CONSTANTES):
+                    partes.append(f'{nombre}={valor!r}')
+
+    #Las versiones de las librerías también cambian el resultado
+    partes.append(f'pandas={pd.__version__}|numpy={np.__version__}|python={sys.version_info[:2]}')
+    return hashlib.sha1('\n'.join(partes).encode()).hexdigest()
+
+
+class etapa():
+    '''Resultado perezoso de una etapa del pipeline. Su clave es un hash de la versión del código de la función, de las claves de
+    las etapas de entrada (o el contenido de los archivos de entrada) y del resto de parámetros, así que no hace falta leer ni
+    calcular nada para saber si ya está en la caché. valor() carga el resultado de la caché o, si no está, calcula las entradas
+    que hagan falta, ejecuta la función y lo guarda'''
+
+    def __init__(self, cache, nombre, funcion, args, kwargs):
+        self.cache = cache
+        self.nombre = nombre
+        self.funcion = funcion
+        self.args = args
+        self.kwargs = kwargs
+        partes = [nombre, version_codigo(funcion)] + [self.clave_entrada(arg) for arg in args] + \
+                 [f'{parametro}={self.clave_entrada(valor)}' for parametro, valor in sorted(kwargs.items())]
+        self.clave = hashlib.sha1('|'.join(partes).encode()).hexdigest()
+        self.ruta = os.path.join(cache.ubicacion, f'{nombre}-{self.clave[:16]}.pkl')
+
+    @staticmethod
+    def clave_entrada(entrada):
+        if isinstance(entrada, etapa):
+            return entrada.clave
+        if isinstance(entrada, archivo):
+            return entrada.huella()
+        if isinstance(entrada, (list, tuple)):
+            return joblib.hash([etapa.clave_entrada(elemento) for elemento in entrada])
+        return huella(entrada)
+
+    @staticmethod
+    def resolver(entrada):
+        if isinstance(entrada, etapa):
+            return entrada.valor()
+        if isinstance(entrada, archivo):
+            return entrada.ruta
+        if isinstance(entrada, (list, tuple)):
+            return type(entrada)(etapa.resolver(elemento) for elemento in entrada)
+        return entrada
+
+    def en_cache(self):
+        return os.path.exists(self.ruta)
+
+    def valor(self):
+        if hasattr(self, 'resultado'):
+            return self.resultado
+
+        if self.en_cache():
+            with open(self.ruta, 'rb') as contenido:
+                self.resultado = pickle.load(contenido)
+            self.cache.registro.append((self.nombre, 'caché'))
+            return self.resultado
+
+        args = [self.resolver(arg) for arg in self.args]
+        kwargs = {parametro: self.resolver(valor) for parametro, valor in self.kwargs.items()}
+        self.resultado = self.funcion(*args, **kwargs)
+        self.cache.registro.append((self.nombre, 'calculada'))
+
+        #Se escribe en un temporal y se renombra para no dejar nunca un archivo a medias
+        os.makedirs(self.cache.ubicacion, exist_ok=True)
+        ruta_temporal = f'{self.ruta}.{os.getpid()}.tmp'
+        with open(ruta_temporal, 'wb') as contenido:
+            pickle.dump(self.resultado, contenido, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ruta_temporal, self.ruta)
+        return self.resultado
+
+
+class cache_etapas():
+    '''Caché en disco de las etapas del pipeline, direccionada por contenido (ver etapa). Las etapas se declaran en orden con
+    etapa(nombre, funcion, *args, **kwargs), donde args y kwargs pueden ser otras etapas, archivos o valores normales, y solo se
+    calcula algo al pedir el valor() de la última. Las etapas que no han cambiado se cargan de la caché y las que sí se recalculan
+    junto con todas las que dependen de ellas; las que no hacen falta para el resultado pedido ni se cargan.
+
+    Las funciones de las etapas no deben modificar el valor de sus entradas que sea otra etapa si esa etapa se usa en más de un
+    sitio, ya que el valor se comparte en memoria'''
+
+    def __init__(self, ubicacion='data/cache/etapas'):
+        self.ubicacion = ubicacion
+        self.registro = []
+
+    def etapa(self, nombre, funcion, *args, **kwargs):
+        return etapa(self, nombre, funcion, args, kwargs)
+
+    def limpiar(self, etapas_actuales=()):
+        '''Borra de la caché todos los resultados excepto los de etapas_actuales'''
+        mantener = {os.path.basename(actual.ruta) for actual in etapas_actuales}
+        if not os.path.isdir(self.ubicacion):
+            return
+        for nombre_archivo in os.listdir(self.ubicacion):
+            if nombre_archivo not in mantener:
+                os.remove(os.path.join(self.ubicacion, nombre_archivo))
+
+    def clear(self):
+        shutil.rmtree(self.ubicacion, ignore_errors=True)
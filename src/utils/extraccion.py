@@ -0,0 +1,306 @@
+import hashlib
+import http.client
+import json
+import os
+import queue
+import random
+import threading
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+from utils.instrumentacion import instrumentar
+
+
+URL_API = 'https://api-football-v1.p.rapidapi.com/v3'
+#Variable de entorno con la clave de RapidAPI, para no dejarla escrita en el código
+VARIABLE_CLAVE = 'RAPIDAPI_KEY'
+
+#Ligas (primera y segunda división) y temporadas del histórico
+LIGAS = [140, 141]
+TEMPORADAS = list(range(2012, 2023))
+
+#Estadísticas en el orden en el que las devuelve la API, con el nombre de su columna en df_estadisticas
+ESTADISTICAS_API = ['shots_on_goal', 'shots_off_goal', 'total_shots', 'blocked_shots', 'shots_insidebox', 'shots_outsidebox',
+                    'fouls', 'corners', 'offsides', 'ball_possession', 'yellow_cards', 'red_cards', 'goalkeeper_saves', 'pass_precision']
+
+#Estados de un partido que ya no va a cambiar. Un listado de partidos solo se guarda en la caché si todos están en alguno de ellos
+ESTADOS_TERMINADOS = {'FT', 'AET', 'PEN', 'CANC', 'ABD', 'AWD', 'WO'}
+#Respuestas que se reintentan: demasiadas peticiones y errores del servidor
+ESTADOS_REINTENTO = {429, 500, 502, 503, 504}
+
+
+class limitador_tasa():
+    '''Cubo de fichas compartido por todos los hilos: se rellena a tasa fichas por segundo hasta capacidad (la ráfaga máxima) y cada
+    petición gasta una. Si no quedan, la petición reserva su ficha y espera fuera del bloqueo lo que tarde en rellenarse, así que
+    las peticiones salen en orden de llegada y nunca por encima de la tasa'''
+
+    def __init__(self, tasa, capacidad=1):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.ultima = time.monotonic()
+        self.bloqueo = threading.Lock()
+
+    def rellenar(self):
+        ahora = time.monotonic()
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultima) * self.tasa)
+        self.ultima = ahora
+
+    def esperar(self):
+        with self.bloqueo:
+            self.rellenar()
+            self.fichas -= 1
+            espera = -self.fichas / self.tasa if self.fichas < 0 else 0
+        if espera > 0:
+            time.sleep(espera)
+
+    def pausar(self, segundos):
+        '''Vacía el cubo para que ninguna petición salga en segundos (por ejemplo el Retry-After de una respuesta 429)'''
+        with self.bloqueo:
+            self.rellenar()
+            self.fichas = min(self.fichas, -segundos * self.tasa)
+
+
+class cache_respuestas():
+    '''Respuestas de la API en disco, un JSON por petición con el hash del endpoint y los parámetros como nombre. Se escriben en un
+    temporal y se renombran, así que un proceso interrumpido nunca deja una respuesta a medias'''
+
+    def __init__(self, ubicacion='data/cache/api'):
+        self.ubicacion = ubicacion
+
+    def ruta(self, endpoint, parametros):
+        clave = hashlib.sha1(json.dumps([endpoint, sorted(parametros.items())], default=str).encode()).hexdigest()
+        return os.path.join(self.ubicacion, endpoint.strip('/').replace('/', '_'), f'{clave}.json')
+
+    def leer(self, endpoint, parametros):
+        try:
+            with open(self.ruta(endpoint, parametros), encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return None
+
+    def guardar(self, endpoint, parametros, respuesta):
+        ruta = self.ruta(endpoint, parametros)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        ruta_temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(ruta_temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(respuesta, archivo)
+        os.replace(ruta_temporal, ruta)
+
+
+class cliente_api():
+    '''Cliente de la API de fútbol para muchas peticiones: las conexiones se quedan abiertas en un pool y se reutilizan (no se abre
+    una por petición, ni una por hilo de cada pedir_varios), todas
+    las peticiones pasan por un limitador_tasa común, los errores temporales (429, 5xx, conexión cortada) se reintentan con espera
+    exponencial y las respuestas se guardan en una cache_respuestas, de forma que lo ya descargado no se vuelve a pedir nunca.
+    url_base puede ser cualquier servidor con los mismos endpoints, por ejemplo uno local para probar.
+
+    contadores cuenta las respuestas leídas de la caché, las peticiones hechas y los reintentos'''
+
+    def __init__(self, url_base=URL_API, clave=None, ubicacion_cache='data/cache/api', peticiones_por_segundo=5, rafaga=5,
+                 n_hilos=8, reintentos=5, espera_base=1.0, timeout=30):
+        partes = urlsplit(url_base)
+        self.esquema, self.host, self.ruta_base = partes.scheme, partes.netloc, partes.path.rstrip('/')
+        self.cabeceras = {'X-RapidAPI-Host': partes.hostname}
+        clave = clave or os.environ.get(VARIABLE_CLAVE)
+        if clave:
+            self.cabeceras['X-RapidAPI-Key'] = clave
+        self.cache = cache_respuestas(ubicacion_cache) if ubicacion_cache else None
+        self.limitador = limitador_tasa(peticiones_por_segundo, rafaga)
+        self.n_hilos = n_hilos
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.timeout = timeout
+        self.conexiones = queue.LifoQueue()
+        self.bloqueo = threading.Lock()
+        self.contadores = {'cache': 0, 'peticiones': 0, 'reintentos': 0}
+
+    def contar(self, contador):
+        with self.bloqueo:
+            self.contadores[contador] += 1
+
+    def tomar_conexion(self):
+        '''Una conexión abierta del pool, o una nueva si están todas en uso'''
+        try:
+            return self.conexiones.get_nowait()
+        except queue.Empty:
+            clase = http.client.HTTPSConnection if self.esquema == 'https' else http.client.HTTPConnection
+            return clase(self.host, timeout=self.timeout)
+
+    def espera_reintento(self, intento):
+        #Espera exponencial con aleatoriedad, para que los hilos que fallan a la vez no vuelvan a la vez
+        return self.espera_base * 2**intento * (0.5 + random.random())
+
+    def pedir(self, endpoint, parametros, guardar=True):
+        '''Respuesta (JSON) de un endpoint, de la caché si ya se pidió. guardar puede ser False o una función que recibe la respuesta
+        y dice si se guarda (por ejemplo, solo si todos los partidos han terminado)'''
+        parametros = dict(parametros)
+        if self.cache is not None:
+            respuesta = self.cache.leer(endpoint, parametros)
+            if respuesta is not None:
+                self.contar('cache')
+                return respuesta
+
+        ruta = f'{self.ruta_base}/{endpoint.strip("/")}?{urlencode(parametros)}'
+        for intento in range(self.reintentos + 1):
+            ultimo = intento == self.reintentos
+            self.limitador.esperar()
+            self.contar('peticiones')
+            conexion = self.tomar_conexion()
+            try:
+                conexion.request('GET', ruta, headers=self.cabeceras)
+                respuesta_http = conexion.getresponse()
+                cuerpo = respuesta_http.read()
+                self.conexiones.put(conexion)
+            except (OSError, http.client.HTTPException) as error:
+                #Conexión cerrada por el servidor o caída: se descarta y el reintento usa otra
+                conexion.close()
+                if ultimo:
+                    raise RuntimeError(f'Error de conexión en {ruta}: {error}') from error
+                self.contar('reintentos')
+                time.sleep(self.espera_reintento(intento))
+                continue
+
+            if respuesta_http.status in ESTADOS_REINTENTO and not ultimo:
+                retry_after = respuesta_http.getheader('Retry-After')
+                espera = float(retry_after) if retry_after and retry_after.replace('.', '', 1).isdigit() else self.espera_reintento(intento)
+                if respuesta_http.status == 429:
+                    #Se ha superado la cuota: se frena a todos los hilos, no solo a este
+                    self.limitador.pausar(espera)
+                self.contar('reintentos')
+                time.sleep(espera)
+                continue
+            if respuesta_http.status != 200:
+                raise RuntimeError(f'La API ha devuelto {respuesta_http.status} en {ruta}: {cuerpo[:200]!r}')
+
+            respuesta = json.loads(cuerpo)
+            #La API devuelve algunos errores con estado 200 en 'errors'. El de límite de peticiones se reintenta, el resto no
+            errores = respuesta.get('errors') if isinstance(respuesta, dict) else None
+            if errores:
+                if 'rateLimit' in errores and not ultimo:
+                    self.limitador.pausar(self.espera_reintento(intento))
+                    self.contar('reintentos')
+                    continue
+                raise RuntimeError(f'La API ha devuelto errores en {ruta}: {errores}')
+
+            if self.cache is not None and (guardar(respuesta) if callable(guardar) else guardar):
+                self.cache.guardar(endpoint, parametros, respuesta)
+            return respuesta
+
+        raise RuntimeError(f'Sin respuesta válida de {ruta} después de {self.reintentos} reintentos')
+
+    def pedir_varios(self, endpoint, lista_parametros, guardar=True):
+        '''Respuestas de muchas peticiones al mismo endpoint, en el mismo orden, con como mucho n_hilos en vuelo a la vez'''
+        with ThreadPoolExecutor(max_workers=self.n_hilos) as executor:
+            return list(executor.map(lambda parametros: self.pedir(endpoint, parametros, guardar), lista_parametros))
+
+
+def todos_terminados(respuesta):
+    '''True si todos los partidos de un listado de /fixtures han terminado, y por tanto el listado ya no cambia'''
+    return all(partido['fixture']['status']['short'] in ESTADOS_TERMINADOS for partido in respuesta['response'])
+
+
+def valor_estadistica(partido, equipo, posicion):
+    try:
+        return partido['statistics'][equipo]['statistics'][posicion]['value']
+    except (IndexError, KeyError, TypeError):
+        return np.nan
+
+
+@instrumentar
+class extraccion_datos():
+    '''Descarga los archivos en bruto de data/raw_files (los mismos que el notebook de extracción, con las mismas columnas) con un
+    cliente_api. Las peticiones por partido se hacen concurrentemente y, al estar en la caché, repetir la extracción solo pide a la
+    API los partidos nuevos'''
+
+    def __init__(self, cliente=None):
+        self.cliente = cliente or cliente_api()
+
+    def partidos(self, ligas=LIGAS, temporadas=TEMPORADAS):
+        '''Datos generales de los partidos terminados (datos_generales_fx). Los listados de temporadas que aún tienen partidos por
+        jugar no se guardan en la caché'''
+        lista_parametros = [{'league': liga, 'season': temporada} for liga in ligas for temporada in temporadas]
+        filas = []
+        for respuesta in self.cliente.pedir_varios('fixtures', lista_parametros, guardar=todos_terminados):
+            for partido in respuesta['response']:
+                if partido['fixture']['status']['long'] != 'Match Finished':
+                    continue
+                goles_local, goles_visitante = partido['goals']['home'], partido['goals']['away']
+                filas.append({'id_equipo_local': partido['teams']['home']['id'],
+                              'id_equipo_visitante': partido['teams']['away']['id'],
+                              'goles_local': goles_local,
+                              'goles_visitante': goles_visitante,
+                              'resultado': 1 if goles_local > goles_visitante else 2 if goles_local < goles_visitante else 0,
+                              'arbitro': partido['fixture']['referee'],
+                              'fixture_id': partido['fixture']['id'],
+                              'fecha_timestamp': partido['fixture']['timestamp'],
+                              'goles_descanso_local': partido['score']['halftime']['home'],
+                              'goles_descanso_visitante': partido['score']['halftime']['away'],
+                              'estadio': partido['fixture']['venue']['name'],
+                              'season': partido['league']['season']})
+        return pd.DataFrame(filas, columns=['id_equipo_local', 'id_equipo_visitante', 'goles_local', 'goles_visitante', 'resultado',
+                                            'arbitro', 'fixture_id', 'fecha_timestamp', 'goles_descanso_local',
+                                            'goles_descanso_visitante', 'estadio', 'season'])
+
+    def estadisticas(self, fixtures):
+        '''Estadísticas de cada partido (df_estadisticas). La API las devuelve en el orden de ESTADISTICAS_API'''
+        fixtures = list(fixtures)
+        respuestas = self.cliente.pedir_varios('fixtures', [{'id': fixture} for fixture in fixtures])
+        filas = []
+        for fixture, respuesta in zip(fixtures, respuestas):
+            for partido in respuesta['response']:
+                fila = {f'{estadistica}_{lado}': valor_estadistica(partido, equipo, posicion)
+                        for posicion, estadistica in enumerate(ESTADISTICAS_API) for equipo, lado in enumerate(['local', 'away'])}
+                fila['fixture_id_2'] = fixture
+                filas.append(fila)
+        return pd.DataFrame(filas, columns=[f'{estadistica}_{lado}' for estadistica in ESTADISTICAS_API for lado in ['local', 'away']] +
+                                           ['fixture_id_2'])
+
+    def lesionados(self, fixtures):
+        '''Lesionados de cada partido (datos_lesionados)'''
+        fixtures = list(fixtures)
+        respuestas = self.cliente.pedir_varios('injuries', [{'fixture': fixture} for fixture in fixtures])
+        filas = [{'fixture_id': fixture, 'id_lesionado': lesionado['player']['id'], 'name_lesionado': lesionado['player']['name']}
+                 for fixture, respuesta in zip(fixtures, respuestas) for lesionado in respuesta['response']]
+        return pd.DataFrame(filas, columns=['fixture_id', 'id_lesionado', 'name_lesionado'])
+
+    def alineaciones(self, fixtures):
+        '''Titulares de cada partido (datos_alineaciones)'''
+        fixtures = list(fixtures)
+        respuestas = self.cliente.pedir_varios('fixtures/lineups', [{'fixture': fixture} for fixture in fixtures])
+        filas = [{'fixture_id': fixture, 'id_jugador_titular': titular['player']['id'], 'name_jugador_titular': titular['player']['name']}
+                 for fixture, respuesta in zip(fixtures, respuestas) for equipo in respuesta['response'] for titular in equipo['startXI']]
+        return pd.DataFrame(filas, columns=['fixture_id', 'id_jugador_titular', 'name_jugador_titular'])
+
+    def jugadores(self, ligas=LIGAS, temporadas=TEMPORADAS):
+        '''Diccionario de jugadores por equipo y temporada (df_diccionario_jugadores). Se pide la primera página de cada liga y
+        temporada y, con el total de páginas que devuelve, todas las demás a la vez'''
+        primeras = [{'league': liga, 'season': temporada, 'page': 1} for liga in ligas for temporada in temporadas]
+        respuestas = self.cliente.pedir_varios('players', primeras)
+        resto = [{**parametros, 'page': pagina} for parametros, respuesta in zip(primeras, respuestas)
+                 for pagina in range(2, respuesta['paging']['total'] + 1)]
+        respuestas += self.cliente.pedir_varios('players', resto)
+
+        filas = [{'id_jugador': jugador['player']['id'],
+                  'nombre_jugador': jugador['player']['name'],
+                  'equipo_jugador': jugador['statistics'][0]['team']['name'],
+                  'id_equipo': jugador['statistics'][0]['team']['id'],
+                  'temporada_equipo': respuesta['parameters']['season']}
+                 for respuesta in respuestas for jugador in respuesta['response']]
+        return pd.DataFrame(filas, columns=['id_jugador', 'nombre_jugador', 'equipo_jugador', 'id_equipo', 'temporada_equipo'])
+
+    def extraccion_completa(self, ruta='data/raw_files', ligas=LIGAS, temporadas=TEMPORADAS):
+        '''Descarga y guarda todos los archivos en bruto de la extracción en ruta'''
+        os.makedirs(ruta, exist_ok=True)
+        df_partidos = self.partidos(ligas, temporadas)
+        fixtures = df_partidos['fixture_id'].tolist()
+        archivos = {'datos_generales_fx': df_partidos,
+                    'df_estadisticas': self.estadisticas(fixtures),
+                    'datos_lesionados': self.lesionados(fixtures),
+                    'datos_alineaciones': self.alineaciones(fixtures),
+                    'df_diccionario_jugadores': self.jugadores(ligas, temporadas)}
+        for nombre, df in archivos.items():
+            df.to_csv(os.path.join(ruta, f'{nombre}.csv'), index=False)
+        return f"Archivos en bruto guardados en '{ruta}'. Peticiones: {self.cliente.contadores}"
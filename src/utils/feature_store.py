@@ -0,0 +1,53 @@
+import pickle
+import numpy as np
+import pandas as pd
+
+
+class feature_store():
+    '''Tabla precalculada por equipo con la forma en casa y de visitante (media de la suma de los 3 partidos anteriores de cada
+    estadística y tiros para marcar), junto con las columnas del modelo. Se crea una vez con data_processing.creacion_feature_store
+    a partir de la salida de creacion_nuevas_variables, y permite crear datos nuevos sin volver a recorrer df_partidos. Si el
+    modelo usa las variables de alineación, alineaciones es el resumen de fuerza_alineaciones con el que se calculan'''
+
+    def __init__(self, forma_local, forma_away, columnas_modelo, alineaciones=None):
+        self.forma_local = forma_local
+        self.forma_away = forma_away
+        self.columnas_modelo = list(columnas_modelo)
+        self.alineaciones = alineaciones
+        self.indexar()
+
+    def indexar(self):
+        '''Prepara los diccionarios id -> posición y las matrices de valores para que cada consulta sea un acceso directo'''
+        #Vocabulario de jugadores con el que se entrenó el modelo
+        self.columnas_jugadores = [col for col in self.columnas_modelo if col.startswith(('les-', 'titu-'))]
+        self.posicion_jugador = {col: i for i, col in enumerate(self.columnas_jugadores)}
+
+        #Añado una fila de NaN al final de cada tabla para los equipos que no tienen histórico
+        self.posicion_equipo = {}
+        self.valores = {}
+        for lado, df_forma in [('local', self.forma_local), ('away', self.forma_away)]:
+            self.posicion_equipo[lado] = {id_equipo: i for i, id_equipo in enumerate(df_forma.index)}
+            self.valores[lado] = np.vstack([df_forma.to_numpy(dtype=float), np.full((1, df_forma.shape[1]), np.nan)])
+
+    def forma(self, ids_equipos, lado):
+        '''Devuelve la forma de los equipos pedidos jugando de local (lado='local') o de visitante (lado='away'), una fila por id'''
+        posiciones = self.posicion_equipo[lado]
+        sin_historico = len(self.valores[lado]) - 1
+        filas = [posiciones.get(id_equipo, sin_historico) for id_equipo in ids_equipos]
+        columnas = self.forma_local.columns if lado == 'local' else self.forma_away.columns
+        return pd.DataFrame(self.valores[lado][filas], columns=columnas)
+
+    def guardar(self, ruta):
+        with open(ruta, 'wb') as archivo:
+            pickle.dump({'forma_local': self.forma_local,
+                         'forma_away': self.forma_away,
+                         'columnas_modelo': self.columnas_modelo,
+                         'alineaciones': self.alineaciones}, archivo)
+        return f"Feature store guardado en '{ruta}'."
+
+    @classmethod
+    def cargar(cls, ruta):
+        with open(ruta, 'rb') as archivo:
+            datos = pickle.load(archivo)
+        #Los stores guardados antes de las variables de alineación no tienen 'alineaciones'
+        return cls(datos['forma_local'], datos['forma_away'], datos['columnas_modelo'], datos.get('alineaciones'))
@@ -1,70 +1,121 @@
-import category_encoders as ce
+import glob
+import hashlib
 import numpy as np
+import os
 import pandas as pd
-from unidecode import unidecode
+from scipy import sparse
+from concurrent.futures import ThreadPoolExecutor
+from utils.alineaciones import FECHA_FUTURA, fuerza_alineaciones, tiene_variables_alineacion
+from utils.buscador import buscador
+from utils.feature_store import feature_store
+from utils.instrumentacion import instrumentar
+from utils.ventanas import ventana_de_nombre, ventanas_equipo
 
 
+#Estadísticas de partido que se extraen de la API. Cada una tiene su columna _local y _away
+ESTADISTICAS = ['shots_on_goal', 'shots_off_goal', 'total_shots', 'blocked_shots', 'shots_insidebox', 'shots_outsidebox',
+                'fouls', 'corners', 'offsides', 'ball_possession', 'yellow_cards', 'red_cards', 'goalkeeper_saves', 'total_pass']
+
+#Columnas de los archivos de cuotas que se usan: equipos y cuotas de Bet365
+COLUMNAS_CUOTAS = ['HomeTeam', 'AwayTeam', 'B365H', 'B365D', 'B365A']
+
+#Tipos compactos del dataset procesado. Las columnas les-/titu- se guardan como uint8 y las estadísticas y cuotas como float32.
+#tiros_para_marcar_* se deja en float64 porque la actualización incremental la recalcula a partir de los valores guardados
+TIPOS_DATASET = {'index': 'int32', 'id_equipo_local': 'int32', 'id_equipo_visitante': 'int32', 'fixture_id': 'int64',
+                 'fecha_timestamp': 'int64', 'season': 'int16', 'resultado': 'int8', 'goles_local': 'int8',
+                 'goles_visitante': 'int8', 'goles_descanso_local': 'int8', 'goles_descanso_visitante': 'int8',
+                 'arbitro': 'category', 'estadio': 'category', 'odd_1': 'float32', 'odd_x': 'float32', 'odd_2': 'float32',
+                 **{f'{estadistica}_{lado}': 'float32' for estadistica in ESTADISTICAS for lado in ['local', 'away']}}
+
+#Columnas de id de equipo y de goles de cada lado del partido
+COLUMNAS_LADO = {'local': ('id_equipo_local', 'goles_local'),
+                 'away': ('id_equipo_visitante', 'goles_visitante')}
+
+#Filas por bloque al leer por bloques los csv de alineaciones y lesionados (ver pivot_disperso_bloques)
+FILAS_BLOQUE = 50000
+
+
+@instrumentar
 class data_processing():
 
     def __init__(self):
         pass
 
+    def pivot_disperso(self, df, columna_jugador, prefijo, nombre_id=None):
+        '''Construye la tabla partido x jugador (1 si el jugador aparece en el partido, 0 si no) como un DataFrame disperso.
+        Las columnas siguen el mismo formato que el pivot de pandas: '<prefijo><id>' ordenadas por id de jugador, así que el
+        vocabulario id -> columna es estable. Solo se guardan los unos, en lugar de miles de columnas llenas de ceros. Con
+        nombre_id (int o float) el id se escribe en el nombre con ese tipo sea cual sea el tipo con el que se ha leído la columna'''
+        #Elimino fila si hay missings en la columna del id del jugador
+        df = df[['fixture_id', columna_jugador]].dropna(subset=[columna_jugador])
+        jugadores = df[columna_jugador].to_numpy(dtype=None if nombre_id is None else np.int64)
+
+        return self.tabla_dispersa(df['fixture_id'].to_numpy(dtype=np.int64), jugadores, prefijo, nombre_id)
+
+    def pivot_disperso_bloques(self, ruta, columna_jugador, prefijo, nombre_id=int, filas_bloque=FILAS_BLOQUE):
+        '''Igual que pivot_disperso, pero leyendo el csv en bruto por bloques de filas_bloque filas. Solo se leen fixture_id y el
+        id del jugador, que se guardan como enteros, y de cada bloque solo los pares (partido, jugador) distintos, así que la
+        memoria no depende del tamaño del archivo sino del bloque y de la tabla resultante. nombre_id es el tipo con el que se
+        escribe el id en el nombre de la columna (float en las alineaciones, cuyos ids se leían como float por sus missings, e int
+        en los lesionados)'''
+        #El id se lee como float64 por si tiene missings (Int64 es mucho más lento de leer) y se pasa a entero en cada bloque
+        lector = pd.read_csv(ruta, usecols=['fixture_id', columna_jugador], chunksize=filas_bloque,
+                             dtype={'fixture_id': 'int64', columna_jugador: 'float64'})
+        fixtures, jugadores = [], []
+        for bloque in lector:
+            bloque = bloque.dropna(subset=[columna_jugador]).drop_duplicates()
+            fixtures.append(bloque['fixture_id'].to_numpy(dtype=np.int64))
+            jugadores.append(bloque[columna_jugador].to_numpy(dtype=np.int64))
+        fixtures = np.concatenate(fixtures) if fixtures else np.zeros(0, dtype=np.int64)
+        jugadores = np.concatenate(jugadores) if jugadores else np.zeros(0, dtype=np.int64)
+
+        return self.tabla_dispersa(fixtures, jugadores, prefijo, nombre_id)
+
+    def tabla_dispersa(self, fixtures, jugadores, prefijo, nombre_id=None):
+        '''Tabla dispersa partido x jugador a partir de los pares (fixture_id, id de jugador) de cada aparición'''
+        #Posición de cada partido y de cada jugador en la matriz (ordenados por id, igual que hace el pivot)
+        fixtures, filas = np.unique(fixtures, return_inverse=True)
+        jugadores, columnas = np.unique(jugadores, return_inverse=True)
+
+        matriz = sparse.csr_matrix((np.ones(len(filas), dtype=np.uint8), (filas, columnas)),
+                                   shape=(len(fixtures), len(jugadores)))
+        #Si un jugador apareciera dos veces en el mismo partido se habría sumado, lo dejo en 1
+        matriz.data[:] = 1
+
+        nombres = jugadores if nombre_id is None else map(nombre_id, jugadores)
+        df_pivot = pd.DataFrame.sparse.from_spmatrix(matriz, columns=[f'{prefijo}{col}' for col in nombres])
+        df_pivot.insert(0, 'fixture_id', fixtures)
+
+        return df_pivot
+
     def procesado_lesionados(self, df):
         '''Coge el dataframe de lesionados y le aplica un OneHotEncoder, pero sin usar la librería. Para tener en cuenta que jugadores
         han participado en el encuentro de inicio o no. Es representativo ya que la no presencia de un jugador puede afectar en el resultado
-        de un partido'''
-        #Añade una fila de 1 para identificar que ese jugador ha estado lesionado en algún momento
-            
-        df['lesionados'] = pd.Series(np.ones(len(df)), index=df.index)
-        
-        
-        df_lesionados_id = df[['fixture_id', 'id_lesionado', 'lesionados']]
-        
-        #Elimino fila si hay missings en la columna de id_jugador_titular
-        df_lesionados_id = df_lesionados_id.dropna(subset=['id_lesionado'])
-        
-        #Pivota la tabla para convertir en una variable cada jugador. Para los partidos que el jugador no ha estado lesionado,
-        #se rellenará con un '0'. Dejo el índice de la forma correcta.
-        df_lesionados_id = df_lesionados_id.pivot( index= 'fixture_id', 
-                                                columns = 'id_lesionado', 
-                                                values = 'lesionados').fillna(0).reset_index()
-        df_lesionados_id.columns.name = None
-        
-        #Transformo los valores '1' y '0' a int.
-        df_lesionados_id.iloc[:,1:] =df_lesionados_id.iloc[:,1:].astype(int)
-        
-        #Añado al nombre de las variables de los id de jugadores 'les-' para identificar que es la variable de lesionados.
-        df_lesionados_id = df_lesionados_id.rename(columns={col: f'les-{col}' for col in df_lesionados_id.iloc[:,1:]})
-        
+        de un partido. Si en vez del dataframe se pasa la ruta del csv, se lee por bloques (ver pivot_disperso_bloques)'''
+        #Convierto en una variable cada jugador. Para los partidos que el jugador no ha estado lesionado vale '0'. Añado al nombre de
+        #las variables de los id de jugadores 'les-' para identificar que es la variable de lesionados.
+        if isinstance(df, str):
+            df_lesionados_id = self.pivot_disperso_bloques(df, 'id_lesionado', 'les-', nombre_id=int)
+        else:
+            df_lesionados_id = self.pivot_disperso(df, 'id_lesionado', 'les-', nombre_id=int)
+
         return df_lesionados_id
 
 
     def procesado_titulares(self, df):
         '''Coge el dataframe de alineaciones y le aplica un OneHotEncoder, pero sin usar la librería. Para tener en cuenta que jugadores
         han participado en el encuentro de inicio o no. Es representativo ya que la no presencia de un jugador puede afectar en el resultado
-        de un partido'''    
-
-        #Añade una fila de 1 para identificar que ese jugador ha estado lesionado en algún momento
-        df['titular'] = pd.Series(np.ones(len(df)), index=df.index)
-        df_alineaciones_id = df[['fixture_id', 'id_jugador_titular', 'titular']]
-        #Elimino fila si hay missings en la columna de id_jugador_titular
-        df_alineaciones_id = df_alineaciones_id.dropna(subset=['id_jugador_titular'])
-        #Pivota la tabla para convertir en una variable cada jugador. Para los partidos que el jugador no ha estado lesionado,
-        #se rellenará con un '0'. Dejo el índice de la forma correcta.
-        df_alineaciones_id = df_alineaciones_id.pivot( index= 'fixture_id', 
-                                                columns = 'id_jugador_titular', 
-                                                values = 'titular').fillna(0).reset_index()
-        df_alineaciones_id.columns.name = None
+        de un partido. Si en vez del dataframe se pasa la ruta del csv, se lee por bloques (ver pivot_disperso_bloques)'''    
+        #Convierto en una variable cada jugador. Para los partidos que el jugador no ha sido titular vale '0'. Añado al nombre de
+        #las variables de los id de jugadores 'titu-' para identificar que es la variable de titulares.
+        if isinstance(df, str):
+            df_alineaciones_id = self.pivot_disperso_bloques(df, 'id_jugador_titular', 'titu-', nombre_id=float)
+        else:
+            df_alineaciones_id = self.pivot_disperso(df, 'id_jugador_titular', 'titu-', nombre_id=float)
         
         #Me cargo un jugador con id nulo (hay que revisarlo después del procesado)
         df_alineaciones_id = df_alineaciones_id.drop(df_alineaciones_id.columns[1], axis=1)
         
-        #Transformo los valores '1' y '0' a int.
-        df_alineaciones_id.iloc[:,1:]=df_alineaciones_id.iloc[:,1:].astype(int)
-        
-        #Añado al nombre de las variables de los id de jugadores 'les-' para identificar que es la variable de lesionados.
-        df_alineaciones_id = df_alineaciones_id.rename(columns={col: f'titu-{col}' for col in df_alineaciones_id.iloc[:,1:]})
-        
         return df_alineaciones_id
     
     def procesado_estadisticas(self, df):
@@ -76,9 +127,11 @@ class data_processing():
         df = df.rename(columns={'pass_precision_local': 'total_pass_local',
                                 'pass_precision_away': 'total_pass_away',
                             'fixture_id_2': 'fixture_id'})
-        #Transformo los datos de posesion a float para poder usarlos de forma más sencilla
-        df['ball_possession_local'] = df['ball_possession_local'].str.replace('%','').astype(float)
-        df['ball_possession_away'] = df['ball_possession_away'].str.replace('%', '').astype(float)
+        #Transformo los datos de posesion a float para poder usarlos de forma más sencilla. Con leer_csv (utils/lectura.py) ya
+        #vienen como número
+        if df['ball_possession_local'].dtype == object:
+            df['ball_possession_local'] = df['ball_possession_local'].str.replace('%','').astype(float)
+            df['ball_possession_away'] = df['ball_possession_away'].str.replace('%', '').astype(float)
 
         df['ball_possession_local'] = df['ball_possession_local']/100
         df['ball_possession_away'] = df['ball_possession_away']/100
@@ -111,36 +164,45 @@ class data_processing():
         #Cambio el tipo de float a int, ya que no puede haber goles decimales
         df['goles_descanso_local'] = df['goles_descanso_local'].astype(int)
         df['goles_descanso_visitante'] = df['goles_descanso_visitante'].astype(int)
+        #Leídos con leer_csv, arbitro y estadio son category. Los partidos sin árbitro se quedan con 0, como hace el fillna(0) de
+        #creacion_df_final con las columnas de texto (y que con una category fallaría)
+        for columna in df.select_dtypes('category'):
+            if df[columna].isna().any():
+                df[columna] = df[columna].cat.add_categories([0]).fillna(0)
         
         return df
     
     def ruta_cuotas(self):
         return [
-        'data/raw_files/cuotas/SP1-2012.csv',
-        'data/raw_files/cuotas/SP2-2012.csv',
-        'data/raw_files/cuotas/SP1-2013.csv',
-        'data/raw_files/cuotas/SP2-2013.csv',
-        'data/raw_files/cuotas/SP1-2014.csv',
-        'data/raw_files/cuotas/SP2-2014.csv',
-        'data/raw_files/cuotas/SP1-2015.csv',
-        'data/raw_files/cuotas/SP2-2015.csv',
-        'data/raw_files/cuotas/SP1-2016.csv',
-        'data/raw_files/cuotas/SP2-2016.csv',
-        'data/raw_files/cuotas/SP1-2017.csv',
-        'data/raw_files/cuotas/SP2-2017.csv',
-        'data/raw_files/cuotas/SP1-2018.csv',
-        'data/raw_files/cuotas/SP2-2018.csv',
-        'data/raw_files/cuotas/SP1-2019.csv',
-        'data/raw_files/cuotas/SP2-2019.csv',
-        'data/raw_files/cuotas/SP1-2020.csv',
-        'data/raw_files/cuotas/SP2-2020.csv',
-        'data/raw_files/cuotas/SP1-2021.csv',
-        'data/raw_files/cuotas/SP2-2021.csv',
-        'data/raw_files/cuotas/SP1-2022.csv',
-        'data/raw_files/cuotas/SP2-2022.csv'
+        'data/raw_files/Cuotas/SP1-2012.csv',
+        'data/raw_files/Cuotas/SP2-2012.csv',
+        'data/raw_files/Cuotas/SP1-2013.csv',
+        'data/raw_files/Cuotas/SP2-2013.csv',
+        'data/raw_files/Cuotas/SP1-2014.csv',
+        'data/raw_files/Cuotas/SP2-2014.csv',
+        'data/raw_files/Cuotas/SP1-2015.csv',
+        'data/raw_files/Cuotas/SP2-2015.csv',
+        'data/raw_files/Cuotas/SP1-2016.csv',
+        'data/raw_files/Cuotas/SP2-2016.csv',
+        'data/raw_files/Cuotas/SP1-2017.csv',
+        'data/raw_files/Cuotas/SP2-2017.csv',
+        'data/raw_files/Cuotas/SP1-2018.csv',
+        'data/raw_files/Cuotas/SP2-2018.csv',
+        'data/raw_files/Cuotas/SP1-2019.csv',
+        'data/raw_files/Cuotas/SP2-2019.csv',
+        'data/raw_files/Cuotas/SP1-2020.csv',
+        'data/raw_files/Cuotas/SP2-2020.csv',
+        'data/raw_files/Cuotas/SP1-2021.csv',
+        'data/raw_files/Cuotas/SP2-2021.csv',
+        'data/raw_files/Cuotas/SP1-2022.csv',
+        'data/raw_files/Cuotas/SP2-2022.csv'
     ]
     
-    def procesado_cuotas(self, file_names, df_ids):
+    def procesado_cuotas(self, file_names, df_ids, ruta_cache='data/cache/cuotas', n_hilos=8, equivalencias=None):
+        '''Une las cuotas de todos los archivos de file_names, con los nombres de los equipos cambiados por sus ids y la temporada.
+        Los archivos se leen en paralelo y se guardan en ruta_cache (ver leer_cuotas). Con ruta_cache=None no se usa la caché.
+        equivalencias añade nombres (nombre en los archivos de cuotas -> nombre en df_ids) a los de las ligas actuales, por
+        ejemplo para los equipos de una liga nueva'''
         equivalencia_nombres = {
             'Celta':'Celta Vigo',
             'Mallorca':'Mallorca',
@@ -213,44 +275,37 @@ class data_processing():
             'Villarreal B':'Villarreal II',
             'Andorra':'FC Andorra'
         }
+        if equivalencias is not None:
+            equivalencia_nombres = {**equivalencia_nombres, **equivalencias}
     
+        # Crear un diccionario que contenga los nombres de los equipos como claves y sus IDs como valores. Se crea una sola vez
+        # para todos los archivos
+        equipo_id = dict(zip(df_ids['equipo_jugador'], df_ids['id_equipo']))
+
         def select_columns_and_add_season(df, file_name):
             # Extraer año del nombre del archivo
-            year = file_name.split('-')[1][:4]
-
-            # Crear un diccionario que contenga los nombres de los equipos como claves y sus IDs como valores
-            equipo_id = {}
-            for index, row in df_ids.iterrows():
-                equipo_id[row['equipo_jugador']] = row['id_equipo']
+            year = os.path.basename(file_name).split('-')[1][:4]
 
             # Reemplazar los nombres de los equipos por sus IDs correspondientes utilizando el diccionario de equivalencias y el diccionario equipo_id
-            df['HomeTeam'] = df['HomeTeam'].map(equivalencia_nombres).map(equipo_id)
-            df['AwayTeam'] = df['AwayTeam'].map(equivalencia_nombres).map(equipo_id)
-
-            # Seleccionar columnas requeridas
-            df_selected = df[['HomeTeam', 'AwayTeam', 'B365H', 'B365D', 'B365A']]
+            df_selected = df.assign(HomeTeam=df['HomeTeam'].map(equivalencia_nombres).map(equipo_id),
+                                    AwayTeam=df['AwayTeam'].map(equivalencia_nombres).map(equipo_id))
 
             # Añadir columna "season" con el año extraído
             df_selected['season'] = int(year)
 
             # Eliminar filas con valores NaN
-            df_selected.dropna(inplace=True)
+            df_selected = df_selected.dropna()
 
             return df_selected
 
-        # Lista para guardar los dataframes procesados
-        processed_dfs = []
-
-        # Iterar sobre los nombres de archivo
-        for file_name in file_names:
-            # Leer archivo CSV en un dataframe
-            df = pd.read_csv(file_name)
-
-            # Aplicar la función select_columns_and_add_season y renombrar las columnas
-            df_processed = select_columns_and_add_season(df, file_name).rename(columns={'B365H': 'odd_1', 'B365D': 'odd_x', 'B365A': 'odd_2'})
+        # Leer los archivos CSV a la vez en varios hilos. Solo se leen las columnas necesarias, y los que no han cambiado desde la
+        # última vez se cogen de la caché
+        with ThreadPoolExecutor(max_workers=n_hilos) as executor:
+            dfs = list(executor.map(lambda file_name: self.leer_cuotas(file_name, ruta_cache), file_names))
 
-            # Agregar el dataframe procesado a la lista
-            processed_dfs.append(df_processed)
+        # Aplicar la función select_columns_and_add_season y renombrar las columnas
+        processed_dfs = [select_columns_and_add_season(df, file_name).rename(columns={'B365H': 'odd_1', 'B365D': 'odd_x', 'B365A': 'odd_2'})
+                         for df, file_name in zip(dfs, file_names)]
 
         # Concatenar todos los dataframes procesados en uno solo
         final_df = pd.concat(processed_dfs, ignore_index=True)
@@ -259,542 +314,607 @@ class data_processing():
         final_df['AwayTeam'] = final_df['AwayTeam'].astype(int)
 
         return final_df
+
+    def leer_cuotas(self, file_name, ruta_cache=None):
+        '''Lee un archivo de cuotas con las únicas columnas que se usan. Si se pasa ruta_cache, el resultado se guarda en esa carpeta
+        con una clave que depende de la fecha de modificación y el tamaño del archivo, así que las temporadas pasadas, que no cambian,
+        no se vuelven a leer'''
+        if ruta_cache is None:
+            return pd.read_csv(file_name, usecols=COLUMNAS_CUOTAS)
+
+        estado = os.stat(file_name)
+        clave = hashlib.sha1(f'{os.path.abspath(file_name)}|{estado.st_mtime_ns}|{estado.st_size}'.encode()).hexdigest()[:16]
+        nombre = os.path.splitext(os.path.basename(file_name))[0]
+        ruta = os.path.join(ruta_cache, f'{nombre}-{clave}.pkl')
+
+        if os.path.exists(ruta):
+            return pd.read_pickle(ruta)
+
+        df = pd.read_csv(file_name, usecols=COLUMNAS_CUOTAS)
+
+        #Borro las versiones anteriores del mismo archivo y guardo la nueva
+        os.makedirs(ruta_cache, exist_ok=True)
+        for ruta_antigua in glob.glob(os.path.join(ruta_cache, f'{nombre}-*.pkl')):
+            os.remove(ruta_antigua)
+        df.to_pickle(ruta)
+
+        return df
         
+    def posiciones_union(self, izquierda, derecha, claves_izquierda, claves_derecha, how):
+        '''Posiciones de las filas de izquierda y de derecha que forman cada fila de pd.merge(izquierda, derecha, how=how) con esas
+        claves, en el mismo orden que el merge (también con claves repetidas). Solo se unen las columnas de las claves, no las
+        tablas enteras. La posición de derecha es -1 en las filas de la izquierda sin pareja'''
+        claves = [f'clave_{i}' for i in range(len(claves_izquierda))]
+        df_izquierda = pd.DataFrame({clave: izquierda[columna].to_numpy() for clave, columna in zip(claves, claves_izquierda)})
+        df_izquierda['fila_izquierda'] = np.arange(len(izquierda))
+        df_derecha = pd.DataFrame({clave: derecha[columna].to_numpy() for clave, columna in zip(claves, claves_derecha)})
+        df_derecha['fila_derecha'] = np.arange(len(derecha))
+
+        df_union = pd.merge(df_izquierda, df_derecha, on=claves, how=how)
+        return df_union['fila_izquierda'].to_numpy(), df_union['fila_derecha'].fillna(-1).to_numpy(dtype=np.int64)
+
+    def bloque_jugadores(self, df_jugadores, filas):
+        '''Filas (posiciones, -1 para un partido sin datos) de la tabla dispersa partido x jugador de pivot_disperso, sin
+        fixture_id. Se toman sobre la matriz CSR, así que no se copia ni se rellena columna a columna'''
+        columnas = df_jugadores.columns.drop('fixture_id')
+        #La matriz se monta directamente con los índices de los SparseArray de cada columna, en el orden de las columnas.
+        #.sparse.to_coo() crea una Series por columna, que con decenas de miles de jugadores es casi todo el tiempo de la unión
+        arrays = [valores.array for columna, valores in df_jugadores.items() if columna != 'fixture_id']
+        indptr = np.cumsum([0] + [len(array.sp_index.indices) for array in arrays])
+        indices = np.concatenate([array.sp_index.indices for array in arrays] + [np.zeros(0, dtype=np.int32)])
+        datos = np.concatenate([array.sp_values for array in arrays] + [np.zeros(0, dtype=np.uint8)])
+        matriz = sparse.csc_matrix((datos, indices, indptr), shape=(len(df_jugadores), len(columnas))).tocsr()
+        #Una fila vacía al final, que es la que coge la posición -1
+        matriz = sparse.vstack([matriz, sparse.csr_matrix((1, len(columnas)), dtype=matriz.dtype)], format='csr')
+        return pd.DataFrame.sparse.from_spmatrix(matriz[filas], columns=columnas)
+
     def creacion_df_final(self, df_lesionados, df_alineaciones, df_datos_partidos, df_estadisticas, df_cuotas):
-        '''Esta función hace un merge de todos los datos sacados anteriormente'''
-        #Comenzamos la unión de dataframes, empezando por los datos de partidos y estadísticas
-        df_final = pd.merge(df_datos_partidos, df_estadisticas, on='fixture_id', how='left')
-        
-        #Elimino las filas en las que la API no me devuelve un solo valor(ha pasado)
-        rows_with_all_missing = df_final.loc[:, 'shots_on_goal_local':].isna().all(axis=1)
-        df_final = df_final[~rows_with_all_missing]
-        
-        #Unimos el df resultante con el de lesionados
-        df_final = pd.merge(df_final,df_lesionados, on='fixture_id', how = 'left')
-        #Relleno los missings con 0, ya que significa que en esos partidos no ha habido lesionados
-        df_final = df_final.fillna(0)
-        
-        #Unimos el df_final con el de alineaciones, que es el que faltaría.
-        df_final = pd.merge(df_final, df_alineaciones, on='fixture_id', how='left')
-        #Relleno los missings con 0, ya que significa que en esos partidos no habría participado ese jugador
-        df_final = df_final.fillna(0)
-        
-        #Unimos el df_final con el de odds
-        df_final = pd.merge(df_final, df_cuotas, left_on=['id_equipo_local', 'id_equipo_visitante', 'season'], 
-                            right_on=['HomeTeam', 'AwayTeam', 'season'], how='inner')
-        
-        #Eliminamos filas con NaN
-        df_final = df_final.dropna(how='any')
-        df_final = df_final.drop(['HomeTeam','AwayTeam'], axis=1)
-        
-        df_final = df_final.reset_index()
+        '''Esta función hace un merge de todos los datos sacados anteriormente. El resultado es el de unir los partidos con sus
+        estadísticas (quitando los que no tienen ninguna), con los lesionados y titulares (a 0 si el partido no tiene) y con las
+        cuotas por (local, visitante, temporada). Las uniones se hacen solo con las claves para saber qué fila de cada tabla va en
+        cada fila del resultado, y cada tabla se alinea una única vez al final, en vez de copiar las miles de columnas de jugadores
+        en cada merge y en cada fillna'''
+        #Partidos y estadísticas, quitando las filas en las que la API no me devuelve un solo valor (ha pasado)
+        filas_partidos, filas_estadisticas = self.posiciones_union(df_datos_partidos, df_estadisticas, ['fixture_id'], ['fixture_id'], 'left')
+        columnas_estadisticas = [col for col in df_estadisticas.columns if col != 'fixture_id']
+        columnas_con_datos = columnas_estadisticas[columnas_estadisticas.index('shots_on_goal_local'):]
+        sin_datos = np.append(df_estadisticas[columnas_con_datos].isna().all(axis=1).to_numpy(), True)
+        validas = ~sin_datos[filas_estadisticas]
+        filas_partidos, filas_estadisticas = filas_partidos[validas], filas_estadisticas[validas]
+
+        #Unión con las cuotas. Se quitan los partidos sin cuotas, y en los que hay alguna cuota vacía
+        columnas_cuotas = [col for col in df_cuotas.columns if col not in ('HomeTeam', 'AwayTeam', 'season')]
+        df_claves = df_datos_partidos[['id_equipo_local', 'id_equipo_visitante', 'season']].take(filas_partidos)
+        filas_union, filas_cuotas = self.posiciones_union(df_claves, df_cuotas, ['id_equipo_local', 'id_equipo_visitante', 'season'],
+                                                          ['HomeTeam', 'AwayTeam', 'season'], 'inner')
+        #'index' es la posición del partido en la unión con las cuotas antes de quitar los que tienen cuotas vacías
+        completas = df_cuotas[columnas_cuotas].notna().all(axis=1).to_numpy()[filas_cuotas]
+        indice = np.flatnonzero(completas)
+        filas_union, filas_cuotas = filas_union[completas], filas_cuotas[completas]
+        filas_partidos, filas_estadisticas = filas_partidos[filas_union], filas_estadisticas[filas_union]
+
+        #Lesionados y titulares de cada partido. Sus tablas tienen un fixture_id por fila
+        fixtures = df_datos_partidos['fixture_id'].to_numpy()[filas_partidos]
+        filas_lesionados = pd.Index(df_lesionados['fixture_id']).get_indexer(fixtures)
+        filas_alineaciones = pd.Index(df_alineaciones['fixture_id']).get_indexer(fixtures)
+
+        #Alineación de cada tabla con las filas del resultado
+        bloques = [df_datos_partidos.take(filas_partidos).reset_index(drop=True),
+                   df_estadisticas[columnas_estadisticas].take(filas_estadisticas).reset_index(drop=True)]
+        #Relleno los missings con 0 (árbitro, goles al descanso...) solo en las tablas que tienen alguno
+        bloques = [bloque.fillna(0) if bloque.isna().any(axis=None) else bloque for bloque in bloques]
+        #Las category (árbitro y estadio con leer_csv) se quedan solo con los valores de los partidos que quedan. El 0 de los partidos
+        #sin árbitro, si no queda ninguno, impediría guardar el dataset en parquet al mezclar números y texto
+        for bloque in bloques:
+            for columna in bloque.select_dtypes('category'):
+                bloque[columna] = bloque[columna].cat.remove_unused_categories()
+        #En los partidos sin lesionados o sin alineación, los jugadores quedan a 0
+        bloques += [self.bloque_jugadores(df_lesionados, filas_lesionados), self.bloque_jugadores(df_alineaciones, filas_alineaciones),
+                    df_cuotas[columnas_cuotas].take(filas_cuotas).reset_index(drop=True)]
+
+        #La tabla se crea una sola vez con los arrays de todas las columnas. pd.concat rehace (y copia) cada SparseArray de jugadores
+        columnas = {'index': indice}
+        for bloque in bloques:
+            columnas.update((columna, valores.array) for columna, valores in bloque.items())
+        df_final = pd.DataFrame(columnas, copy=False)
 
         #Para agilizar tiempos en métedos que necesitan esta tabla para usarse, ya que tarda un poco en ejecutarse.
         #df_final.to_csv('df_partidos_completo.csv', index=False)
         
         return df_final
         
-    def creacion_nuevas_variables(self, df_final):
-        '''Esta función creará una nueva variable que se me ha ocurrido: los lanzamientos necesarios para marcar gol'''
+    def apariciones_jugadores(self, df):
+        '''Tabla larga de las columnas les-/titu- de df: una fila por jugador lesionado o titular en cada partido, con fila (posición
+        del partido en df), id_jugador y titular (False si está lesionado). Se lee de los índices de cada SparseArray, sin
+        densificar la tabla de jugadores'''
+        filas, jugadores, titular = [], [], []
+        for columna, valores in df.items():
+            if not columna.startswith(('les-', 'titu-')):
+                continue
+            array = valores.array
+            if isinstance(array, pd.arrays.SparseArray):
+                posiciones = array.sp_index.indices[np.asarray(array.sp_values) != 0]
+            else:
+                posiciones = np.flatnonzero(np.asarray(array, dtype=float))
+            prefijo, id_jugador = columna.split('-', 1)
+            filas.append(posiciones)
+            jugadores.append(np.full(len(posiciones), int(float(id_jugador)), dtype=np.int64))
+            titular.append(np.full(len(posiciones), prefijo == 'titu'))
+
+        vacio = [np.zeros(0, dtype=np.int64)]
+        return pd.DataFrame({'fila': np.concatenate(filas + vacio).astype(np.int64),
+                             'id_jugador': np.concatenate(jugadores + vacio),
+                             'titular': np.concatenate(titular + [np.zeros(0, dtype=bool)])})
+
+    def variables_alineacion(self, df_partidos):
+        '''Variables de alineación de cada partido de df_partidos (ver fuerza_alineaciones.variables), calculadas solo con los
+        partidos anteriores a cada uno. Son diez columnas numéricas que resumen las miles de columnas les-/titu-'''
+        apariciones = self.apariciones_jugadores(df_partidos)
+        return fuerza_alineaciones.desde_historico(df_partidos, apariciones).variables(df_partidos, apariciones)
+
+    def fuga_variables_alineacion(self, df_partidos, cortes=(0.25, 0.5, 0.75)):
+        '''Comprueba que las variables de alineación de cada partido solo usan los partidos anteriores. Para cada corte (fracción de
+        los partidos, en orden de fecha_timestamp) las calcula solo con los partidos hasta el corte y las compara con las del
+        histórico completo en esas mismas filas, que no tienen que cambiar al añadir partidos posteriores. Devuelve un dataframe con
+        una fila por corte: partidos, filas distintas y mayor diferencia'''
+        df_partidos = self.ordenar_por_fecha(df_partidos).reset_index(drop=True)
+        completo = self.variables_alineacion(df_partidos)
+        comparaciones = []
+        for corte in cortes:
+            n = int(len(df_partidos) * corte)
+            truncado = self.variables_alineacion(df_partidos.iloc[:n])
+            diferencias = (truncado - completo.iloc[:n]).abs().to_numpy()
+            comparaciones.append({'corte': corte, 'partidos': n, 'filas_distintas': int((diferencias > 1e-9).any(axis=1).sum()),
+                                  'diferencia_maxima': float(diferencias.max()) if n else 0.0})
+        return pd.DataFrame(comparaciones)
+
+    def tiros_para_marcar_previos(self, df_final, lado):
+        '''Lanzamientos necesarios para marcar gol en los 3 partidos anteriores del equipo como local (lado='local') o visitante
+        (lado='away'), en el orden de filas de df_final. Sin rellenar con la media los partidos en los que no se puede calcular'''
+        columna_equipo, columna_goles = COLUMNAS_LADO[lado]
+        columna_tiros = f'total_shots_{lado}'
+        motor = ventanas_equipo(df_final[columna_equipo].to_numpy())
+        valores = motor.ordenar(df_final[[columna_goles, columna_tiros]])
+
+        #Se cogen la suma de los goles y lanzamientos de los tres ultimos partidos como local/visitante
+        previos = motor.suma_ordenados(valores, 3)
+        #En el caso de nulos, se coge el siguiente partido(en rara ocasión habrá nulos)
+        previos = np.where(np.isnan(previos), motor.desplazar_ordenados(valores, -1), previos)
+        goles_previos, tiros_previos = motor.desordenar(previos).T
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.Series(np.where(goles_previos == 0, tiros_previos, tiros_previos / goles_previos), index=df_final.index)
+
+    def tomar_filas(self, df, posiciones):
+        '''df.take(posiciones) columna a columna. DataFrame.take y sort_values pasan a Sparse[int64] las columnas dispersas de uint8
+        que tienen algún valor, y SparseArray.take mantiene su tipo, así que las columnas de jugadores siguen en Sparse[uint8]'''
+        return pd.DataFrame({columna: valores.array.take(posiciones) for columna, valores in df.items()},
+                            index=df.index.take(posiciones), copy=False)
+
+    def ordenar_por_fecha(self, df):
+        '''df.sort_values(by='fecha_timestamp') con tomar_filas, en el mismo orden'''
+        return self.tomar_filas(df, np.argsort(df['fecha_timestamp'].to_numpy(), kind='quicksort'))
+
+    def creacion_nuevas_variables(self, df_final, forma=None, alineacion=False):
+        '''Esta función creará una nueva variable que se me ha ocurrido: los lanzamientos necesarios para marcar gol. Si se pasa forma
+        (diccionario con los parámetros de variables_forma, por ejemplo {'ventanas': [3, 5, 10, 0.3]}) se añaden también las
+        variables de forma de los partidos anteriores de cada equipo. Con alineacion=True se añaden las variables de alineación
+        (variables_alineacion) y el modelo se entrena con ellas en lugar de con las columnas de cada jugador, que se quedan en el
+        dataset para poder recalcularlas'''
         #Se cogen la suma de los goles y lanzamientos de los tres ultimos partidos como local/visitante para calcular el número de 
         #lanzamientos que se necesitan para marcar gol.
-        df_final['goles_local_previos'] =   df_final.groupby('id_equipo_local')['goles_local'].shift(1) + \
-                                    df_final.groupby('id_equipo_local')['goles_local'].shift(2) + \
-                                    df_final.groupby('id_equipo_local')['goles_local'].shift(3)
+        df_final['tiros_para_marcar_local'] = self.tiros_para_marcar_previos(df_final, 'local')
+        df_final['tiros_para_marcar_away'] = self.tiros_para_marcar_previos(df_final, 'away')
         
-        df_final['tiros_local_previos'] =   df_final.groupby('id_equipo_local')['total_shots_local'].shift(1) + \
-                                    df_final.groupby('id_equipo_local')['total_shots_local'].shift(2) + \
-                                    df_final.groupby('id_equipo_local')['total_shots_local'].shift(3)
-        #En el caso de nulos, se coge el siguiente partido(en rara ocasión habrá nulos)
-        df_final['goles_local_previos'] = df_final['goles_local_previos'].fillna(df_final.groupby('id_equipo_local')['goles_local'].shift(-1))
-        df_final['tiros_local_previos'] = df_final['tiros_local_previos'].fillna(df_final.groupby('id_equipo_local')['total_shots_local'].shift(-1))
+        df_final = self.ordenar_por_fecha(df_final)
+        
+        df_final['tiros_para_marcar_local'] = df_final['tiros_para_marcar_local'].fillna(df_final['tiros_para_marcar_local'].mean())
+        df_final['tiros_para_marcar_away'] = df_final['tiros_para_marcar_away'].fillna(df_final['tiros_para_marcar_away'].mean())
 
+        #Las variables de forma se calculan ya en orden cronológico
+        if forma is not None:
+            df_final = pd.concat([df_final, self.variables_forma(df_final, **forma)], axis=1)
 
-        df_final['tiros_para_marcar_local'] = np.where(df_final['goles_local_previos'] == 0, 
-                                            df_final['tiros_local_previos'], 
-                                            df_final['tiros_local_previos'] / df_final['goles_local_previos'])
+        if alineacion:
+            df_final = pd.concat([df_final, self.variables_alineacion(df_final)], axis=1)
         
-        df_final['goles_away_previos'] =    df_final.groupby('id_equipo_visitante')['goles_visitante'].shift(1) + \
-                                    df_final.groupby('id_equipo_visitante')['goles_visitante'].shift(2) + \
-                                    df_final.groupby('id_equipo_visitante')['goles_visitante'].shift(3)
+        return df_final
 
-        
-        df_final['tiros_away_previos'] =    df_final.groupby('id_equipo_visitante')['total_shots_away'].shift(1) + \
-                                    df_final.groupby('id_equipo_visitante')['total_shots_away'].shift(2) + \
-                                    df_final.groupby('id_equipo_visitante')['total_shots_away'].shift(3)
+    def columna_estadistica(self, estadistica, lado):
+        '''Columna con la estadística del equipo local (lado='local') o visitante (lado='away'). 'goles' es goles_local/goles_visitante'''
+        return COLUMNAS_LADO[lado][1] if estadistica == 'goles' else f'{estadistica}_{lado}'
+
+    def variables_forma(self, df, estadisticas=None, ventanas=(3, 5, 10), sedes=('sede', 'todos'), siguiente=False):
+        '''Variables de forma de los dos equipos de cada partido de df (en orden cronológico), calculadas solo con sus partidos
+        anteriores. Para cada estadística (por defecto ESTADISTICAS y 'goles'), cada ventana (int k: suma de los k partidos
+        anteriores, float alpha: media con decaimiento exponencial) y cada sede ('sede': el local en sus partidos en casa y el
+        visitante en sus partidos fuera, como tiros_para_marcar; 'todos': todos sus partidos, en casa o fuera) crea la columna
+        'forma_<estadistica>_<local|away>_<sede>_<ventana>' (por ejemplo forma_total_shots_local_todos_u5).
+
+        Cada sede ordena los partidos por equipo una sola vez y calcula todas las estadísticas y ventanas sobre esos arrays, así
+        que añadir estadísticas o ventanas no añade más groupby. Con siguiente=True devuelve también, para cada lado, la forma de
+        cada equipo para su próximo partido (indexada por id de equipo), que es lo que usa el feature_store'''
+        estadisticas = ESTADISTICAS + ['goles'] if estadisticas is None else list(estadisticas)
+        n_partidos = len(df)
+        ids = {lado: df[columna_equipo].to_numpy() for lado, (columna_equipo, _) in COLUMNAS_LADO.items()}
+        valores = {lado: df[[self.columna_estadistica(estadistica, lado) for estadistica in estadisticas]].to_numpy(dtype=float)
+                   for lado in COLUMNAS_LADO}
+
+        columnas = {}
+        formas_siguiente = {lado: {} for lado in COLUMNAS_LADO}
+
+        def calcular(equipos, valores_entradas, lados_entradas, sede):
+            #Se añade al final una entrada vacía por equipo: su ventana es la forma del equipo para el siguiente partido
+            equipos_siguiente = np.unique(equipos) if siguiente else equipos[:0]
+            valores_entradas = np.vstack([valores_entradas, np.full((len(equipos_siguiente), len(estadisticas)), np.nan)])
+            resultados = ventanas_equipo(np.r_[equipos, equipos_siguiente]).calcular(valores_entradas, ventanas)
+            for nombre, resultado in resultados.items():
+                for lado, entradas in lados_entradas.items():
+                    for j, estadistica in enumerate(estadisticas):
+                        columna = f'forma_{estadistica}_{lado}_{sede}_{nombre}'
+                        columnas[columna] = resultado[entradas, j]
+                        formas_siguiente[lado][columna] = pd.Series(resultado[len(equipos):, j], index=equipos_siguiente)
+
+        for sede in sedes:
+            if sede == 'sede':
+                for lado in COLUMNAS_LADO:
+                    calcular(ids[lado], valores[lado], {lado: slice(0, n_partidos)}, sede)
+            elif sede == 'todos':
+                #Entradas intercaladas (local y visitante de cada partido) para que cada equipo mantenga el orden de sus partidos
+                equipos = np.column_stack([ids['local'], ids['away']]).ravel()
+                valores_entradas = np.stack([valores['local'], valores['away']], axis=1).reshape(2 * n_partidos, len(estadisticas))
+                calcular(equipos, valores_entradas, {'local': slice(0, 2 * n_partidos, 2), 'away': slice(1, 2 * n_partidos, 2)}, sede)
+            else:
+                raise ValueError(f"sede tiene que ser 'sede' o 'todos', no '{sede}'")
+
+        df_forma = pd.DataFrame(columnas, index=df.index)
+        if siguiente:
+            return df_forma, {lado: pd.DataFrame(formas) for lado, formas in formas_siguiente.items()}
+        return df_forma
+
+    def especificacion_forma(self, columnas):
+        '''Parámetros de variables_forma que generan las columnas forma_ de columnas, o None si no hay ninguna'''
+        estadisticas, ventanas, sedes = {}, {}, {}
+        for columna in columnas:
+            if columna.startswith('forma_'):
+                estadistica, _, sede, ventana = columna[len('forma_'):].rsplit('_', 3)
+                estadisticas[estadistica] = sedes[sede] = ventanas[ventana] = None
+        if not estadisticas:
+            return None
+        return {'estadisticas': list(estadisticas), 'ventanas': [ventana_de_nombre(ventana) for ventana in ventanas], 'sedes': list(sedes)}
+
+    def actualizacion_incremental(self, df_final, df_datos_generales, df_estadisticas, df_alineaciones, df_lesionados, file_names_cuotas, df_ids):
+        '''Añade a df_final (salida de creacion_nuevas_variables) solo los partidos nuevos, sin reconstruir todo el dataset. Los
+        dataframes de datos generales, estadísticas, alineaciones y lesionados tienen únicamente las filas nuevas de cada archivo en bruto,
+        y file_names_cuotas son los archivos de cuotas de la temporada actual. Las filas nuevas se entienden añadidas al final de los
+        archivos en bruto, y así el resultado es el mismo que reconstruir todo con creacion_df_final y creacion_nuevas_variables'''
+        #Solo se procesan los partidos que no estén ya en df_final
+        df_datos_generales = df_datos_generales[~df_datos_generales['fixture_id'].isin(df_final['fixture_id'])].copy()
+        if len(df_datos_generales) == 0:
+            return self.ordenar_por_fecha(df_final)
+
+        #Procesado de los partidos nuevos, igual que en la reconstrucción completa
+        df_datos_generales_procesado = self.procesado_datos_generales(df_datos_generales)
+        df_estadisticas_procesado = self.procesado_estadisticas(df_estadisticas)
+        df_lesionados_procesado = self.procesado_lesionados(df_lesionados)
+        df_alineaciones_procesado = self.pivot_disperso(df_alineaciones, 'id_jugador_titular', 'titu-', nombre_id=float)
+        df_cuotas_procesado = self.procesado_cuotas(file_names_cuotas, df_ids)
+
+        #procesado_titulares descarta el jugador con el id más bajo del histórico, que por eso no tiene columna en df_final
+        id_titular_minimo = min(float(col.split('-', 1)[1]) for col in df_final.columns if col.startswith('titu-'))
+        columnas_descartadas = [col for col in df_alineaciones_procesado.columns[1:] if float(col.split('-', 1)[1]) < id_titular_minimo]
+        df_alineaciones_procesado = df_alineaciones_procesado.drop(columnas_descartadas, axis=1)
+
+        df_nuevos = self.creacion_df_final(df_lesionados=df_lesionados_procesado,
+                                           df_alineaciones=df_alineaciones_procesado,
+                                           df_datos_partidos=df_datos_generales_procesado,
+                                           df_estadisticas=df_estadisticas_procesado,
+                                           df_cuotas=df_cuotas_procesado)
+        #Los partidos nuevos van detrás de los que ya había
+        df_nuevos['index'] = df_nuevos['index'] + df_final['index'].max() + 1
+
+        #Amplío el vocabulario de jugadores: cada parte recibe a 0 las columnas de jugadores que solo tiene la otra
+        def ampliar_jugadores(df, columnas):
+            df_ceros = pd.DataFrame.sparse.from_spmatrix(sparse.csr_matrix((len(df), len(columnas)), dtype=np.uint8), index=df.index,
+                                                         columns=columnas)
+            return pd.concat([df, df_ceros], axis=1)
+
+        def es_jugador(col):
+            return col.startswith(('les-', 'titu-'))
+
+        df_final = ampliar_jugadores(df_final, [col for col in df_nuevos.columns if es_jugador(col) and col not in df_final.columns])
+        df_nuevos = ampliar_jugadores(df_nuevos, [col for col in df_final.columns if es_jugador(col) and col not in df_nuevos.columns])
+
+        #Mismo orden de columnas que la reconstrucción completa: lesionados y titulares ordenados por id de jugador
+        def id_jugador(col):
+            return float(col.split('-', 1)[1])
+
+        columnas_les = sorted([col for col in df_final.columns if col.startswith('les-')], key=id_jugador)
+        columnas_titu = sorted([col for col in df_final.columns if col.startswith('titu-')], key=id_jugador)
+        columnas_otras = [col for col in df_nuevos.columns if not es_jugador(col)]
+        posicion_jugadores = list(df_nuevos.columns).index(next(col for col in df_nuevos.columns if es_jugador(col)))
+        posicion_jugadores = len([col for col in df_nuevos.columns[:posicion_jugadores] if not es_jugador(col)])
+        columnas = columnas_otras[:posicion_jugadores] + columnas_les + columnas_titu + columnas_otras[posicion_jugadores:]
+
+        columnas_tiros = ['tiros_para_marcar_local', 'tiros_para_marcar_away']
+        df_completo = pd.concat([df_final[columnas], df_nuevos[columnas]], ignore_index=True)
+
+        #Las reordenaciones y el cálculo de variables se hacen sobre una tabla pequeña con las columnas necesarias, y al final se
+        #reordena df_completo una sola vez. Empiezo en el orden en el que salen los partidos de creacion_df_final ('index')
+        df_claves = df_completo[['index', 'id_equipo_local', 'id_equipo_visitante', 'season', 'fecha_timestamp',
+                                 'goles_local', 'goles_visitante', 'total_shots_local', 'total_shots_away']].copy()
+        df_claves[columnas_tiros] = pd.concat([df_final[columnas_tiros], df_nuevos.reindex(columns=columnas_tiros)], ignore_index=True)
+        df_claves = df_claves.sort_values(by='index', kind='stable')
+
+        #El merge con las cuotas de creacion_df_final deja juntos los partidos con la misma clave (local, visitante, temporada) en el
+        #orden de su primera aparición, así que un partido nuevo puede quedar entre los que ya había. Renumero 'index' de la misma forma
+        orden = df_claves.groupby(['id_equipo_local', 'id_equipo_visitante', 'season'], sort=False).ngroup()
+        df_claves = df_claves.iloc[np.argsort(orden.to_numpy(), kind='stable')]
+        posiciones = df_claves.index.to_numpy()
+        df_claves.index = np.arange(len(df_claves))
+
+        #Solo se recalculan las variables de los equipos que juegan algún partido nuevo
+        for lado, (columna_equipo, columna_goles) in COLUMNAS_LADO.items():
+            columna = f'tiros_para_marcar_{lado}'
+            afectados = df_claves[columna_equipo].isin(df_nuevos[columna_equipo])
+            df_claves.loc[afectados, columna] = self.tiros_para_marcar_previos(df_claves[afectados], lado)
+
+            #En el resto de equipos solo cambia el relleno con la media: se rellenó el último partido de los equipos que tienen 3 o
+            #menos, porque no tienen partidos anteriores ni siguiente que coger. Los vuelvo a dejar vacíos para rellenarlos con la media nueva
+            grupos = df_claves.loc[~afectados].groupby(columna_equipo)
+            sin_previos = (grupos.cumcount(ascending=False) == 0) & (grupos[columna_equipo].transform('size') <= 3)
+            df_claves.loc[sin_previos.index[sin_previos], columna] = np.nan
+
+        df_claves = df_claves.sort_values(by='fecha_timestamp', ascending=True)
+
+        df_completo = self.tomar_filas(df_completo, posiciones[df_claves.index])
+        df_completo.index = df_claves.index
+        df_completo['index'] = df_claves.index
+        df_completo['tiros_para_marcar_local'] = df_claves['tiros_para_marcar_local'].fillna(df_claves['tiros_para_marcar_local'].mean())
+        df_completo['tiros_para_marcar_away'] = df_claves['tiros_para_marcar_away'].fillna(df_claves['tiros_para_marcar_away'].mean())
+
+        #Las variables de forma son una sola pasada vectorizada, así que se recalculan enteras en el orden final
+        forma = self.especificacion_forma(df_final.columns)
+        if forma is not None:
+            df_forma = self.variables_forma(df_completo, **forma)
+            df_completo = pd.concat([df_completo, df_forma[[col for col in df_final.columns if col in df_forma.columns]]], axis=1)
+
+        #Las de alineación dependen de todos los partidos anteriores de cada jugador, y también se recalculan enteras
+        if tiene_variables_alineacion(df_final.columns):
+            df_completo = pd.concat([df_completo, self.variables_alineacion(df_completo)], axis=1)
+
+        return df_completo
+
+
+    def guardar_dataset(self, df_final, ruta):
+        '''Guarda el dataset procesado en parquet con tipos compactos (ver TIPOS_DATASET), en lugar de un csv con miles de columnas de
+        ceros en texto. Se lee con cargar_dataset'''
+        columnas_jugadores = [col for col in df_final.columns if col.startswith(('les-', 'titu-'))]
+        df_guardar = df_final.drop(columnas_jugadores, axis=1).astype({col: tipo for col, tipo in TIPOS_DATASET.items() if col in df_final.columns})
+
+        #Las columnas de jugadores pueden venir dispersas (procesado_titulares/procesado_lesionados) o densas
+        if all(isinstance(df_final[col].dtype, pd.SparseDtype) for col in columnas_jugadores):
+            matriz_jugadores = df_final[columnas_jugadores].sparse.to_coo().toarray()
+        else:
+            matriz_jugadores = df_final[columnas_jugadores].to_numpy()
+        df_jugadores = pd.DataFrame(matriz_jugadores.astype(np.uint8), columns=columnas_jugadores, index=df_final.index)
 
-        df_final['goles_away_previos'] = df_final['goles_away_previos'].fillna(df_final.groupby('id_equipo_visitante')['goles_visitante'].shift(-1))
-        df_final['tiros_away_previos'] = df_final['tiros_away_previos'].fillna(df_final.groupby('id_equipo_visitante')['total_shots_away'].shift(-1))
+        df_guardar = pd.concat([df_guardar, df_jugadores], axis=1)[list(df_final.columns)]
+        df_guardar.to_parquet(ruta, index=False)
 
+        return f"Dataset guardado en '{ruta}'."
 
-        df_final['tiros_para_marcar_away'] = np.where(df_final['goles_away_previos'] == 0, 
-                                            df_final['tiros_away_previos'], 
-                                            df_final['tiros_away_previos'] / df_final['goles_away_previos'])
+    def columnas_dataset(self, ruta):
+        '''Nombres de las columnas del dataset guardado, leídos del esquema del parquet sin cargar ningún dato'''
+        import pyarrow.parquet as pq
 
-        df_final = df_final.drop(['tiros_away_previos','goles_away_previos','tiros_local_previos','goles_local_previos'], axis=1)
-        
-        df_final = df_final.sort_values(by='fecha_timestamp', ascending=True)
-        
-        df_final['tiros_para_marcar_local'] = df_final['tiros_para_marcar_local'].fillna(df_final['tiros_para_marcar_local'].mean())
-        df_final['tiros_para_marcar_away'] = df_final['tiros_para_marcar_away'].fillna(df_final['tiros_para_marcar_away'].mean())
+        return pq.read_schema(ruta).names
+
+    def cargar_dataset(self, ruta, columnas=None):
+        '''Lee el dataset guardado con guardar_dataset. Con columnas se leen únicamente esas columnas del parquet. Las columnas de
+        jugadores se vuelven a dejar dispersas, igual que salen de creacion_df_final'''
+        df_final = pd.read_parquet(ruta, columns=columnas)
+
+        columnas_jugadores = [col for col in df_final.columns if col.startswith(('les-', 'titu-'))]
+        if len(columnas_jugadores) > 0:
+            matriz_jugadores = sparse.csr_matrix(df_final[columnas_jugadores].to_numpy())
+            df_jugadores = pd.DataFrame.sparse.from_spmatrix(matriz_jugadores, index=df_final.index, columns=columnas_jugadores)
+            df_final = pd.concat([df_final.drop(columnas_jugadores, axis=1), df_jugadores], axis=1)[list(df_final.columns)]
 
-        
         return df_final
 
+    def columnas_prediccion(self, columnas):
+        '''De todas las columnas del dataset, las que hacen falta para crear el feature_store: ids de equipos, goles, estadísticas y
+        tiros para marcar. Las columnas de jugadores no se leen, solo se necesitan sus nombres, salvo si el dataset tiene las
+        variables de alineación: entonces hacen falta los jugadores, la temporada y la fecha de cada partido para fuerza_alineaciones'''
+        necesarias = ['id_equipo_local', 'id_equipo_visitante', 'goles_local', 'goles_visitante',
+                      'tiros_para_marcar_local', 'tiros_para_marcar_away'] + \
+                     [f'{estadistica}_{lado}' for estadistica in ESTADISTICAS for lado in ['local', 'away']]
+        if tiene_variables_alineacion(columnas):
+            necesarias += ['season', 'fecha_timestamp'] + [col for col in columnas if col.startswith(('les-', 'titu-'))]
+        necesarias = set(necesarias)
+        return [col for col in columnas if col in necesarias]
 
 
     #Las funciones siguientes tendrán únicamente la utilidad de crear datos nuevos.
+    def cargar_buscador(self, ruta='data/raw_files'):
+        '''Crea una sola vez por instancia los índices de búsqueda de equipos, jugadores, árbitros y estadios (ver buscador). Las
+        funciones de búsqueda siguientes lo usan, así que ninguna vuelve a leer los CSV'''
+        if getattr(self, 'indices_busqueda', None) is None:
+            self.indices_busqueda = buscador(ruta)
+        return self.indices_busqueda
+
     def buscar_jugador(self, id_equipo, temporada_equipo):
         ''' Esta función únicamente será llamada para localizar los ids de jugadores y poder crear los datos nuevos'''
+        # Plantilla del equipo en esa temporada, ya agrupada al crear el buscador
+        return self.cargar_buscador().plantilla(id_equipo, temporada_equipo)
 
-        df = pd.read_csv("df_diccionario_jugadores.csv")
-
-        # Filtre el DataFrame original utilizando los valores de los parámetros
-        filtro = (df['id_equipo'] == id_equipo) & (df['temporada_equipo'] == temporada_equipo)
-        df_filtrado = df[filtro]
-
-        # Devuelva el DataFrame filtrado
-        return df_filtrado
-
-    def buscar_equipo(self, nombres):
+    def buscar_equipo(self, nombres, n_resultados=5):
         ''' Esta función únicamente será llamada para localizar los ids delos equipos y poder crear los datos nuevos. Acepta una lista de nombres o
-         un único nombre '''
-        # Cargo el diccionario de ids que tengo y fue descargado. Es el mismo que de jugadores
-        equipos = pd.read_csv("df_diccionario_jugadores.csv")
-        # Elimino acentos de los nombres de los equipos en el DataFrame aplicando unidecode. También se quedan en minúsculas
-        equipos['nombre_equipo'] = equipos['equipo_jugador'].apply(lambda x: unidecode(x.lower()))
-        
+         un único nombre. Devuelve las coincidencias de cada nombre ordenadas de mejor a peor, aunque el nombre no esté escrito exacto '''
         if isinstance(nombres, str):
-            # Eliminar las marcas diacríticas del nombre introducido
-            equipo = unidecode(nombres.lower())
-            # Busco los equipos cuyo nombre contenga la cadena de texto introducida como parámetro
-            equipos_coincidentes = equipos[equipos['nombre_equipo'].str.contains(nombres, case=False)]
-            #Elimino los jugadores duplicados, porque pueden salir jugadores repetidos si participaron más de 1 temporada
-            equipos_coincidentes = equipos_coincidentes.drop_duplicates(subset='id_equipo')
-            # Devuelve una tabla con los nombres y los ids de los jugadores encontrados
-            return equipos_coincidentes[['nombre_equipo', 'id_equipo']]
-        
-        elif isinstance(nombres, list):
-            resultados = []
-            # Busco cada id de los jugadores en la lista
-            for n in nombres:
-                # Elimino acentos del nombre introducido
-                equipo = unidecode(n.lower())
-                # Busco los jugadores cuyo nombre contenga la cadena de texto introducida como parámetro
-                equipos_coincidentes = equipos[equipos['nombre_equipo'].str.contains(n, case=False)]
-                # Elimino jugadores duplicados en función del id
-                equipos_coincidentes = equipos_coincidentes.drop_duplicates(subset='id_equipo')
-                # Añado los resultados a la lista de resultados
-                for i, row in equipos_coincidentes.iterrows():
-                    resultados.append([row['nombre_equipo'], row['id_equipo']])
-            # Devuelvo una tabla con los nombres y los IDs de los jugadores encontrados
-            return pd.DataFrame(resultados, columns=['nombre_equipo', 'id_equipo'])
-        
-        else: return 'Introduce una lista de nombres o un nombre único'
-
-    
-    def nombre_arbitro_correcto(self, nombre):
+            nombres = [nombres]
+        elif not isinstance(nombres, list):
+            return 'Introduce una lista de nombres o un nombre único'
 
-        arbitros = pd.read_csv('df_partidos_completo.csv')
-        # Elimino los acentos del nombre introducido
-        arbitro = unidecode(nombre.lower())
-        # Busco los equipos cuyo nombre contenga la cadena de texto introducida como parámetro
-        arbitros_coincidentes = arbitros[arbitros['arbitro'].str.contains(nombre, case=False)]
-        #Elimino los arbitros duplicados, porque pueden salir árbitros repetidos si participaron más de 1 temporada
-        arbitros_coincidentes = arbitros_coincidentes.drop_duplicates(subset='arbitro')
-        if len(arbitros_coincidentes) == 0:
-            return None
-        else:
-            # Obtengo el índice de la fila correspondiente al árbitro
-            indice = arbitros_coincidentes.index[0]
-            # Obtengo el nombre del árbitro con el formato adecuado
-            nombre_completo = arbitros.loc[indice, 'arbitro']
-            # Devuelve el nombre del árbitro con el formato adecuado
-            return nombre_completo
+        resultados = [(nombre, id_equipo, puntuacion) for consulta in nombres
+                      for nombre, id_equipo, puntuacion in self.cargar_buscador().equipos.buscar(consulta, n_resultados)]
+        # Devuelvo una tabla con los nombres y los IDs de los equipos encontrados
+        return pd.DataFrame(resultados, columns=['nombre_equipo', 'id_equipo', 'puntuacion'])
 
+    def nombre_arbitro_correcto(self, nombre):
+        # Nombre del árbitro con el formato adecuado que mejor encaja con el introducido, o None si no se parece a ninguno
+        return self.cargar_buscador().arbitros.mejor(nombre)
 
     def nombre_estadio_correcto(self, nombre):
-        estadios = pd.read_csv('df_partidos_completo.csv')
-        # Elimino los acentos del nombre introducido
-        estadio = unidecode(nombre.lower())
-        # Busco los equipos cuyo nombre contenga la cadena de texto introducida como parámetro
-        estadios_coincidentes = estadios[estadios['estadio'].str.contains(nombre, case=False)]
-        #Elimino los arbitros duplicados, porque pueden salir estadios repetidos si participaron más de 1 temporada
-        estadios_coincidentes = estadios_coincidentes.drop_duplicates(subset='estadio')
-        if len(estadios_coincidentes) == 0:
-            return None
-        else:
-            # Obtengo el índice de la fila correspondiente al estadio
-            indice = estadios_coincidentes.index[0]
-            # Obtengo el nombre del estadio con el formato adecuado
-            nombre_completo = estadios.loc[indice, 'estadio']
-            # Devuelve el nombre del estadio con el formato adecuado
-            return nombre_completo
-    
-    def creacion_datos_nuevos(self, df_partidos,id_equipo_local, id_equipo_visitante,odd_1, odd_x, odd_2, arbitro, estadio, season, ids_lesionados, ids_titulares):
-        #Leo el csv donde estan todos los datos completos de los partidos. Se ha creado con la función creacion_df_final()
-        
-        #Creo los datos de estadisticas que se preveen con la media de datos de los últimos 3 partidos en casa o de visitante
-        shots_on_goal_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_on_goal_local'].shift(1) +  \
-                                df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_on_goal_local'].shift(2) +  \
-                                df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_on_goal_local'].shift(3))
-        shots_on_goal_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_on_goal_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_on_goal_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_on_goal_away'].shift(3))
-        shots_off_goal_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_off_goal_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_off_goal_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_off_goal_local'].shift(3))
-        shots_off_goal_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_off_goal_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_off_goal_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_off_goal_away'].shift(3))
-        total_shots_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_shots_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_shots_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_shots_local'].shift(3))
-        total_shots_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_shots_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_shots_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_shots_away'].shift(3))
-        blocked_shots_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'blocked_shots_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'blocked_shots_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'blocked_shots_local'].shift(3))
-        blocked_shots_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'blocked_shots_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'blocked_shots_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'blocked_shots_away'].shift(3))
-        shots_insidebox_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_insidebox_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_insidebox_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_insidebox_local'].shift(3))
-        shots_insidebox_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_insidebox_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_insidebox_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_insidebox_away'].shift(3))
-        shots_outsidebox_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_outsidebox_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_outsidebox_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_outsidebox_local'].shift(3))
-        shots_outsidebox_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_outsidebox_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_outsidebox_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_outsidebox_away'].shift(3))
-        fouls_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'fouls_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'fouls_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'fouls_local'].shift(3))
-        fouls_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'fouls_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'fouls_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'fouls_away'].shift(3))
-        corners_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'corners_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'corners_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'corners_local'].shift(3))
-        corners_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'corners_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'corners_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'corners_away'].shift(3))
-        offsides_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'offsides_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'offsides_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'offsides_local'].shift(3))
-        offsides_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'offsides_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'offsides_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'offsides_away'].shift(3))
-        ball_possession_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'ball_possession_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'ball_possession_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'ball_possession_local'].shift(3))
-        ball_possession_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'ball_possession_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'ball_possession_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'ball_possession_away'].shift(3))
-        yellow_cards_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'yellow_cards_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'yellow_cards_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'yellow_cards_local'].shift(3))
-        yellow_cards_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'yellow_cards_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'yellow_cards_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'yellow_cards_away'].shift(3))
-        red_cards_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'red_cards_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'red_cards_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'red_cards_local'].shift(3))
-        red_cards_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'red_cards_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'red_cards_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'red_cards_away'].shift(3))
-        goalkeeper_saves_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'goalkeeper_saves_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'goalkeeper_saves_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'goalkeeper_saves_local'].shift(3))
-        goalkeeper_saves_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'goalkeeper_saves_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'goalkeeper_saves_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'goalkeeper_saves_away'].shift(3))
-        total_pass_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_pass_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_pass_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_pass_local'].shift(3))
-        total_pass_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_pass_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_pass_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_pass_away'].shift(3))
-        
-        #Creo un dataframe de solo estadísticas más los datos de arbitro, estadio, ids, season (todos menos lesionados y titulares)
-        df_datos_nuevos = pd.DataFrame({
-                                        'id_equipo_local': id_equipo_local,
-                                            'id_equipo_visitante': id_equipo_visitante,
-                                            'arbitro': arbitro,
-                                            'estadio': estadio,
-                                            'season': season,
-                                        'shots_on_goal_local':shots_on_goal_local,
-                                        'shots_on_goal_away':shots_on_goal_away,
-                                        'shots_off_goal_local':shots_off_goal_local,
-                                        'shots_off_goal_away':shots_off_goal_away,
-                                        'total_shots_local':total_shots_local,
-                                        'total_shots_away':total_shots_away,
-                                        'blocked_shots_local':blocked_shots_local,
-                                        'blocked_shots_away':blocked_shots_away,
-                                        'shots_insidebox_local':shots_insidebox_local,
-                                        'shots_insidebox_away':shots_insidebox_away,
-                                        'shots_outsidebox_local':shots_outsidebox_local,
-                                        'shots_outsidebox_away':shots_outsidebox_away,
-                                        'fouls_local':fouls_local,
-                                        'fouls_away':fouls_away,
-                                        'corners_local':corners_local,
-                                        'corners_away':corners_away,
-                                        'offsides_local':offsides_local,
-                                        'offsides_away':offsides_away,
-                                        'ball_possession_local':ball_possession_local,
-                                        'ball_possession_away':ball_possession_away,
-                                        'yellow_cards_local':yellow_cards_local,
-                                        'yellow_cards_away':yellow_cards_away,
-                                        'red_cards_local':red_cards_local,
-                                        'red_cards_away':red_cards_away,
-                                        'goalkeeper_saves_local':goalkeeper_saves_local,
-                                        'goalkeeper_saves_away':goalkeeper_saves_away,
-                                        'total_pass_local':total_pass_local,
-                                        'total_pass_away':total_pass_away
-                                        }, index = [0])
-        
-        #Creo un dataframe solo con las columnas de lesionados y las relleno con 0 todas
-        #Primero localizo todas las columnas de df_partidos
-        columns_les = []
-        for col in df_partidos.columns:
-            if 'les-' in col:
-                columns_les.append(col)
-        #Relleno con 0 y creo el dataframe de lesionados
-        valores = {col: 0 for col in columns_les}
-        df_lesionados_nuevos = pd.DataFrame([valores])
-        
-        #Hago el mismo proceso con un dataframe de titulares
-        columns_titus = []
-        for col in df_partidos.columns:
-            if 'titu-' in col:
-                columns_titus.append(col)
-        valores_titu = {col: 0 for col in columns_titus}
-        df_titulares_nuevos = pd.DataFrame([valores_titu])
-        
-        #Concateno los 3 dataframe para obtener el dataframe de datos final
-        df_datos_nuevos_final = pd.concat([df_datos_nuevos, df_lesionados_nuevos,df_titulares_nuevos], axis = 1)
-        
-        #Añado los prefijos y sufijos necesarios para localizar los ids de lesionados y titulares en la tabla
-        ids_lesionado_prefijo = ['les-{}'.format(id) for id in ids_lesionados]
-        ids_titular_prefijo = ['titu-{}{}'.format(id,'.0') for id in ids_titulares]
-        
-        #Y sustituyo el valor correspondiente por 1, ya que o estan lesionados en ese partido o van a jugar
-        for id_les in ids_lesionado_prefijo:
-            df_datos_nuevos_final.loc[0, id_les] = 1
-        for id_titu in ids_titular_prefijo:
-            df_datos_nuevos_final.loc[0, id_titu] = 1
-            
-        #Aquí añado las nuevas variables que me parecieron interesantes siguiendo el mismo código que como las cree en el método anterior    
-        df_datos_nuevos_final['goles_local_previos'] = df_partidos.groupby('id_equipo_local')['goles_local'].shift(1) + \
-                                    df_partidos.groupby('id_equipo_local')['goles_local'].shift(2) + \
-                                    df_partidos.groupby('id_equipo_local')['goles_local'].shift(3)
-
-        df_datos_nuevos_final['tiros_local_previos'] = df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(1) + \
-                                        df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(2) + \
-                                        df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(3)
-
-        df_datos_nuevos_final['goles_local_previos'] = df_datos_nuevos_final['goles_local_previos'].fillna(df_partidos.groupby('id_equipo_local')['goles_local'].shift(-1))
-        df_datos_nuevos_final['tiros_local_previos'] = df_datos_nuevos_final['tiros_local_previos'].fillna(df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(-1))
-
-        df_datos_nuevos_final['tiros_para_marcar_local'] = np.where(df_datos_nuevos_final['goles_local_previos'] == 0, 
-                                                df_datos_nuevos_final['tiros_local_previos'], 
-                                                df_datos_nuevos_final['tiros_local_previos'] / df_datos_nuevos_final['goles_local_previos'])
-
-        df_datos_nuevos_final['goles_away_previos'] = df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(1) + \
-                                        df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(2) + \
-                                        df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(3)
-
-        df_datos_nuevos_final['tiros_away_previos'] = df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(1) + \
-                                        df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(2) + \
-                                        df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(3)
-
-        df_datos_nuevos_final['goles_away_previos'] = df_datos_nuevos_final['goles_away_previos'].fillna(df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(-1))
-        df_datos_nuevos_final['tiros_away_previos'] = df_datos_nuevos_final['tiros_away_previos'].fillna(df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(-1))
+        # Nombre del estadio con el formato adecuado que mejor encaja con el introducido, o None si no se parece a ninguno
+        return self.cargar_buscador().estadios.mejor(nombre)
 
-        df_datos_nuevos_final['tiros_para_marcar_away'] = np.where(df_datos_nuevos_final['goles_away_previos'] == 0, 
-                                                df_datos_nuevos_final['tiros_away_previos'], 
-                                                df_datos_nuevos_final['tiros_away_previos'] / df_datos_nuevos_final['goles_away_previos'])
-
-        df_datos_nuevos_final = df_datos_nuevos_final.drop(['tiros_away_previos','goles_away_previos','tiros_local_previos','goles_local_previos'], axis=1)
-
-        df_datos_nuevos_final['tiros_para_marcar_local'] = df_datos_nuevos_final['tiros_para_marcar_local'].fillna(df_datos_nuevos_final['tiros_para_marcar_local'].mean())
-        df_datos_nuevos_final['tiros_para_marcar_away'] = df_datos_nuevos_final['tiros_para_marcar_away'].fillna(df_datos_nuevos_final['tiros_para_marcar_away'].mean())
+    def resolver_nombres(self, tipo, nombres):
+        '''Resuelve muchos nombres de una vez. tipo es 'equipo', 'jugador', 'arbitro' o 'estadio'. Devuelve un dataframe con el
+        nombre buscado, el encontrado, su valor (id de equipo o jugador, o el nombre correcto de árbitro o estadio) y la puntuación'''
+        return self.cargar_buscador().resolver(tipo, nombres)
+    
+    def forma_equipos(self, df_partidos, columnas_modelo=None):
+        '''Calcula de una vez, para todos los equipos, las estadísticas que se preveen para un partido nuevo: la media de la suma de
+        los 3 partidos anteriores en casa (para el local) o de visitante (para el visitante), y los tiros necesarios para marcar gol
+        en sus 3 últimos partidos. Si columnas_modelo tiene variables de forma (variables_forma), se añade la forma de cada equipo
+        para su próximo partido. Devuelve dos dataframes (local y visitante) indexados por id de equipo'''
+        forma = None if columnas_modelo is None else self.especificacion_forma(columnas_modelo)
+        if forma is not None:
+            _, formas_siguiente = self.variables_forma(df_partidos, **forma, siguiente=True)
+
+        formas = []
+        for lado, (columna_equipo, columna_goles) in COLUMNAS_LADO.items():
+            columnas = [f'{estadistica}_{lado}' for estadistica in ESTADISTICAS]
+            equipos = df_partidos[columna_equipo]
+
+            #Suma de los 3 partidos anteriores de cada equipo y media por equipo, todas las estadísticas a la vez
+            grupos = df_partidos.groupby(columna_equipo)[columnas]
+            suma_previos = grupos.shift(1) + grupos.shift(2) + grupos.shift(3)
+            df_forma = suma_previos.groupby(equipos).mean()
+
+            #Lanzamientos necesarios para marcar gol en los 3 últimos partidos del equipo
+            columna_tiros = f'total_shots_{lado}'
+            ultimos = df_partidos[[columna_equipo, columna_goles, columna_tiros]].groupby(columna_equipo).tail(3).groupby(columna_equipo)
+            goles_previos = ultimos[columna_goles].sum().where(ultimos.size() == 3)
+            tiros_previos = ultimos[columna_tiros].sum().where(ultimos.size() == 3)
+            tiros_para_marcar = pd.Series(np.where(goles_previos == 0, tiros_previos, tiros_previos / goles_previos),
+                                          index=goles_previos.index)
+            #Si el equipo no tiene 3 partidos se coge la media, igual que en creacion_nuevas_variables
+            df_forma[f'tiros_para_marcar_{lado}'] = tiros_para_marcar.fillna(df_partidos[f'tiros_para_marcar_{lado}'].mean())
+
+            if forma is not None:
+                columnas_forma = [col for col in formas_siguiente[lado].columns if col in columnas_modelo]
+                df_forma = df_forma.join(formas_siguiente[lado][columnas_forma])
+
+            formas.append(df_forma)
+
+        return formas[0], formas[1]
+
+    def creacion_feature_store(self, df_partidos, columnas_modelo=None):
+        '''Crea el feature_store con la forma de todos los equipos a partir de la salida de creacion_nuevas_variables. Se guarda con
+        feature_store.guardar y se carga con feature_store.cargar para predecir sin tener que leer df_partidos. Si df_partidos solo
+        tiene las columnas de columnas_prediccion, columnas_modelo son todas las columnas del dataset (columnas_dataset). Si el
+        dataset tiene las variables de alineación, el store guarda el resumen de fuerza_alineaciones y no las columnas de jugadores,
+        con las que no se entrena el modelo'''
+        columnas_modelo = df_partidos.columns if columnas_modelo is None else columnas_modelo
+        forma_local, forma_away = self.forma_equipos(df_partidos, columnas_modelo)
+        alineaciones = None
+        if tiene_variables_alineacion(columnas_modelo):
+            alineaciones = fuerza_alineaciones.desde_historico(df_partidos, self.apariciones_jugadores(df_partidos)).resumen()
+            columnas_modelo = [col for col in columnas_modelo if not col.startswith(('les-', 'titu-'))]
+        return feature_store(forma_local, forma_away, columnas_modelo, alineaciones)
+
+    def creacion_datos_nuevos_partes(self, df_partidos, df_fixtures):
+        '''Igual que creacion_datos_nuevos_lote pero sin montar el dataframe ancho: devuelve las columnas que no son de jugadores,
+        la matriz CSR partido x jugador y la lista de columnas de esa matriz. Montar las miles de columnas dispersas es lo que más
+        tarda al crear pocos partidos, así que modelo_ligero puede predecir directamente a partir de estas partes'''
+        df_fixtures = df_fixtures.reset_index(drop=True)
+
+        #df_partidos puede ser el histórico completo o el feature_store ya creado con creacion_feature_store, que evita recalcularlo
+        store = df_partidos if isinstance(df_partidos, feature_store) else self.creacion_feature_store(df_partidos)
+
+        #Estadísticas previstas de cada equipo, consultadas directamente por id en el feature_store
+        df_forma_local = store.forma(df_fixtures['id_equipo_local'], 'local')
+        df_forma_away = store.forma(df_fixtures['id_equipo_visitante'], 'away')
+
+        df_datos_nuevos = pd.concat([df_fixtures[['id_equipo_local', 'id_equipo_visitante', 'arbitro', 'estadio', 'season']],
+                                     df_forma_local, df_forma_away,
+                                     df_fixtures[['odd_1', 'odd_x', 'odd_2']]], axis=1)
+
+        #Variables de alineación, con todo el histórico del store anterior a los partidos nuevos
+        if store.alineaciones is not None:
+            lesionados = df_fixtures['ids_lesionados'].explode().dropna()
+            titulares = df_fixtures['ids_titulares'].explode().dropna()
+            apariciones = pd.DataFrame({'fila': np.r_[lesionados.index.to_numpy(), titulares.index.to_numpy()].astype(np.int64),
+                                        'id_jugador': np.r_[lesionados.to_numpy(dtype=float), titulares.to_numpy(dtype=float)].astype(np.int64),
+                                        'titular': np.r_[np.zeros(len(lesionados), dtype=bool), np.ones(len(titulares), dtype=bool)]})
+            partidos = df_fixtures[['id_equipo_local', 'id_equipo_visitante', 'season']].assign(fecha_timestamp=FECHA_FUTURA)
+            df_datos_nuevos = pd.concat([df_datos_nuevos, store.alineaciones.variables(partidos, apariciones)], axis=1)
+
+        #Bloque de lesionados y titulares como matriz dispersa con todas las columnas de jugadores de df_partidos.
+        #Las columnas de jugadores de df_partidos son el vocabulario id -> columna con el que se entrenó el modelo
+        columnas_jugadores = store.columnas_jugadores
+        posicion_columna = store.posicion_jugador
 
-        df_datos_nuevos_final['odd_1'] = odd_1
-        df_datos_nuevos_final['odd_x'] = odd_x
-        df_datos_nuevos_final['odd_2'] = odd_2
+        #Añado los prefijos y sufijos necesarios para localizar los ids de lesionados y titulares en la tabla
+        lesionados = df_fixtures['ids_lesionados'].explode().dropna()
+        titulares = df_fixtures['ids_titulares'].explode().dropna()
+        filas = np.concatenate([lesionados.index.to_numpy(), titulares.index.to_numpy()])
+        nombres = ['les-{}'.format(int(id)) for id in lesionados] + ['titu-{}'.format(float(id)) for id in titulares]
+
+        #Pongo a 1 las posiciones correspondientes, ya que o estan lesionados en ese partido o van a jugar. Los jugadores que no
+        #aparecen en el histórico no tienen columna en el modelo, así que se ignoran
+        conocidos = np.array([nombre in posicion_columna for nombre in nombres], dtype=bool)
+        columnas = [posicion_columna[nombre] for nombre, conocido in zip(nombres, conocidos) if conocido]
+        matriz_jugadores = sparse.csr_matrix((np.ones(len(columnas), dtype=np.uint8), (filas[conocidos].astype(int), columnas)),
+                                             shape=(len(df_fixtures), len(columnas_jugadores)))
+        matriz_jugadores.data[:] = 1
+
+        #Ordeno las columnas igual que en df_partidos, que es el orden con el que se entrenó el modelo
+        columnas_modelo = [col for col in store.columnas_modelo if col in df_datos_nuevos.columns]
+        return df_datos_nuevos[columnas_modelo], matriz_jugadores, columnas_jugadores
+
+    def creacion_datos_nuevos_lote(self, df_partidos, df_fixtures):
+        '''Crea los datos nuevos de muchos partidos a la vez (por ejemplo una jornada entera). df_fixtures tiene una fila por partido
+        con las columnas id_equipo_local, id_equipo_visitante, odd_1, odd_x, odd_2, arbitro, estadio, season, ids_lesionados y
+        ids_titulares (estas dos son listas de ids de jugadores). Devuelve una fila por partido con las columnas del modelo'''
+        store = df_partidos if isinstance(df_partidos, feature_store) else self.creacion_feature_store(df_partidos)
+        df_datos_nuevos, matriz_jugadores, columnas_jugadores = self.creacion_datos_nuevos_partes(store, df_fixtures)
+        return self.unir_partes(store, df_datos_nuevos, matriz_jugadores, columnas_jugadores)
+
+    def unir_partes(self, store, df_datos_nuevos, matriz_jugadores, columnas_jugadores):
+        '''Monta el dataframe ancho con las columnas del modelo a partir de la salida de creacion_datos_nuevos_partes'''
+        df_jugadores_nuevos = pd.DataFrame.sparse.from_spmatrix(matriz_jugadores, columns=columnas_jugadores)
+
+        df_datos_nuevos_final = pd.concat([df_datos_nuevos, df_jugadores_nuevos], axis=1)
+
+        #Ordeno las columnas igual que en df_partidos, que es el orden con el que se entrenó el modelo
+        columnas_modelo = [col for col in store.columnas_modelo if col in df_datos_nuevos_final.columns]
+        df_datos_nuevos_final = df_datos_nuevos_final[columnas_modelo]
 
         return df_datos_nuevos_final
+
+    def creacion_datos_nuevos(self, df_partidos,id_equipo_local, id_equipo_visitante,odd_1, odd_x, odd_2, arbitro, estadio, season, ids_lesionados, ids_titulares):
+        '''Crea los datos nuevos de un único partido. Es un lote de un solo partido de creacion_datos_nuevos_lote'''
+        df_fixtures = pd.DataFrame({'id_equipo_local': [id_equipo_local],
+                                    'id_equipo_visitante': [id_equipo_visitante],
+                                    'odd_1': [odd_1],
+                                    'odd_x': [odd_x],
+                                    'odd_2': [odd_2],
+                                    'arbitro': [arbitro],
+                                    'estadio': [estadio],
+                                    'season': [season],
+                                    'ids_lesionados': [list(ids_lesionados)],
+                                    'ids_titulares': [list(ids_titulares)]})
+
+        return self.creacion_datos_nuevos_lote(df_partidos, df_fixtures)
     
     def creacion_datos_nuevos_redes(self, df_partidos,id_equipo_local, id_equipo_visitante,odd_1, odd_x, odd_2, arbitro, estadio, season):
-        #Leo el csv donde estan todos los datos completos de los partidos. Se ha creado con la función creacion_df_final()
-        
-        #Creo los datos de estadisticas que se preveen con la media de datos de los últimos 3 partidos en casa o de visitante
-        shots_on_goal_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_on_goal_local'].shift(1) +  \
-                                df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_on_goal_local'].shift(2) +  \
-                                df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_on_goal_local'].shift(3))
-        shots_on_goal_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_on_goal_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_on_goal_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_on_goal_away'].shift(3))
-        shots_off_goal_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_off_goal_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_off_goal_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_off_goal_local'].shift(3))
-        shots_off_goal_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_off_goal_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_off_goal_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_off_goal_away'].shift(3))
-        total_shots_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_shots_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_shots_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_shots_local'].shift(3))
-        total_shots_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_shots_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_shots_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_shots_away'].shift(3))
-        blocked_shots_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'blocked_shots_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'blocked_shots_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'blocked_shots_local'].shift(3))
-        blocked_shots_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'blocked_shots_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'blocked_shots_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'blocked_shots_away'].shift(3))
-        shots_insidebox_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_insidebox_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_insidebox_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_insidebox_local'].shift(3))
-        shots_insidebox_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_insidebox_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_insidebox_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_insidebox_away'].shift(3))
-        shots_outsidebox_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_outsidebox_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_outsidebox_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'shots_outsidebox_local'].shift(3))
-        shots_outsidebox_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_outsidebox_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_outsidebox_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'shots_outsidebox_away'].shift(3))
-        fouls_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'fouls_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'fouls_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'fouls_local'].shift(3))
-        fouls_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'fouls_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'fouls_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'fouls_away'].shift(3))
-        corners_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'corners_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'corners_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'corners_local'].shift(3))
-        corners_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'corners_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'corners_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'corners_away'].shift(3))
-        offsides_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'offsides_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'offsides_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'offsides_local'].shift(3))
-        offsides_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'offsides_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'offsides_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'offsides_away'].shift(3))
-        ball_possession_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'ball_possession_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'ball_possession_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'ball_possession_local'].shift(3))
-        ball_possession_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'ball_possession_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'ball_possession_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'ball_possession_away'].shift(3))
-        yellow_cards_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'yellow_cards_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'yellow_cards_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'yellow_cards_local'].shift(3))
-        yellow_cards_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'yellow_cards_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'yellow_cards_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'yellow_cards_away'].shift(3))
-        red_cards_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'red_cards_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'red_cards_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'red_cards_local'].shift(3))
-        red_cards_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'red_cards_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'red_cards_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'red_cards_away'].shift(3))
-        goalkeeper_saves_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'goalkeeper_saves_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'goalkeeper_saves_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'goalkeeper_saves_local'].shift(3))
-        goalkeeper_saves_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'goalkeeper_saves_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'goalkeeper_saves_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'goalkeeper_saves_away'].shift(3))
-        total_pass_local = np.mean(df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_pass_local'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_pass_local'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_local'] == id_equipo_local, 'total_pass_local'].shift(3))
-        total_pass_away = np.mean(df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_pass_away'].shift(1) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_pass_away'].shift(2) +  \
-                                    df_partidos.loc[df_partidos['id_equipo_visitante'] == id_equipo_visitante, 'total_pass_away'].shift(3))
-        
-        #Creo un dataframe de solo estadísticas más los datos de arbitro, estadio, ids, season (todos menos lesionados y titulares)
-        df_datos_nuevos_final = pd.DataFrame({
-                                        'id_equipo_local': id_equipo_local,
-                                            'id_equipo_visitante': id_equipo_visitante,
-                                            'arbitro': arbitro,
-                                            'estadio': estadio,
-                                            'season': season,
-                                        'shots_on_goal_local':shots_on_goal_local,
-                                        'shots_on_goal_away':shots_on_goal_away,
-                                        'shots_off_goal_local':shots_off_goal_local,
-                                        'shots_off_goal_away':shots_off_goal_away,
-                                        'total_shots_local':total_shots_local,
-                                        'total_shots_away':total_shots_away,
-                                        'blocked_shots_local':blocked_shots_local,
-                                        'blocked_shots_away':blocked_shots_away,
-                                        'shots_insidebox_local':shots_insidebox_local,
-                                        'shots_insidebox_away':shots_insidebox_away,
-                                        'shots_outsidebox_local':shots_outsidebox_local,
-                                        'shots_outsidebox_away':shots_outsidebox_away,
-                                        'fouls_local':fouls_local,
-                                        'fouls_away':fouls_away,
-                                        'corners_local':corners_local,
-                                        'corners_away':corners_away,
-                                        'offsides_local':offsides_local,
-                                        'offsides_away':offsides_away,
-                                        'ball_possession_local':ball_possession_local,
-                                        'ball_possession_away':ball_possession_away,
-                                        'yellow_cards_local':yellow_cards_local,
-                                        'yellow_cards_away':yellow_cards_away,
-                                        'red_cards_local':red_cards_local,
-                                        'red_cards_away':red_cards_away,
-                                        'goalkeeper_saves_local':goalkeeper_saves_local,
-                                        'goalkeeper_saves_away':goalkeeper_saves_away,
-                                        'total_pass_local':total_pass_local,
-                                        'total_pass_away':total_pass_away
-                                        }, index = [0])
-        
-           
-        #Aquí añado las nuevas variables que me parecieron interesantes siguiendo el mismo código que como las cree en el método anterior    
-        df_datos_nuevos_final['goles_local_previos'] = df_partidos.groupby('id_equipo_local')['goles_local'].shift(1) + \
-                                    df_partidos.groupby('id_equipo_local')['goles_local'].shift(2) + \
-                                    df_partidos.groupby('id_equipo_local')['goles_local'].shift(3)
-
-        df_datos_nuevos_final['tiros_local_previos'] = df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(1) + \
-                                        df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(2) + \
-                                        df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(3)
-
-        df_datos_nuevos_final['goles_local_previos'] = df_datos_nuevos_final['goles_local_previos'].fillna(df_partidos.groupby('id_equipo_local')['goles_local'].shift(-1))
-        df_datos_nuevos_final['tiros_local_previos'] = df_datos_nuevos_final['tiros_local_previos'].fillna(df_partidos.groupby('id_equipo_local')['total_shots_local'].shift(-1))
-
-        df_datos_nuevos_final['tiros_para_marcar_local'] = np.where(df_datos_nuevos_final['goles_local_previos'] == 0, 
-                                                df_datos_nuevos_final['tiros_local_previos'], 
-                                                df_datos_nuevos_final['tiros_local_previos'] / df_datos_nuevos_final['goles_local_previos'])
-
-        df_datos_nuevos_final['goles_away_previos'] = df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(1) + \
-                                        df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(2) + \
-                                        df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(3)
-
-        df_datos_nuevos_final['tiros_away_previos'] = df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(1) + \
-                                        df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(2) + \
-                                        df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(3)
-
-        df_datos_nuevos_final['goles_away_previos'] = df_datos_nuevos_final['goles_away_previos'].fillna(df_partidos.groupby('id_equipo_visitante')['goles_visitante'].shift(-1))
-        df_datos_nuevos_final['tiros_away_previos'] = df_datos_nuevos_final['tiros_away_previos'].fillna(df_partidos.groupby('id_equipo_visitante')['total_shots_away'].shift(-1))
-
-        df_datos_nuevos_final['tiros_para_marcar_away'] = np.where(df_datos_nuevos_final['goles_away_previos'] == 0, 
-                                                df_datos_nuevos_final['tiros_away_previos'], 
-                                                df_datos_nuevos_final['tiros_away_previos'] / df_datos_nuevos_final['goles_away_previos'])
-
-        df_datos_nuevos_final = df_datos_nuevos_final.drop(['tiros_away_previos','goles_away_previos','tiros_local_previos','goles_local_previos'], axis=1)
-
-        df_datos_nuevos_final['tiros_para_marcar_local'] = df_datos_nuevos_final['tiros_para_marcar_local'].fillna(df_datos_nuevos_final['tiros_para_marcar_local'].mean())
-        df_datos_nuevos_final['tiros_para_marcar_away'] = df_datos_nuevos_final['tiros_para_marcar_away'].fillna(df_datos_nuevos_final['tiros_para_marcar_away'].mean())
-
-        df_datos_nuevos_final['odd_1'] = odd_1
-        df_datos_nuevos_final['odd_x'] = odd_x
-        df_datos_nuevos_final['odd_2'] = odd_2
+        '''Crea los datos nuevos de un partido para el modelo de redes, que no usa lesionados ni titulares'''
+        df_datos_nuevos_final = self.creacion_datos_nuevos(df_partidos, id_equipo_local, id_equipo_visitante, odd_1, odd_x, odd_2,
+                                                           arbitro, estadio, season, [], [])
+        columnas_jugadores = [col for col in df_datos_nuevos_final.columns if col.startswith(('les-', 'titu-'))]
 
-        return df_datos_nuevos_final
\ No newline at end of file
+        return df_datos_nuevos_final.drop(columnas_jugadores, axis=1)
@@ -0,0 +1,194 @@
+import functools
+import inspect
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import pandas as pd
+
+
+#Variable de entorno que activa la traza. Su valor es la ruta del archivo (JSON Lines) o '1' para usar RUTA_TRAZA
+VARIABLE_TRAZA = 'TRAZA_PIPELINE'
+RUTA_TRAZA = 'traza_pipeline.jsonl'
+
+#Traza activa del proceso, se crea al instrumentar la primera clase
+TRAZA = None
+
+
+def ruta_traza():
+    '''Ruta del archivo de traza según la variable de entorno, o None si la traza está desactivada'''
+    valor = os.environ.get(VARIABLE_TRAZA, '').strip()
+    if valor.lower() in ('', '0', 'false', 'no'):
+        return None
+    return RUTA_TRAZA if valor.lower() in ('1', 'true', 'si', 'sí') else valor
+
+
+def memoria_rss_mb():
+    '''Memoria residente actual del proceso en MB'''
+    try:
+        with open('/proc/self/statm') as archivo:
+            return int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return pico_memoria_mb()
+
+
+def reiniciar_pico_memoria():
+    '''Reinicia el pico de memoria residente del proceso (solo en Linux). Devuelve False si no se puede, y entonces el pico es el
+    de todo el proceso'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as archivo:
+            archivo.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def pico_memoria_mb():
+    '''Pico de memoria residente del proceso en MB desde el último reiniciar_pico_memoria'''
+    try:
+        with open('/proc/self/status') as archivo:
+            for linea in archivo:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1]) / 2**10
+    except OSError:
+        pass
+    #ru_maxrss está en KB en Linux y en bytes en macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 2**20 if sys.platform == 'darwin' else pico / 2**10
+
+
+def dimensiones(salida):
+    '''Filas y columnas de un dataframe, array o matriz dispersa (None si no es una tabla, por ejemplo un modelo). Para varias
+    tablas (tupla o diccionario) se suman las filas y las columnas de las que lo son'''
+    if isinstance(salida, dict):
+        salida = tuple(salida.values())
+    if isinstance(salida, tuple):
+        tamanos = [dimensiones(parte) for parte in salida]
+        if all(filas is None for filas, _ in tamanos):
+            return None, None
+        return sum(filas or 0 for filas, _ in tamanos), sum(columnas or 0 for _, columnas in tamanos)
+    forma = getattr(salida, 'shape', None)
+    #Los escalares de NumPy también tienen shape, pero vacío
+    if not forma:
+        return None, None
+    return int(forma[0]), int(forma[1]) if len(forma) > 1 else 1
+
+
+def formas(valor):
+    '''[filas, columnas] de una tabla, una lista con las de cada parte para varias tablas (tupla o diccionario), o None'''
+    if isinstance(valor, (tuple, dict)):
+        partes = [formas(parte) for parte in (valor.values() if isinstance(valor, dict) else valor)]
+        return partes if any(parte is not None for parte in partes) else None
+    filas, columnas = dimensiones(valor)
+    return None if filas is None else [filas, columnas]
+
+
+class traza():
+    '''Escribe en un archivo JSON Lines un evento 'inicio' al entrar en cada método instrumentado y un evento 'fin' al salir, con
+    tiempo real, tiempo de CPU del proceso, pico de memoria residente por encima de la memoria al entrar y filas y columnas de
+    las entradas y de la salida. Cada evento se escribe en cuanto ocurre, así que si el proceso muere por falta de memoria el
+    último 'inicio' sin su 'fin' es la etapa que lo ha provocado. Los métodos anidados llevan su profundidad, y el pico de memoria
+    de un método incluye el de los que llama'''
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.bloqueo = threading.Lock()
+        self.local = threading.local()
+        self.hilo_principal = threading.main_thread()
+
+    def escribir(self, evento):
+        linea = json.dumps(evento, ensure_ascii=False, default=str) + '\n'
+        with self.bloqueo:
+            with open(self.ruta, 'a', encoding='utf-8') as archivo:
+                archivo.write(linea)
+
+    def medir(self, clase, metodo, parametros, args, kwargs, funcion):
+        pila = self.local.__dict__.setdefault('pila', [])
+        #El pico de memoria es de todo el proceso, así que solo se reinicia desde el hilo principal. En los hilos de un
+        #ThreadPoolExecutor solo se mide el tiempo
+        medir_memoria = threading.current_thread() is self.hilo_principal
+        entradas = {}
+        for nombre, valor in list(zip(parametros, args)) + list(kwargs.items()):
+            forma = formas(valor)
+            if forma is not None:
+                entradas[nombre] = forma
+
+        evento = {'clase': clase, 'metodo': metodo, 'pid': os.getpid(), 'hilo': threading.current_thread().name,
+                  'profundidad': len(pila), 'entradas': entradas}
+        self.escribir({'evento': 'inicio', 'fecha': time.time(), **evento})
+
+        if medir_memoria:
+            #El pico del método que llama se guarda antes de reiniciar el contador para este
+            if pila:
+                pila[-1]['pico'] = max(pila[-1]['pico'], pico_memoria_mb())
+            reiniciar_pico_memoria()
+        marco = {'pico': 0.0}
+        pila.append(marco)
+        memoria_inicial = memoria_rss_mb() if medir_memoria else None
+        inicio, inicio_cpu = time.perf_counter(), time.process_time()
+        error = None
+        try:
+            salida = funcion(*args, **kwargs)
+            return salida
+        except BaseException as excepcion:
+            salida = None
+            error = f'{type(excepcion).__name__}: {excepcion}'
+            raise
+        finally:
+            tiempo, tiempo_cpu = time.perf_counter() - inicio, time.process_time() - inicio_cpu
+            pila.pop()
+            memoria = {}
+            if medir_memoria:
+                pico = max(marco['pico'], pico_memoria_mb())
+                memoria = {'memoria_inicial_mb': round(memoria_inicial, 1), 'memoria_pico_mb': round(pico - memoria_inicial, 1)}
+            self.escribir({'evento': 'fin', 'fecha': time.time(), **evento, 'tiempo_s': round(tiempo, 6),
+                           'tiempo_cpu_s': round(tiempo_cpu, 6), **memoria, 'salida': formas(salida), 'error': error})
+
+
+def instrumentar(clase):
+    '''Decorador de clase: si la variable de entorno TRAZA_PIPELINE está definida al importar el módulo, cada método público de la
+    clase escribe sus eventos en la traza (ver traza). Si no lo está, la clase se devuelve sin tocar, así que desactivada la
+    instrumentación no cuesta nada'''
+    ruta = ruta_traza()
+    if ruta is None:
+        return clase
+
+    global TRAZA
+    if TRAZA is None or TRAZA.ruta != ruta:
+        TRAZA = traza(ruta)
+
+    for nombre, metodo in list(vars(clase).items()):
+        if nombre.startswith('_') or not inspect.isfunction(metodo):
+            continue
+        parametros = list(inspect.signature(metodo).parameters)[1:]
+
+        def envolver(metodo, nombre, parametros):
+            @functools.wraps(metodo)
+            def metodo_instrumentado(self, *args, **kwargs):
+                return TRAZA.medir(clase.__name__, nombre, parametros, args, kwargs, functools.partial(metodo, self))
+            return metodo_instrumentado
+
+        setattr(clase, nombre, envolver(metodo, nombre, parametros))
+    return clase
+
+
+def leer_traza(ruta=None):
+    '''Lee una traza y devuelve un dataframe con una fila por llamada terminada (eventos 'fin'), en el orden en el que terminaron.
+    Las llamadas que empezaron y no terminaron (por ejemplo porque el proceso murió) se añaden con tiempo_s vacío'''
+    ruta = ruta or ruta_traza() or RUTA_TRAZA
+    with open(ruta, encoding='utf-8') as archivo:
+        eventos = [json.loads(linea) for linea in archivo if linea.strip()]
+
+    abiertas = {}
+    filas = []
+    for evento in eventos:
+        clave = (evento['pid'], evento['hilo'], evento['profundidad'])
+        if evento['evento'] == 'inicio':
+            abiertas[clave] = evento
+        else:
+            abiertas.pop(clave, None)
+            filas.append(evento)
+    filas.extend({**evento, 'evento': 'sin_terminar'} for evento in abiertas.values())
+    return pd.DataFrame(filas)
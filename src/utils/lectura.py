@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+#Columnas que se leen de cada archivo en bruto y su tipo. Los conteos que nunca tienen missings se leen como enteros pequeños, los
+#que sí los tienen (la API devuelve null cuando el valor es 0) como float32, y los nombres de árbitros, estadios y equipos como
+#category. Las columnas de nombres de jugadores de alineaciones y lesionados no las usa nadie y no se leen
+ESQUEMAS = {
+    'datos_generales_fx': {
+        'tipos': {'id_equipo_local': 'int32', 'id_equipo_visitante': 'int32', 'goles_local': 'int8', 'goles_visitante': 'int8',
+                  'resultado': 'int8', 'arbitro': 'category', 'fixture_id': 'int64', 'fecha_timestamp': 'int64',
+                  'goles_descanso_local': 'float32', 'goles_descanso_visitante': 'float32', 'estadio': 'category',
+                  'season': 'int16'}},
+    'df_estadisticas': {
+        'tipos': {**{f'{estadistica}_{lado}': 'float32'
+                     for estadistica in ['shots_on_goal', 'shots_off_goal', 'total_shots', 'blocked_shots', 'shots_insidebox',
+                                         'shots_outsidebox', 'fouls', 'corners', 'offsides', 'ball_possession', 'yellow_cards',
+                                         'red_cards', 'goalkeeper_saves', 'pass_precision']
+                     for lado in ['local', 'away']},
+                  'fixture_id_2': 'int64'},
+        #'55%' -> 55.0
+        'porcentajes': ['ball_possession_local', 'ball_possession_away'],
+        #Las tarjetas amarillas traen algún valor erróneo (con porcentaje), que se queda en NaN igual que con pd.to_numeric(errors='coerce')
+        'numericas': ['yellow_cards_local', 'yellow_cards_away']},
+    #El id de los titulares tiene algún missing. Se lee como float64 (exacto para cualquier id) porque Int64 tarda más del doble
+    'datos_alineaciones': {
+        'tipos': {'fixture_id': 'int64', 'id_jugador_titular': 'float64'}},
+    'datos_lesionados': {
+        'tipos': {'fixture_id': 'int64', 'id_lesionado': 'int32'}},
+    'df_dicc_equipos': {
+        'tipos': {'equipo_jugador': 'category', 'id_equipo': 'int32'}},
+    'df_diccionario_jugadores': {
+        'tipos': {'id_jugador': 'int32', 'nombre_jugador': 'object', 'equipo_jugador': 'category', 'id_equipo': 'int32',
+                  'temporada_equipo': 'int16'}},
+}
+
+
+def esquema_archivo(ruta):
+    '''Esquema de un archivo en bruto según su nombre (sin extensión)'''
+    return ESQUEMAS[os.path.splitext(os.path.basename(ruta))[0]]
+
+
+def a_numero(columna, porcentaje=False):
+    '''Convierte a float32 una columna leída como category. Se convierten solo las categorías (unas pocas decenas de valores
+    distintos) y no cada fila. Los valores que no son números se quedan en NaN'''
+    categorias = pd.Series(columna.cat.categories.astype(str))
+    if porcentaje:
+        categorias = categorias.str.rstrip('%')
+    valores = pd.to_numeric(categorias, errors='coerce').to_numpy(dtype=np.float32)
+    codigos = columna.cat.codes.to_numpy()
+    return pd.Series(np.where(codigos >= 0, valores[codigos], np.nan).astype(np.float32), index=columna.index, name=columna.name)
+
+
+def leer_csv(ruta, esquema=None):
+    '''Lee un archivo en bruto con su esquema (por defecto el de ESQUEMAS según el nombre del archivo): solo las columnas del
+    esquema y ya con sus tipos, de forma que no hace falta convertirlos después. Las columnas de porcentajes y las numéricas con
+    valores erróneos se leen como category y se convierten a float32 al terminar la lectura'''
+    esquema = esquema or esquema_archivo(ruta)
+    texto = esquema.get('porcentajes', []) + esquema.get('numericas', [])
+    tipos = {columna: ('category' if columna in texto else tipo) for columna, tipo in esquema['tipos'].items()}
+
+    df = pd.read_csv(ruta, usecols=list(tipos), dtype=tipos)
+    for columna in texto:
+        df[columna] = a_numero(df[columna], porcentaje=columna in esquema.get('porcentajes', []))
+    return df
@@ -0,0 +1,147 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class modelo_ligero():
+    '''Versión para inferencia del pipeline entrenado (ColumnTransformer + PCADisperso + XGBClassifier), creada con
+    train_model.exportar_modelo_ligero. Solo guarda lo necesario para predecir: los vocabularios de los encoders, las componentes
+    de la PCA como arrays de NumPy y el booster en formato nativo UBJSON junto con sus árboles como arrays planos. Los arrays se
+    abren con memory-map y los árboles se recorren con NumPy, así que predecir no necesita importar sklearn, category_encoders ni
+    xgboost. Con usar_xgboost=True se carga el booster nativo (importando xgboost en ese momento) en vez del recorrido con NumPy'''
+
+    def __init__(self, ruta, usar_xgboost=False):
+        self.ruta = ruta
+        with open(os.path.join(ruta, 'metadatos.json'), encoding='utf-8') as archivo:
+            self.metadatos = json.load(archivo)
+
+        self.classes_ = np.array(self.metadatos['clases'])
+        self.posicion_arbitro = {arbitro: i for i, arbitro in enumerate(self.metadatos['vocabulario_arbitro'])}
+        self.valor_estadio = dict(zip(self.metadatos['vocabulario_estadio'], self.metadatos['valores_estadio']))
+        self.posicion_jugador = {col: i for i, col in enumerate(self.metadatos['columnas_jugadores'])}
+
+        self.componentes = self.cargar_array('componentes_pca')
+        self.desplazamiento = self.cargar_array('desplazamiento_pca')
+
+        self.booster = None
+        if usar_xgboost:
+            import xgboost as xgb
+            self.booster = xgb.Booster(model_file=os.path.join(ruta, 'booster.ubj'))
+        else:
+            self.arboles = {nombre: self.cargar_array(f'arboles_{nombre}')
+                            for nombre in ['izquierdo', 'derecho', 'variable', 'umbral', 'defecto_izquierda', 'clase', 'raiz']}
+
+    @classmethod
+    def cargar(cls, ruta, usar_xgboost=False):
+        return cls(ruta, usar_xgboost)
+
+    def cargar_array(self, nombre):
+        return np.load(os.path.join(self.ruta, f'{nombre}.npy'), mmap_mode='r')
+
+    def matriz_preprocesada(self, datos_nuevos, matriz_jugadores=None, columnas_jugadores=None):
+        '''Reproduce la salida del ColumnTransformer como matriz densa: one-hot de arbitro, target encoding de estadio, columnas de
+        jugadores y el resto de columnas numéricas, en las mismas posiciones que en el entrenamiento. Las columnas de jugadores se
+        leen de datos_nuevos o, si se pasan, de matriz_jugadores (CSR con columnas columnas_jugadores, la salida de
+        creacion_datos_nuevos_partes)'''
+        bloques = self.metadatos['bloques']
+        X = np.zeros((len(datos_nuevos), self.metadatos['n_columnas']))
+        filas = np.arange(len(datos_nuevos))
+
+        #Los árbitros que no estaban en el entrenamiento se quedan a 0 (handle_unknown='ignore')
+        posiciones = np.array([self.posicion_arbitro.get(arbitro, -1) for arbitro in datos_nuevos['arbitro']], dtype=int)
+        conocidos = posiciones >= 0
+        X[filas[conocidos], bloques['arbitro'] + posiciones[conocidos]] = 1
+
+        #Los estadios desconocidos o vacíos toman la media a priori, igual que el TargetEncoder
+        X[:, bloques['estadio']] = [self.metadatos['valor_estadio_missing'] if pd.isna(estadio)
+                                    else self.valor_estadio.get(estadio, self.metadatos['valor_estadio_desconocido'])
+                                    for estadio in datos_nuevos['estadio']]
+
+        if matriz_jugadores is not None:
+            #Se pasa cada valor no nulo de la matriz a la posición de su columna en el modelo. Los jugadores que el modelo no conoce se ignoran
+            matriz_jugadores = matriz_jugadores.tocoo()
+            posiciones_modelo = np.array([self.posicion_jugador.get(columna, -1) for columna in columnas_jugadores], dtype=int)
+            posiciones = posiciones_modelo[matriz_jugadores.col]
+            conocidos = posiciones >= 0
+            X[matriz_jugadores.row[conocidos], bloques['jugadores'] + posiciones[conocidos]] = matriz_jugadores.data[conocidos]
+            columnas_dataframe = []
+        else:
+            columnas_dataframe = datos_nuevos.columns.intersection(self.metadatos['columnas_jugadores'])
+
+        #Solo se recorren las columnas de jugadores presentes en datos_nuevos. Con columnas dispersas se leen únicamente sus
+        #posiciones no nulas
+        for columna in columnas_dataframe:
+            valores = datos_nuevos[columna].array
+            if isinstance(valores, pd.arrays.SparseArray):
+                posiciones_no_nulas, valores = valores.sp_index.indices, valores.sp_values
+            else:
+                valores = np.asarray(valores, dtype=float)
+                posiciones_no_nulas = np.flatnonzero(valores)
+                valores = valores[posiciones_no_nulas]
+            X[posiciones_no_nulas, bloques['jugadores'] + self.posicion_jugador[columna]] = valores
+
+        columnas_restantes = self.metadatos['columnas_restantes']
+        X[:, bloques['remainder']:bloques['remainder'] + len(columnas_restantes)] = datos_nuevos[columnas_restantes].to_numpy(dtype=float)
+        return X
+
+    def margen_arboles(self, X):
+        '''Recorre todos los árboles del booster a la vez para cada fila de X y devuelve la suma de las hojas por clase. Igual que
+        xgboost, las comparaciones se hacen en float32 y los valores NaN van por la rama por defecto'''
+        arboles = self.arboles
+        X = np.asarray(X, dtype=np.float32)
+        filas = np.arange(len(X))[:, None]
+        nodos = np.broadcast_to(arboles['raiz'], (len(X), len(arboles['raiz']))).copy()
+
+        while True:
+            izquierdo = arboles['izquierdo'][nodos]
+            hojas = izquierdo == -1
+            if hojas.all():
+                break
+            valores = X[filas, arboles['variable'][nodos]]
+            va_izquierda = np.where(np.isnan(valores), arboles['defecto_izquierda'][nodos], valores < arboles['umbral'][nodos])
+            nodos = np.where(hojas, nodos, np.where(va_izquierda, izquierdo, arboles['derecho'][nodos]))
+
+        #En las hojas, umbral guarda el valor de la hoja
+        valores_hojas = arboles['umbral'][nodos]
+        margen = np.full((len(X), len(self.classes_)), self.metadatos['base_score'], dtype=np.float32)
+        for clase in range(len(self.classes_)):
+            margen[:, clase] += valores_hojas[:, arboles['clase'] == clase].sum(axis=1)
+        return margen
+
+    def predict_proba(self, datos_nuevos, matriz_jugadores=None, columnas_jugadores=None):
+        X = self.matriz_preprocesada(datos_nuevos, matriz_jugadores, columnas_jugadores)
+        X_pca = X @ self.componentes.T - self.desplazamiento
+
+        if self.booster is not None:
+            import xgboost as xgb
+            return self.booster.predict(xgb.DMatrix(X_pca))
+
+        margen = self.margen_arboles(X_pca)
+        exponencial = np.exp(margen - margen.max(axis=1, keepdims=True))
+        return exponencial / exponencial.sum(axis=1, keepdims=True)
+
+
+def prediccion_lote(modelo, datos_nuevos):
+    '''Predice todos los partidos de datos_nuevos (creados con creacion_datos_nuevos_lote) con una única llamada a predict_proba.
+    modelo puede ser el modelo entrenado o un modelo_ligero. Devuelve un dataframe con una fila por partido: ids de los equipos,
+    probabilidad de X, 1 y 2 y el resultado más probable'''
+    probabilidades = modelo.predict_proba(datos_nuevos)
+
+    df_predicciones = pd.DataFrame({
+        'id_equipo_local': np.asarray(datos_nuevos['id_equipo_local']),
+        'id_equipo_visitante': np.asarray(datos_nuevos['id_equipo_visitante']),
+        'prob_X': probabilidades[:, 0],
+        'prob_1': probabilidades[:, 1],
+        'prob_2': probabilidades[:, 2],
+        'resultado': modelo.classes_[np.argmax(probabilidades, axis=1)]
+    }, index=datos_nuevos.index)
+
+    return df_predicciones
+
+
+def mostrar_prediccion(modelo, datos_nuevos):
+    #Columna a columna: una fila con .iloc[0] pasaría el resultado a float junto a las probabilidades
+    df_predicciones = prediccion_lote(modelo, datos_nuevos)
+    resultado, prob_X, prob_1, prob_2 = [df_predicciones[columna].iat[0] for columna in ['resultado', 'prob_X', 'prob_1', 'prob_2']]
+    return print(f'El resultado del partido será {resultado}. Las probabilidades son de X - {prob_X*100}%, 1 - {prob_1*100} y 2 - {prob_2*100}')
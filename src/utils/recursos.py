@@ -0,0 +1,130 @@
+import joblib
+import numpy as np
+import os
+import pandas as pd
+from contextlib import contextmanager
+from scipy import sparse
+
+
+#Memoria de un proceso de joblib antes de recibir datos: intérprete con numpy, pandas, sklearn y xgboost importados
+MEMORIA_BASE_PROCESO_MB = 300
+#Copias de la matriz de entrada que tiene a la vez un proceso durante un ajuste: las filas del fold, la salida del preprocesado
+#y la DMatrix de XGBoost. Es una estimación por arriba, para no quedarse sin memoria
+COPIAS_AJUSTE = 3
+#Columna que sustituye al bloque de jugadores en la matriz compartida: la posición de cada partido en la matriz CSR de jugadores
+COLUMNA_FILA_JUGADORES = 'fila_jugadores'
+#Arrays a partir de este tamaño que joblib pasa a los procesos como memmap de solo lectura en vez de copiarlos en cada tarea
+TAMANO_MEMMAP = '1M'
+
+
+def cpus_disponibles():
+    '''Núcleos que puede usar el proceso (los del cgroup/afinidad en Linux, no todos los de la máquina)'''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memoria_disponible_mb():
+    '''Memoria disponible del sistema en MB según /proc/meminfo, o None si no se puede leer'''
+    try:
+        with open('/proc/meminfo') as archivo:
+            for linea in archivo:
+                if linea.startswith('MemAvailable:'):
+                    return int(linea.split()[1]) / 2**10
+    except OSError:
+        pass
+    return None
+
+
+def tamano_mb(X):
+    if sparse.issparse(X):
+        return (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 2**20
+    return X.memory_usage(index=True, deep=True).sum() / 2**20
+
+
+def filas_matriz(posiciones, matriz):
+    '''Filas de matriz (la CSR de jugadores de compartida) de los partidos de posiciones (la columna COLUMNA_FILA_JUGADORES).
+    Es una función de módulo para que los procesos de joblib puedan deserializar el FunctionTransformer que la usa'''
+    return matriz[np.asarray(posiciones).ravel()]
+
+
+class recursos_entrenamiento():
+    '''Reparto de los núcleos y la memoria del entrenamiento entre los procesos de la búsqueda de hiperparámetros (un ajuste de
+    un candidato en un fold por tarea) y los hilos de XGBoost de cada ajuste. Con n_jobs=-1 en la búsqueda y XGBoost con sus hilos
+    por defecto se lanzan N procesos x N hilos, cada proceso con su copia de la matriz de entrada.
+    - n_cpus y memoria_mb son el total que puede usar el entrenamiento (por defecto los núcleos del proceso y la memoria disponible).
+    - procesos e hilos_xgb fijan el reparto. Por defecto se da prioridad a los procesos, porque los ajustes son independientes y
+      con unos miles de filas XGBoost escala peor con hilos, y los procesos se limitan por la memoria que necesita cada uno.
+    - Con compartir=True (ver compartida) la matriz de entrada llega a los procesos como memmap de solo lectura en carpeta_temporal
+      (por defecto la de joblib), en vez de una copia serializada en cada tarea'''
+
+    def __init__(self, n_cpus=None, memoria_mb=None, procesos=None, hilos_xgb=None, compartir=True, carpeta_temporal=None):
+        self.n_cpus = n_cpus
+        self.memoria_mb = memoria_mb
+        self.procesos = procesos
+        self.hilos_xgb = hilos_xgb
+        self.compartir = compartir
+        self.carpeta_temporal = carpeta_temporal
+
+    def total_cpus(self):
+        return self.n_cpus if self.n_cpus is not None else cpus_disponibles()
+
+    def total_memoria_mb(self):
+        return self.memoria_mb if self.memoria_mb is not None else memoria_disponible_mb()
+
+    def compartida(self, X):
+        '''Devuelve (X, matriz) preparadas para pasarlas a los procesos. Los arrays de numpy de más de TAMANO_MEMMAP los convierte
+        joblib en memmap, pero las miles de columnas dispersas de jugadores son arrays pequeños sueltos que se serializan y se
+        copian en cada tarea. Por eso el bloque de jugadores sale de X como una única matriz CSR (sus data, indices e indptr se
+        comparten con memmap como cualquier otro array grande), y en su lugar X lleva la columna COLUMNA_FILA_JUGADORES con la
+        fila de cada partido en esa matriz. El pipeline de la búsqueda saca de ella las filas de cada fold (ver
+        pipeline_xgbc), así que recibe la misma matriz de jugadores que con las columnas originales. Si no hay columnas de
+        jugadores o compartir=False devuelve X sin tocar y matriz=None'''
+        columnas = [col for col in X.columns if col.startswith(('les-', 'titu-'))]
+        if not self.compartir or not columnas:
+            return X, None
+        jugadores = X[columnas]
+        if all(isinstance(tipo, pd.SparseDtype) for tipo in jugadores.dtypes):
+            matriz = jugadores.sparse.to_coo().tocsr()
+        else:
+            matriz = sparse.csr_matrix(jugadores)
+
+        X_compartida = X.drop(columns=columnas)
+        X_compartida[COLUMNA_FILA_JUGADORES] = np.arange(len(X))
+        return X_compartida, matriz
+
+    def reparto(self, X=None, n_tareas=None, matriz=None):
+        '''Procesos e hilos de XGBoost por proceso para n_tareas ajustes independientes sobre X (y la matriz de jugadores que
+        devuelve compartida, si se ha sacado de X). Guarda en self.reparto_ el reparto y la memoria estimada por proceso'''
+        n_cpus = self.total_cpus()
+        memoria = self.total_memoria_mb()
+
+        #Lo que ocupa X se cuenta una vez si se comparte y una más por proceso si cada uno tiene su copia
+        datos_mb = sum(tamano_mb(datos) for datos in (X, matriz) if datos is not None)
+        memoria_proceso = MEMORIA_BASE_PROCESO_MB + datos_mb * (COPIAS_AJUSTE + (0 if self.compartir else 1))
+        limite_memoria = None
+        if memoria is not None:
+            limite_memoria = max(1, int((memoria - (datos_mb if self.compartir else 0)) // memoria_proceso))
+
+        if self.procesos is not None:
+            procesos = self.procesos
+        else:
+            procesos = n_cpus if self.hilos_xgb is None else max(1, n_cpus // self.hilos_xgb)
+            if n_tareas is not None:
+                procesos = min(procesos, n_tareas)
+            if limite_memoria is not None:
+                procesos = min(procesos, limite_memoria)
+        hilos = self.hilos_xgb if self.hilos_xgb is not None else max(1, n_cpus // procesos)
+
+        self.reparto_ = {'n_cpus': n_cpus, 'memoria_mb': memoria, 'procesos': procesos, 'hilos_xgb': hilos,
+                         'memoria_proceso_mb': round(memoria_proceso, 1), 'limite_procesos_memoria': limite_memoria}
+        return procesos, hilos
+
+    @contextmanager
+    def contexto(self, hilos):
+        '''Configuración de joblib para los procesos de la búsqueda: las librerías con hilos propios (BLAS de la PCA, OpenMP)
+        se limitan a hilos en cada proceso, y los arrays grandes se pasan como memmap de solo lectura'''
+        with joblib.parallel_config(backend='loky', inner_max_num_threads=hilos, temp_folder=self.carpeta_temporal,
+                                    max_nbytes=TAMANO_MEMMAP if self.compartir else None, mmap_mode='r'):
+            yield
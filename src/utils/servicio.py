@@ -0,0 +1,217 @@
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import pandas as pd
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.cache_predicciones import version_archivos
+from utils.feature_store import feature_store
+from utils.functions import data_processing
+from utils.modelo_ligero import modelo_ligero
+
+
+#Campos que tiene que traer cada partido en la petición, los mismos que recibe creacion_datos_nuevos
+CAMPOS_PARTIDO = ['id_equipo_local', 'id_equipo_visitante', 'odd_1', 'odd_x', 'odd_2', 'arbitro', 'estadio', 'season',
+                  'ids_lesionados', 'ids_titulares']
+
+#Estado de cada proceso del pool: se carga una vez al arrancar el proceso y se reutiliza en todas las peticiones
+estado_worker = {}
+
+
+def contexto_procesos():
+    '''Contexto de multiprocessing del pool. Los procesos no se crean con fork: el servicio ya tiene hilos en marcha (el servidor
+    HTTP, el de los lotes) y un fork copia los bloqueos que tenga cogidos otro hilo en ese momento, que en el hijo no se sueltan
+    nunca. Con forkserver los procesos salen de un proceso sin hilos que ya tiene este módulo importado, y donde no hay
+    forkserver se usa spawn. Con los dos los procesos importan el script principal, así que este tiene que arrancar el servicio
+    dentro de if __name__ == '__main__' '''
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        contexto = multiprocessing.get_context('forkserver')
+        contexto.set_forkserver_preload([__name__])
+        return contexto
+    return multiprocessing.get_context('spawn')
+
+
+def iniciar_worker(ruta_modelo, ruta_store):
+    '''Carga en el proceso el feature store y el modelo (el ligero si existe la carpeta, si no el .pkl completo)'''
+    estado_worker['data_processing'] = data_processing()
+    estado_worker['store'] = feature_store.cargar(ruta_store)
+    if os.path.isdir(ruta_modelo):
+        estado_worker['modelo'] = modelo_ligero.cargar(ruta_modelo)
+    else:
+        from utils.train import train_model
+        estado_worker['modelo'] = train_model().importar_modelo(ruta_modelo)
+
+
+def predecir_partidos(partidos):
+    '''Crea los datos nuevos de todos los partidos del lote de una vez y los predice con una sola llamada a predict_proba. Con el
+    modelo ligero no se monta el dataframe ancho de jugadores (ver creacion_datos_nuevos_partes). Devuelve una lista de
+    diccionarios en el mismo orden que partidos'''
+    df_fixtures = pd.DataFrame(partidos, columns=CAMPOS_PARTIDO)
+    modelo = estado_worker['modelo']
+    if isinstance(modelo, modelo_ligero):
+        datos_nuevos, matriz_jugadores, columnas_jugadores = estado_worker['data_processing'].creacion_datos_nuevos_partes(
+            estado_worker['store'], df_fixtures)
+        probabilidades = modelo.predict_proba(datos_nuevos, matriz_jugadores, columnas_jugadores)
+    else:
+        datos_nuevos = estado_worker['data_processing'].creacion_datos_nuevos_lote(estado_worker['store'], df_fixtures)
+        probabilidades = modelo.predict_proba(datos_nuevos)
+
+    resultados = modelo.classes_[probabilidades.argmax(axis=1)]
+    return [{'id_equipo_local': int(partido['id_equipo_local']),
+             'id_equipo_visitante': int(partido['id_equipo_visitante']),
+             'prob_X': float(probabilidad[0]),
+             'prob_1': float(probabilidad[1]),
+             'prob_2': float(probabilidad[2]),
+             'resultado': int(resultado)} for partido, probabilidad, resultado in zip(partidos, probabilidades, resultados)]
+
+
+class servicio_prediccion():
+    '''Servicio HTTP/JSON en localhost que mantiene el modelo y el feature store cargados en un pool de procesos. Las peticiones
+    se encolan y un hilo las agrupa en lotes: coge todo lo que haya llegado en espera_lote segundos (hasta tamano_lote partidos) y
+    lo manda a un proceso libre. Mientras todos los procesos están ocupados los partidos se siguen acumulando en la cola, así que
+    con carga los lotes crecen solos y el coste de crear los datos nuevos y predecir se reparte entre más partidos.
+
+    Endpoints:
+    - POST /prediccion con un partido (objeto JSON con los campos de CAMPOS_PARTIDO) o {"partidos": [...]}. Devuelve la
+      predicción o {"predicciones": [...]}.
+    - GET /salud devuelve {"estado": "ok"}, y con caché también sus contadores.
+
+    Con cache (cache_predicciones) los partidos ya predichos se responden desde este proceso sin pasar por la cola. La versión de
+    las predicciones es la del contenido de los archivos del modelo y del store al arrancar'''
+
+    def __init__(self, ruta_modelo, ruta_store, host='127.0.0.1', puerto=8000, n_workers=None, tamano_lote=64, espera_lote=0.005,
+                 cache=None):
+        self.ruta_modelo = ruta_modelo
+        self.ruta_store = ruta_store
+        self.host = host
+        self.puerto = puerto
+        self.n_workers = n_workers or os.cpu_count()
+        self.tamano_lote = tamano_lote
+        self.espera_lote = espera_lote
+        self.cache = cache
+        self.cola = queue.Queue()
+        self.servidor = None
+
+    def iniciar(self):
+        '''Arranca el pool de procesos, el hilo que forma los lotes y el servidor HTTP (en otro hilo). Devuelve la dirección'''
+        if self.cache is not None:
+            self.version = version_archivos(self.ruta_modelo, self.ruta_store)
+        self.pool = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=contexto_procesos(), initializer=iniciar_worker,
+                                        initargs=(self.ruta_modelo, self.ruta_store))
+        #Como mucho dos lotes por proceso en vuelo, el resto espera en la cola para formar lotes más grandes
+        self.lotes_en_vuelo = threading.Semaphore(2 * self.n_workers)
+        self.hilo_lotes = threading.Thread(target=self.formar_lotes, daemon=True)
+        self.hilo_lotes.start()
+
+        self.servidor = servidor_http((self.host, self.puerto), manejador_peticiones)
+        self.servidor.servicio = self
+        self.hilo_servidor = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.hilo_servidor.start()
+        return f'http://{self.host}:{self.servidor.server_address[1]}'
+
+    def detener(self):
+        if self.servidor is not None:
+            self.servidor.shutdown()
+            self.servidor.server_close()
+        self.cola.put(None)
+        self.hilo_lotes.join()
+        self.pool.shutdown()
+
+    def predecir(self, partidos):
+        '''Predicciones de los partidos, de la caché si está y las que falten de la cola. Se llama desde los hilos del servidor HTTP'''
+        if self.cache is None:
+            return self.encolar(partidos)
+        return self.cache.predecir(partidos, self.version, self.encolar)
+
+    def encolar(self, partidos):
+        '''Encola los partidos y espera a sus predicciones'''
+        futuros = []
+        for partido in partidos:
+            futuro = Future()
+            self.cola.put((partido, futuro))
+            futuros.append(futuro)
+        return [futuro.result() for futuro in futuros]
+
+    def formar_lotes(self):
+        while True:
+            primero = self.cola.get()
+            if primero is None:
+                return
+            self.lotes_en_vuelo.acquire()
+
+            #Tras esperar a un hueco libre se añade todo lo que ya esté en la cola y lo que llegue durante espera_lote
+            lote = [primero]
+            limite = time.monotonic() + self.espera_lote
+            while len(lote) < self.tamano_lote:
+                try:
+                    siguiente = self.cola.get(timeout=max(limite - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if siguiente is None:
+                    self.cola.put(None)
+                    break
+                lote.append(siguiente)
+
+            futuro_lote = self.pool.submit(predecir_partidos, [partido for partido, _ in lote])
+            futuro_lote.add_done_callback(partial(self.repartir_resultados, lote))
+
+    def repartir_resultados(self, lote, futuro_lote):
+        self.lotes_en_vuelo.release()
+        error = futuro_lote.exception()
+        for i, (_, futuro) in enumerate(lote):
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(futuro_lote.result()[i])
+
+
+class servidor_http(ThreadingHTTPServer):
+    #Cola de conexiones pendientes más grande que la de por defecto (5) para aguantar muchas peticiones a la vez
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class manejador_peticiones(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/salud':
+            cache = self.server.servicio.cache
+            return self.responder(200, {'estado': 'ok'} if cache is None else {'estado': 'ok', 'cache': cache.estadisticas()})
+        return self.responder(404, {'error': f"Ruta '{self.path}' no encontrada"})
+
+    def do_POST(self):
+        if self.path != '/prediccion':
+            return self.responder(404, {'error': f"Ruta '{self.path}' no encontrada"})
+
+        try:
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            varios = isinstance(cuerpo, dict) and 'partidos' in cuerpo
+            partidos = cuerpo['partidos'] if varios else [cuerpo]
+            for partido in partidos:
+                faltan = [campo for campo in CAMPOS_PARTIDO if campo not in partido]
+                if faltan:
+                    raise ValueError(f'Faltan los campos {faltan}')
+        except (ValueError, TypeError) as error:
+            return self.responder(400, {'error': str(error)})
+
+        try:
+            predicciones = self.server.servicio.predecir(partidos)
+        except Exception as error:
+            return self.responder(500, {'error': str(error)})
+        return self.responder(200, {'predicciones': predicciones} if varios else predicciones[0])
+
+    def responder(self, codigo, datos):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        #Sin una línea por petición en la consola
+        pass
@@ -1,25 +1,336 @@
+import hashlib
+import joblib
+import json
 import numpy as np
 import os
 import pandas as pd
 import pickle
+import shutil
+import tempfile
+import threading
+import time
 import xgboost as xgb
 from category_encoders import TargetEncoder
+from joblib.externals.loky import get_reusable_executor
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, svds
+from collections import OrderedDict
+from sklearn.base import BaseEstimator, ClassifierMixin, TransformerMixin, clone
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.decomposition import PCA
-from sklearn.model_selection import GridSearchCV
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder
+from sklearn.experimental import enable_halving_search_cv
+from sklearn.metrics import accuracy_score, log_loss
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, ParameterGrid, RandomizedSearchCV, TimeSeriesSplit
+from sklearn.utils.extmath import svd_flip
+from sklearn.utils.validation import check_array, check_is_fitted
+from utils.alineaciones import tiene_variables_alineacion
+from utils.cache_predicciones import version_modelo
+from utils.etapas import huella
+from utils.feature_store import feature_store
+from utils.functions import data_processing
+from utils.instrumentacion import instrumentar
+from utils.modelo_ligero import mostrar_prediccion, prediccion_lote
+from utils.recursos import COLUMNA_FILA_JUGADORES, filas_matriz, recursos_entrenamiento
 
 
+#Grid de hiperparámetros del pipeline de train_xgbc
+PARAMETROS_XGB = {
+    'pca__n_components': [25,30,35],
+    'xgb__n_estimators': [300, 500, 700],
+    'xgb__learning_rate': [0.1],
+    'xgb__max_depth': [27,25],
+    'xgb__subsample': [0.5, 0.8],
+    'xgb__colsample_bytree': [0.5, 0.6],
+    'xgb__min_child_weight': [1, 2],
+    'xgb__gamma': [0]
+}
+
+#Número de combinaciones que prueba la búsqueda 'aleatoria'
+N_ITER_ALEATORIA = 20
+
+#Carpeta donde el pipeline guarda el preprocesado ya ajustado durante la búsqueda de hiperparámetros
+RUTA_CACHE_PIPELINE = os.path.join('data', 'cache', 'pipeline')
+
+#Carpeta donde se guardan en binario las DMatrix de XGBoost de cada fold (ver XGBClassifierCacheado). Cada búsqueda usa su propia
+#subcarpeta, que se borra al terminar
+RUTA_CACHE_DMATRIX = os.path.join('data', 'cache', 'dmatrix')
+#DMatrix que se mantienen en memoria en cada proceso, las de los últimos folds usados
+DMATRIX_EN_MEMORIA = 8
+#Filas de cada bloque que se pasa a XGBoost al crear una DMatrix en memoria externa
+FILAS_BLOQUE_EXTERNA = 100000
+
+
+def a_matriz_dispersa(X):
+    '''Convierte el bloque de columnas de jugadores (les-/titu-) en una matriz CSR sin pasar por una matriz densa'''
+    if hasattr(X, 'sparse'):
+        return X.sparse.to_coo().tocsr()
+    return sparse.csr_matrix(X)
+
+
+class PCADisperso(BaseEstimator, TransformerMixin):
+    '''PCA que acepta matrices dispersas. El centrado de los datos se hace de forma implícita con un LinearOperator, así que
+    la matriz de miles de columnas de jugadores nunca se densifica. Da las mismas componentes que sklearn.decomposition.PCA'''
+
+    def __init__(self, n_components=None, random_state=None):
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        X = check_array(X, accept_sparse='csr', dtype=np.float64)
+        n_filas, n_columnas = X.shape
+        n_components = self.n_components if self.n_components is not None else min(n_filas, n_columnas) - 1
+
+        self.mean_ = np.asarray(X.mean(axis=0)).ravel()
+        media = self.mean_
+
+        #X centrada = X - 1·media, sin llegar a restar la media sobre la matriz
+        X_centrada = LinearOperator(
+            shape=X.shape,
+            dtype=np.float64,
+            matvec=lambda v: X @ v - media @ v,
+            matmat=lambda M: X @ M - media @ M,
+            rmatvec=lambda u: X.T @ u - media * u.sum(),
+            rmatmat=lambda M: X.T @ M - np.outer(media, M.sum(axis=0)),
+        )
+        v0 = np.random.RandomState(self.random_state).uniform(-1, 1, min(X.shape))
+        U, S, Vt = svds(X_centrada, k=n_components, v0=v0)
+
+        #svds devuelve los valores singulares de menor a mayor
+        orden = np.argsort(S)[::-1]
+        U, S, Vt = U[:, orden], S[orden], Vt[orden]
+        U, Vt = svd_flip(U, Vt)
+
+        self.components_ = Vt
+        self.n_components_ = n_components
+        self.singular_values_ = S
+        self.explained_variance_ = S ** 2 / (n_filas - 1)
+        self.n_features_in_ = n_columnas
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self)
+        X = check_array(X, accept_sparse='csr', dtype=np.float64)
+        return np.asarray(X @ self.components_.T) - self.mean_ @ self.components_.T
+
+
+class memoria_pipeline():
+    '''Caché en disco con la interfaz de joblib.Memory (método cache) para el parámetro memory de Pipeline. Guarda cada paso de
+    preprocesado ya ajustado junto con su salida, con la clave calculada con huella sobre el transformador sin ajustar, los datos
+    del fold y el resto de argumentos'''
+
+    def __init__(self, ubicacion):
+        self.ubicacion = ubicacion
+
+    def cache(self, funcion):
+        def funcion_cacheada(*args, **kwargs):
+            clave = hashlib.sha1(''.join([funcion.__name__] + [huella(arg) for arg in args] +
+                                         [nombre + huella(valor) for nombre, valor in sorted(kwargs.items())]).encode()).hexdigest()
+            ruta = os.path.join(self.ubicacion, clave + '.pkl')
+            if os.path.exists(ruta):
+                return joblib.load(ruta)
+
+            resultado = funcion(*args, **kwargs)
+            #Se escribe en un temporal y se renombra para que los procesos de la búsqueda en paralelo nunca lean un archivo a medias
+            os.makedirs(self.ubicacion, exist_ok=True)
+            ruta_temporal = f'{ruta}.{os.getpid()}.tmp'
+            joblib.dump(resultado, ruta_temporal)
+            os.replace(ruta_temporal, ruta)
+            return resultado
+        return funcion_cacheada
+
+    def clear(self):
+        shutil.rmtree(self.ubicacion, ignore_errors=True)
+
+
+#DMatrix en memoria del proceso por clave, de la más antigua a la más reciente
+DMATRIX_PROCESO = OrderedDict()
+BLOQUEO_DMATRIX = threading.Lock()
+
+
+class bloques_filas(xgb.DataIter):
+    '''Pasa a XGBoost una matriz por bloques de filas para crear una DMatrix en memoria externa: XGBoost escribe cada bloque como
+    páginas en disco con el prefijo cache_prefix y durante el entrenamiento las lee de una en una'''
+
+    def __init__(self, datos, cache_prefix, filas_bloque=FILAS_BLOQUE_EXTERNA, **por_fila):
+        #por_fila son las etiquetas, pesos y márgenes, que se cortan igual que los datos
+        self.datos = datos
+        self.por_fila = {nombre: np.asarray(valores) for nombre, valores in por_fila.items() if valores is not None}
+        self.filas_bloque = filas_bloque
+        self.inicio = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, entrada):
+        if self.inicio >= self.datos.shape[0]:
+            return 0
+        bloque = slice(self.inicio, self.inicio + self.filas_bloque)
+        entrada(data=self.datos[bloque], **{nombre: valores[bloque] for nombre, valores in self.por_fila.items()})
+        self.inicio += self.filas_bloque
+        return 1
+
+    def reset(self):
+        self.inicio = 0
+
+
+def liberar_dmatrix():
+    '''Libera las DMatrix guardadas en memoria de este proceso. XGBoost borra las páginas de memoria externa al liberarlas'''
+    with BLOQUEO_DMATRIX:
+        DMATRIX_PROCESO.clear()
+
+
+class XGBClassifierCacheado(BaseEstimator, ClassifierMixin):
+    '''Clasificador de XGBoost para el pipeline que crea la DMatrix de entrenamiento una sola vez por matriz de entrada (en la
+    búsqueda, una por fold y pca__n_components) y la reutiliza en todos los ajustes con esos datos. Solo usa la API pública de
+    XGBoost: crea la DMatrix (o la QuantileDMatrix) y entrena con xgb.train. Los hiperparámetros a None toman el valor por defecto
+    de XGBoost, igual que en xgb.XGBClassifier, y con los mismos parámetros da el mismo modelo.
+
+    La clave de cada DMatrix es la huella de los datos, las etiquetas y los parámetros que cambian la matriz (tree_method, max_bin,
+    missing). Se guarda en memoria del proceso (las DMATRIX_EN_MEMORIA más recientes) y:
+    - Con el tree_method por defecto (o 'exact', 'approx') es una DMatrix normal que, si hay ubicacion_cache, también se guarda
+      en binario en disco, desde donde la cargan los demás procesos de la búsqueda y los reentrenamientos con los mismos datos.
+    - Con tree_method='hist' es una QuantileDMatrix, que ya guarda los datos cuantizados y así la cuantización se paga una vez
+      por fold y no en cada combinación del grid. XGBoost 1.7 no puede guardarla en binario, así que solo se reutiliza en memoria
+      del proceso, no entre procesos ni entre ejecuciones.
+    - Con memoria_externa=True se crea en memoria externa de XGBoost, con páginas en ubicacion_cache, para cuando la tabla no cabe
+      en RAM'''
+
+    def __init__(self, n_estimators=100, learning_rate=None, max_depth=None, subsample=None, colsample_bytree=None,
+                 min_child_weight=None, gamma=None, reg_alpha=None, reg_lambda=None, tree_method=None, max_bin=None,
+                 missing=np.nan, n_jobs=None, random_state=None, ubicacion_cache=None, memoria_externa=False):
+        self.n_estimators = n_estimators
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.subsample = subsample
+        self.colsample_bytree = colsample_bytree
+        self.min_child_weight = min_child_weight
+        self.gamma = gamma
+        self.reg_alpha = reg_alpha
+        self.reg_lambda = reg_lambda
+        self.tree_method = tree_method
+        self.max_bin = max_bin
+        self.missing = missing
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.ubicacion_cache = ubicacion_cache
+        self.memoria_externa = memoria_externa
+
+    def parametros_xgb(self):
+        '''Parámetros de xgb.train, sin los que están a None para que XGBoost use los suyos por defecto'''
+        parametros = {'eta': self.learning_rate, 'max_depth': self.max_depth, 'subsample': self.subsample,
+                      'colsample_bytree': self.colsample_bytree, 'min_child_weight': self.min_child_weight, 'gamma': self.gamma,
+                      'alpha': self.reg_alpha, 'lambda': self.reg_lambda, 'tree_method': self.tree_method, 'max_bin': self.max_bin,
+                      'nthread': self.n_jobs, 'seed': self.random_state}
+        parametros = {parametro: valor for parametro, valor in parametros.items() if valor is not None}
+        if len(self.classes_) > 2:
+            parametros.update(objective='multi:softprob', num_class=len(self.classes_))
+        else:
+            parametros['objective'] = 'binary:logistic'
+        return parametros
+
+    def matriz_entrenamiento(self, X, etiquetas):
+        #En memoria externa la DMatrix lee sus páginas de ubicacion_cache, así que la carpeta también cuenta: si se borra, la
+        #siguiente búsqueda no reutiliza una DMatrix sin páginas
+        externa = f'{self.memoria_externa}|{self.ubicacion_cache}' if self.memoria_externa else 'False'
+        clave = hashlib.sha1(f'{self.tree_method}|{self.max_bin}|{self.missing}|{externa}|{huella(X)}|{huella(etiquetas)}'
+                             .encode()).hexdigest()
+        with BLOQUEO_DMATRIX:
+            if clave in DMATRIX_PROCESO:
+                DMATRIX_PROCESO.move_to_end(clave)
+                return DMATRIX_PROCESO[clave]
+
+        if self.memoria_externa:
+            ubicacion = self.ubicacion_cache or RUTA_CACHE_DMATRIX
+            os.makedirs(ubicacion, exist_ok=True)
+            iterador = bloques_filas(X, os.path.join(ubicacion, f'{clave}-{os.getpid()}'), label=etiquetas)
+            dmatrix = xgb.DMatrix(iterador, missing=self.missing, nthread=self.n_jobs)
+        elif self.tree_method in ('hist', 'gpu_hist'):
+            #QuantileDMatrix: los datos ya se cuantizan al crearla, con el mismo max_bin que el entrenamiento
+            dmatrix = xgb.QuantileDMatrix(X, label=etiquetas, missing=self.missing, nthread=self.n_jobs,
+                                          max_bin=256 if self.max_bin is None else self.max_bin)
+        else:
+            ruta = None if self.ubicacion_cache is None else os.path.join(self.ubicacion_cache, f'{clave}.buffer')
+            if ruta is not None and os.path.exists(ruta):
+                dmatrix = xgb.DMatrix(ruta, nthread=self.n_jobs)
+            else:
+                dmatrix = xgb.DMatrix(X, label=etiquetas, missing=self.missing, nthread=self.n_jobs)
+                if ruta is not None:
+                    #Temporal y renombrado, para que los otros procesos de la búsqueda nunca lean un binario a medias
+                    os.makedirs(self.ubicacion_cache, exist_ok=True)
+                    ruta_temporal = f'{ruta}.{os.getpid()}.tmp'
+                    dmatrix.save_binary(ruta_temporal, silent=True)
+                    os.replace(ruta_temporal, ruta)
+
+        with BLOQUEO_DMATRIX:
+            DMATRIX_PROCESO[clave] = dmatrix
+            while len(DMATRIX_PROCESO) > DMATRIX_EN_MEMORIA:
+                DMATRIX_PROCESO.popitem(last=False)
+        return dmatrix
+
+    def fit(self, X, y, xgb_model=None):
+        '''Entrena n_estimators árboles. Con xgb_model (un Booster) continúa desde ese modelo, como XGBClassifier.fit'''
+        self.classes_, etiquetas = np.unique(np.asarray(y), return_inverse=True)
+        self.n_features_in_ = X.shape[1]
+        self.booster_ = xgb.train(self.parametros_xgb(), self.matriz_entrenamiento(X, etiquetas),
+                                  num_boost_round=self.n_estimators, xgb_model=xgb_model)
+        return self
+
+    def get_booster(self):
+        check_is_fitted(self, 'booster_')
+        return self.booster_
+
+    def predict_proba(self, X):
+        probabilidades = self.get_booster().predict(xgb.DMatrix(X, missing=self.missing, nthread=self.n_jobs))
+        if probabilidades.ndim == 1:
+            probabilidades = np.c_[1 - probabilidades, probabilidades]
+        return probabilidades
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def puntuar_ventana(modelo, X_test, y_test):
+    '''Accuracy y log-loss de un modelo ya ajustado sobre los partidos de test de una ventana'''
+    probabilidades = modelo.predict_proba(X_test)
+    return {'accuracy': accuracy_score(y_test, modelo.classes_[np.argmax(probabilidades, axis=1)]),
+            'log_loss': log_loss(y_test, probabilidades, labels=modelo.classes_)}
+
+
+def ajustar_ventana(pipeline, X, y, entrenamiento, test):
+    '''Ajusta desde cero una copia del pipeline con los partidos de entrenamiento de una ventana y la puntúa con los de test.
+    Es una función de módulo para que joblib pueda repartir las ventanas entre procesos'''
+    inicio = time.perf_counter()
+    modelo = clone(pipeline).fit(X.iloc[entrenamiento], y.iloc[entrenamiento])
+    tiempo = time.perf_counter() - inicio
+    return {'n_entrenamiento': len(entrenamiento),
+            **puntuar_ventana(modelo, X.iloc[test], y.iloc[test]),
+            'tiempo_s': tiempo,
+            'arboles': modelo.named_steps['xgb'].get_booster().num_boosted_rounds()}
+
+
+@instrumentar
 class train_model():
     def __init__(self):
         pass
 
-    def train_xgbc(self,df):
+    def datos_entrenamiento(self, df):
         #Dividimos en los datos de entrenamiento y la clasificación de los datos de entrenamiento que usaremos para entrenar el modelo
         X = df.drop(['index','fixture_id','resultado', 'goles_local', 'goles_visitante','goles_descanso_local','goles_descanso_visitante','fecha_timestamp' ], axis=1)
+        #Con las variables de alineación el modelo no usa las columnas de cada jugador (el bloque 'jugadores' del pipeline queda vacío)
+        if tiene_variables_alineacion(X.columns):
+            X = X.drop([col for col in X.columns if col.startswith(('les-', 'titu-'))], axis=1)
         y = df['resultado']
+        return X, y
 
+    def pipeline_xgbc(self, X, memoria=None, ubicacion_dmatrix=None, memoria_externa=False, hilos_xgb=None, tree_method=None,
+                      matriz_jugadores=None):
+        '''Pipeline de preprocesado + PCA + XGBoost. Si se pasa memoria (memoria_pipeline, una ruta o un joblib.Memory), el
+        ColumnTransformer y la PCA ajustados se guardan en disco y se reutilizan en cualquier ajuste con el mismo fold y los mismos parámetros de esos pasos.
+        XGBoost reutiliza la DMatrix de cada matriz de entrada (ver XGBClassifierCacheado). tree_method es el de XGBoost, por
+        defecto el suyo (el modelo de siempre). Con el de por defecto la DMatrix se guarda también en ubicacion_dmatrix si se pasa;
+        con tree_method='hist' es una QuantileDMatrix que solo se reutiliza en memoria de cada proceso y nunca se escribe en disco.
+        Con memoria_externa=True se crea en memoria externa. hilos_xgb son los hilos de cada ajuste de XGBoost (por defecto todos
+        los núcleos). Con matriz_jugadores (la de recursos_entrenamiento.compartida) X no tiene columnas de jugadores sino
+        COLUMNA_FILA_JUGADORES, y las filas de cada partido se sacan de esa matriz'''
         # Pipeline para codificar la columna 'arbitro' con OneHotEncoder
         arbitro_pipeline = Pipeline([
             ('onehot', OneHotEncoder(sparse=False, handle_unknown='ignore'))
@@ -30,46 +341,252 @@ class train_model():
             ('target', TargetEncoder())
         ])
 
-        # ColumnTransformer para aplicar los pipelines a las columnas correspondientes
+        # Las columnas de lesionados y titulares son dispersas, se pasan al modelo como matriz CSR
+        columnas_jugadores = [col for col in X.columns if col.startswith(('les-', 'titu-'))]
+        jugadores = FunctionTransformer(a_matriz_dispersa, accept_sparse=True)
+        if matriz_jugadores is not None:
+            columnas_jugadores = [COLUMNA_FILA_JUGADORES]
+            jugadores = FunctionTransformer(filas_matriz, kw_args={'matriz': matriz_jugadores})
+
+        # ColumnTransformer para aplicar los pipelines a las columnas correspondientes. Con sparse_threshold=1 la salida
+        # se queda como matriz dispersa
         preprocessor = ColumnTransformer([
             ('arbitro', arbitro_pipeline, ['arbitro']),
             ('estadio', estadio_pipeline, ['estadio']),
-            ], remainder = "passthrough")
+            ('jugadores', jugadores, columnas_jugadores),
+            ], remainder = "passthrough", sparse_threshold = 1)
 
         # Pipeline final con el preprocesamiento y el modelo RandomForestClassifier
         pipeline_xgb = Pipeline([
             ('preprocessor', preprocessor),
-            ('pca', PCA()),
-            ('xgb', xgb.XGBClassifier())
-        ])
+            ('pca', PCADisperso()),
+            ('xgb', XGBClassifierCacheado(tree_method=tree_method, ubicacion_cache=ubicacion_dmatrix,
+                                          memoria_externa=memoria_externa, n_jobs=hilos_xgb))
+        ], memory=memoria)
+
+        return pipeline_xgb
+
+    def busqueda_hiperparametros(self, pipeline_xgb, busqueda='grid', validacion='kfold', parametros=None, n_jobs=-1, refit=True):
+        '''Crea la búsqueda de hiperparámetros sobre parametros (por defecto PARAMETROS_XGB). busqueda puede ser:
+        - 'grid': GridSearchCV con todas las combinaciones.
+        - 'halving': successive halving sobre el mismo grid usando el número de árboles como recurso. Todas las combinaciones empiezan
+          con pocos árboles y solo la mejor tercera parte pasa a la siguiente ronda, hasta llegar al máximo de xgb__n_estimators.
+        - 'aleatoria': RandomizedSearchCV con N_ITER_ALEATORIA combinaciones del grid.
+        Con validacion='temporal' los 3 folds son TimeSeriesSplit: cada fold valida sobre partidos posteriores a los de entrenamiento
+        (los datos vienen ordenados por fecha_timestamp), en vez de validar con partidos futuros mezclados en el entrenamiento.
+        n_jobs son los procesos entre los que se reparten los ajustes (ver recursos_entrenamiento)'''
+        if validacion == 'kfold':
+            cv = 3
+        elif validacion == 'temporal':
+            cv = TimeSeriesSplit(n_splits=3)
+        else:
+            raise ValueError(f"validacion tiene que ser 'kfold' o 'temporal', no '{validacion}'")
+
+        parametros = PARAMETROS_XGB if parametros is None else parametros
+        if busqueda == 'grid':
+            return GridSearchCV(pipeline_xgb, parametros, cv=cv, scoring="accuracy", verbose=1, n_jobs=n_jobs, refit=refit)
 
-        xgb_param = {
-        'pca__n_components': [25,30,35],
-        'xgb__n_estimators': [300, 500, 700],
-        'xgb__learning_rate': [0.1],
-        'xgb__max_depth': [27,25],
-        'xgb__subsample': [0.5, 0.8],
-        'xgb__colsample_bytree': [0.5, 0.6],
-        'xgb__min_child_weight': [1, 2],
-        'xgb__gamma': [0]
-        }
-
-        gs_xgb = GridSearchCV(
-                                pipeline_xgb,
-                                xgb_param,
-                                cv=3,
-                                scoring="accuracy",
-                                verbose=1,
-                                n_jobs=-1
-                            )
+        elif busqueda == 'halving':
+            xgb_param = {parametro: valores for parametro, valores in parametros.items() if parametro != 'xgb__n_estimators'}
+            return HalvingGridSearchCV(pipeline_xgb, xgb_param, resource='xgb__n_estimators',
+                                       max_resources=max(parametros['xgb__n_estimators']), factor=3,
+                                       cv=cv, scoring="accuracy", verbose=1, n_jobs=n_jobs, refit=refit)
+
+        elif busqueda == 'aleatoria':
+            return RandomizedSearchCV(pipeline_xgb, parametros, n_iter=N_ITER_ALEATORIA, random_state=0,
+                                      cv=cv, scoring="accuracy", verbose=1, n_jobs=n_jobs, refit=refit)
+
+        else:
+            raise ValueError(f"busqueda tiene que ser 'grid', 'halving' o 'aleatoria', no '{busqueda}'")
+
+    def train_xgbc(self, df, busqueda='grid', guardar=True, validacion='kfold', parametros=None, memoria_externa=False, recursos=None,
+                   tree_method=None):
+        '''Entrena el pipeline con la búsqueda de hiperparámetros elegida (ver busqueda_hiperparametros) sobre parametros (por
+        defecto PARAMETROS_XGB). Guarda en self.resultado_busqueda el tiempo que ha tardado, la mejor accuracy de validación
+        cruzada, el número de ajustes y el reparto de núcleos, y en self.busqueda_cv la búsqueda de sklearn tal cual (sin reajuste).
+        tree_method es el de XGBoost (ver pipeline_xgbc). Con el de por defecto las DMatrix de cada fold se guardan en una subcarpeta
+        de RUTA_CACHE_DMATRIX, desde la que las cargan todos los procesos de la búsqueda, y que se borra al terminar; con 'hist'
+        solo se reutilizan en memoria de cada proceso. Con memoria_externa=True se crean en memoria externa de XGBoost, para tablas
+        que no caben en RAM. recursos (recursos_entrenamiento, por defecto todos los núcleos y la memoria disponible) reparte los núcleos
+        entre los procesos de la búsqueda y los hilos de XGBoost de cada ajuste, y los procesos reciben la matriz de entrada como
+        memmap. El mejor candidato se reajusta después en este proceso con todos los núcleos, y ese pipeline ya ajustado es el
+        modelo que devuelve (o guarda)'''
+        X, y = self.datos_entrenamiento(df)
+        parametros = PARAMETROS_XGB if parametros is None else parametros
+        recursos = recursos_entrenamiento() if recursos is None else recursos
+        X_compartida, matriz_jugadores = recursos.compartida(X)
+        #Cada candidato se ajusta una vez por fold (3 folds), es el máximo de tareas que se pueden repartir a la vez
+        procesos, hilos = recursos.reparto(X_compartida, n_tareas=len(ParameterGrid(parametros)) * 3, matriz=matriz_jugadores)
+
+        #Solo pca__n_components cambia la salida del preprocesado, así que con la caché el ColumnTransformer se ajusta una vez por
+        #fold y la PCA una vez por (fold, n_components), y todos los candidatos de XGBoost reutilizan esas matrices y su DMatrix
+        memoria = memoria_pipeline(RUTA_CACHE_PIPELINE)
+        os.makedirs(RUTA_CACHE_DMATRIX, exist_ok=True)
+        ubicacion_dmatrix = tempfile.mkdtemp(prefix='busqueda-', dir=RUTA_CACHE_DMATRIX)
+        pipeline_xgb = self.pipeline_xgbc(X_compartida, memoria=memoria, ubicacion_dmatrix=ubicacion_dmatrix, memoria_externa=memoria_externa,
+                                          hilos_xgb=hilos, tree_method=tree_method, matriz_jugadores=matriz_jugadores)
+        gs_xgb = self.busqueda_hiperparametros(pipeline_xgb, busqueda, validacion, parametros, n_jobs=procesos, refit=False)
         
-        modelo = gs_xgb.fit(X, y)
+        inicio = time.perf_counter()
+        try:
+            with recursos.contexto(hilos):
+                busqueda_cv = gs_xgb.fit(X_compartida, y)
+            tiempo_busqueda = time.perf_counter() - inicio
 
-        with open(os.path.join('model','football_predictor.pkl'), 'wb') as file:
-            pickle.dump(modelo, file)
+            #El reajuste es un único ajuste, así que usa todos los núcleos. Las cachés solo sirven para la búsqueda: con todos los
+            #datos ni el preprocesado ni la DMatrix se vuelven a usar. Se ajusta sobre X con sus columnas de jugadores, que son las
+            #que llegan al modelo al predecir
+            modelo = self.pipeline_xgbc(X, hilos_xgb=recursos.total_cpus(), tree_method=tree_method,
+                                        memoria_externa=memoria_externa).set_params(**busqueda_cv.best_params_)
+            modelo.fit(X, y)
+            tiempo = time.perf_counter() - inicio
+        finally:
+            memoria.clear()
+            liberar_dmatrix()
+            if memoria_externa:
+                #Los procesos de joblib siguen vivos con sus DMatrix y las páginas abiertas. Se cierran antes de borrar la carpeta
+                #para que cada uno libere (y borre) sus páginas
+                get_reusable_executor().shutdown(wait=True)
+            shutil.rmtree(ubicacion_dmatrix, ignore_errors=True)
+
+        self.busqueda_cv = busqueda_cv
+        self.resultado_busqueda = {'busqueda': busqueda,
+                                   'tiempo_s': tiempo,
+                                   'mejor_accuracy': busqueda_cv.best_score_,
+                                   'n_ajustes': len(busqueda_cv.cv_results_['params']) * busqueda_cv.n_splits_,
+                                   'mejores_parametros': busqueda_cv.best_params_,
+                                   'tiempo_busqueda_s': tiempo_busqueda,
+                                   'tiempo_reajuste_s': tiempo - tiempo_busqueda,
+                                   **recursos.reparto_}
+
+        if not guardar:
+            return modelo
+
+        self.guardar_modelo(modelo, os.path.join('model','football_predictor.pkl'))
+
+        return f"Modelo entrenado con éxito y guardado en 'football_predictor.pkl'. Búsqueda '{busqueda}': {tiempo:.1f} s, accuracy {busqueda_cv.best_score_:.4f}."
+
+    def comparar_busquedas(self, df, busquedas=('grid', 'halving', 'aleatoria'), validacion='kfold'):
+        '''Entrena con cada una de las búsquedas sin guardar el modelo y devuelve una tabla con el tiempo, la mejor accuracy y el número
+        de ajustes de cada una, para comparar con el grid completo'''
+        resultados = []
+        for busqueda in busquedas:
+            self.train_xgbc(df, busqueda=busqueda, guardar=False, validacion=validacion)
+            resultados.append(self.resultado_busqueda)
+
+        return pd.DataFrame(resultados).set_index('busqueda')
+
+    def comparar_recursos(self, df, repartos=None, busqueda='grid', validacion='kfold', parametros=None, n_cpus=None, memoria_mb=None):
+        '''Benchmark de repartos de núcleos: entrena con cada (procesos, hilos_xgb) de repartos sin guardar el modelo y devuelve una
+        tabla con el tiempo de la búsqueda y los ajustes por hora de cada reparto. Por defecto prueba 1, 2, 4... procesos hasta n_cpus
+        con los núcleos que sobran como hilos de XGBoost. parametros tiene que tener candidatos suficientes para ocupar los procesos
+        (ver PARAMETROS_RECURSOS en utils/benchmark.py)'''
+        recursos = recursos_entrenamiento(n_cpus, memoria_mb)
+        n_cpus = recursos.total_cpus()
+        if repartos is None:
+            procesos = sorted({2**potencia for potencia in range(n_cpus.bit_length()) if 2**potencia <= n_cpus} | {n_cpus})
+            repartos = [(n_procesos, n_cpus // n_procesos) for n_procesos in procesos]
+
+        resultados = []
+        for procesos, hilos in repartos:
+            #Las DMatrix de ajustes anteriores en este proceso harían más rápido el reparto que se mida después
+            DMATRIX_PROCESO.clear()
+            recursos = recursos_entrenamiento(n_cpus, memoria_mb, procesos=procesos, hilos_xgb=hilos)
+            self.train_xgbc(df, busqueda=busqueda, guardar=False, validacion=validacion, parametros=parametros, recursos=recursos)
+            resultado = self.resultado_busqueda
+            resultados.append({'procesos': procesos, 'hilos_xgb': hilos,
+                               'tiempo_busqueda_s': resultado['tiempo_busqueda_s'],
+                               'n_ajustes': resultado['n_ajustes'],
+                               'ajustes_hora': resultado['n_ajustes'] / resultado['tiempo_busqueda_s'] * 3600,
+                               'memoria_proceso_mb': resultado['memoria_proceso_mb'],
+                               'mejor_accuracy': resultado['mejor_accuracy']})
+
+        return pd.DataFrame(resultados)
+
+
+    def ventanas_walk_forward(self, df, por='season', dias_jornada=7, ventanas_iniciales=1, max_ventanas=None):
+        '''Divide df (ordenado por fecha_timestamp) en ventanas crecientes: cada ventana entrena con todos los partidos
+        anteriores y evalúa con los del siguiente periodo. por='season' usa cada temporada como periodo y por='jornada' bloques de
+        dias_jornada días, ya que no hay columna de jornada y conviven varias ligas. Los primeros ventanas_iniciales periodos solo se
+        usan para entrenar y con max_ventanas se evalúan solo los últimos periodos. Devuelve una lista de (periodo, posiciones de
+        entrenamiento, posiciones de test)'''
+        if por == 'season':
+            periodos = df['season'].to_numpy()
+        elif por == 'jornada':
+            fechas = df['fecha_timestamp'].to_numpy()
+            periodos = (fechas - fechas.min()) // (dias_jornada * 24 * 3600)
+        else:
+            raise ValueError(f"por tiene que ser 'season' o 'jornada', no '{por}'")
+
+        valores = np.unique(periodos)
+        ventanas = [(valor, np.flatnonzero(periodos < valor), np.flatnonzero(periodos == valor))
+                    for valor in valores[ventanas_iniciales:]]
+        if max_ventanas is not None:
+            ventanas = ventanas[-max_ventanas:]
+        return ventanas
 
-        return "Modelo entrenado con éxito y guardado en 'football_predictor.pkl'."
+    def evaluacion_walk_forward(self, df, parametros=None, por='season', dias_jornada=7, ventanas_iniciales=1, max_ventanas=None,
+                                reentrenamiento='completo', arboles_incremento=50, recursos=None):
+        '''Evaluación walk-forward del pipeline de train_xgbc con los parametros dados (por ejemplo resultado_busqueda['mejores_parametros']; por defecto
+        el primer valor de cada hiperparámetro de PARAMETROS_XGB) sobre las ventanas de ventanas_walk_forward. reentrenamiento puede ser:
+        - 'completo': en cada ventana se ajusta el pipeline desde cero. Las ventanas son independientes y se reparten entre los procesos
+          de recursos (recursos_entrenamiento, por defecto todos los núcleos), que reciben la matriz de entrada como memmap.
+        - 'warm_start': el preprocesado y la PCA se ajustan en la primera ventana y se congelan, y en cada ventana siguiente el booster
+          anterior continúa con arboles_incremento árboles nuevos entrenados con todos los partidos hasta esa ventana. Es secuencial.
+        - 'ninguno': se ajusta una vez con la primera ventana y no se vuelve a entrenar, como referencia de lo que aporta reentrenar.
+        Devuelve un dataframe con una fila por ventana: partidos con los que se ha entrenado el modelo y de test, accuracy, log-loss, tiempo de ajuste y árboles
+        del modelo. Comparando los tres modos se ve cuánto cómputo de reentrenamiento merece la pena'''
+        if parametros is None:
+            parametros = {parametro: valores[0] for parametro, valores in PARAMETROS_XGB.items()}
 
+        X, y = self.datos_entrenamiento(df)
+        pipeline_xgb = self.pipeline_xgbc(X).set_params(**parametros)
+        ventanas = self.ventanas_walk_forward(df, por, dias_jornada, ventanas_iniciales, max_ventanas)
+
+        if reentrenamiento == 'completo':
+            recursos = recursos_entrenamiento() if recursos is None else recursos
+            X_compartida, matriz_jugadores = recursos.compartida(X)
+            procesos, hilos = recursos.reparto(X_compartida, n_tareas=len(ventanas), matriz=matriz_jugadores)
+            pipeline_ventanas = self.pipeline_xgbc(X_compartida, hilos_xgb=hilos,
+                                                   matriz_jugadores=matriz_jugadores).set_params(**parametros)
+            with recursos.contexto(hilos):
+                resultados = joblib.Parallel(n_jobs=procesos)(joblib.delayed(ajustar_ventana)(pipeline_ventanas, X_compartida, y, entrenamiento, test)
+                                                              for _, entrenamiento, test in ventanas)
+
+        elif reentrenamiento in ('warm_start', 'ninguno'):
+            resultados = []
+            modelo = None
+            for _, entrenamiento, test in ventanas:
+                inicio = time.perf_counter()
+                if modelo is None:
+                    modelo = clone(pipeline_xgb).fit(X.iloc[entrenamiento], y.iloc[entrenamiento])
+                    n_entrenamiento = len(entrenamiento)
+                elif reentrenamiento == 'warm_start':
+                    #El booster solo puede continuar si las columnas que recibe son las mismas, por eso el preprocesado no se reajusta
+                    X_entrenamiento = modelo[:-1].transform(X.iloc[entrenamiento])
+                    xgb_anterior = modelo.named_steps['xgb']
+                    xgb_nuevo = clone(xgb_anterior).set_params(n_estimators=arboles_incremento)
+                    xgb_nuevo.fit(X_entrenamiento, y.iloc[entrenamiento], xgb_model=xgb_anterior.get_booster())
+                    modelo = Pipeline(modelo.steps[:-1] + [('xgb', xgb_nuevo)])
+                    n_entrenamiento = len(entrenamiento)
+                tiempo = time.perf_counter() - inicio
+
+                resultados.append({'n_entrenamiento': n_entrenamiento,
+                                   **puntuar_ventana(modelo, X.iloc[test], y.iloc[test]),
+                                   'tiempo_s': tiempo,
+                                   'arboles': modelo.named_steps['xgb'].get_booster().num_boosted_rounds()})
+
+        else:
+            raise ValueError(f"reentrenamiento tiene que ser 'completo', 'warm_start' o 'ninguno', no '{reentrenamiento}'")
+
+        df_resultados = pd.DataFrame(resultados, index=pd.Index([periodo for periodo, _, _ in ventanas], name='ventana'))
+        df_resultados.insert(1, 'n_test', [len(test) for _, _, test in ventanas])
+        return df_resultados
+
+
+    def guardar_modelo(self, modelo, ruta_modelo):
+        with open(ruta_modelo, 'wb') as file:
+            pickle.dump(modelo, file)
 
     def importar_modelo(self, ruta_modelo):
         with open(ruta_modelo, 'rb') as archivo:
@@ -77,7 +594,86 @@ class train_model():
         return gs_xgb
 
 
+    def exportar_modelo_ligero(self, modelo, ruta):
+        '''Exporta el pipeline entrenado (o el mejor de una búsqueda) a la carpeta ruta en el formato de modelo_ligero: metadatos.json
+        con los vocabularios de los encoders y las columnas, las componentes de la PCA en .npy, el booster en UBJSON nativo y sus
+        árboles como arrays planos en .npy para recorrerlos con NumPy'''
+        pipeline = getattr(modelo, 'best_estimator_', modelo)
+        preprocesador = pipeline.named_steps['preprocessor']
+        pca = pipeline.named_steps['pca']
+        booster = pipeline.named_steps['xgb'].get_booster()
+        os.makedirs(ruta, exist_ok=True)
+
+        #Vocabularios del OneHotEncoder de arbitro y valores del TargetEncoder de estadio, incluidos desconocido y missing
+        onehot = preprocesador.named_transformers_['arbitro'].named_steps['onehot']
+        target = preprocesador.named_transformers_['estadio'].named_steps['target']
+        vocabulario_estadio = [estadio for estadio in target.ordinal_encoder.category_mapping[0]['mapping'].index if not pd.isna(estadio)]
+        valores_estadio = target.transform(pd.DataFrame({'estadio': vocabulario_estadio + ['\0estadio desconocido', np.nan]}))['estadio']
+
+        columnas_transformadores = {nombre: columnas for nombre, _, columnas in preprocesador.transformers_}
+        metadatos = {'clases': pipeline.classes_.tolist(),
+                     'n_columnas': int(sum(bloque.stop - bloque.start for bloque in preprocesador.output_indices_.values())),
+                     'bloques': {nombre: bloque.start for nombre, bloque in preprocesador.output_indices_.items()},
+                     'vocabulario_arbitro': onehot.categories_[0].tolist(),
+                     'vocabulario_estadio': vocabulario_estadio,
+                     'valores_estadio': valores_estadio.iloc[:-2].tolist(),
+                     'valor_estadio_desconocido': float(valores_estadio.iloc[-2]),
+                     'valor_estadio_missing': float(valores_estadio.iloc[-1]),
+                     'columnas_jugadores': list(columnas_transformadores['jugadores']),
+                     'columnas_restantes': list(preprocesador.feature_names_in_[columnas_transformadores['remainder']])}
+
+        #La PCA queda como X @ componentes.T - desplazamiento
+        np.save(os.path.join(ruta, 'componentes_pca.npy'), pca.components_)
+        np.save(os.path.join(ruta, 'desplazamiento_pca.npy'), pca.mean_ @ pca.components_.T)
+
+        #Booster en formato nativo y sus árboles concatenados, con los hijos de cada nodo como posiciones globales
+        booster.save_model(os.path.join(ruta, 'booster.ubj'))
+        modelo_json = json.loads(booster.save_raw(raw_format='json'))
+        learner = modelo_json['learner']
+        metadatos['base_score'] = float(learner['learner_model_param']['base_score'])
+        arboles = learner['gradient_booster']['model']['trees']
+        inicios = np.cumsum([0] + [len(arbol['left_children']) for arbol in arboles])[:-1]
+
+        def hijos(arbol, inicio, lado):
+            hijos_arbol = np.asarray(arbol[lado], dtype=np.int32)
+            return np.where(hijos_arbol == -1, -1, hijos_arbol + inicio)
+
+        arrays_arboles = {
+            'izquierdo': np.concatenate([hijos(arbol, inicio, 'left_children') for arbol, inicio in zip(arboles, inicios)]),
+            'derecho': np.concatenate([hijos(arbol, inicio, 'right_children') for arbol, inicio in zip(arboles, inicios)]),
+            'variable': np.concatenate([arbol['split_indices'] for arbol in arboles]).astype(np.int32),
+            'umbral': np.concatenate([arbol['split_conditions'] for arbol in arboles]).astype(np.float32),
+            'defecto_izquierda': np.concatenate([arbol['default_left'] for arbol in arboles]).astype(bool),
+            'clase': np.asarray(learner['gradient_booster']['model']['tree_info'], dtype=np.int32),
+            'raiz': inicios.astype(np.int32)}
+        for nombre, array in arrays_arboles.items():
+            np.save(os.path.join(ruta, f'arboles_{nombre}.npy'), array)
+
+        with open(os.path.join(ruta, 'metadatos.json'), 'w', encoding='utf-8') as archivo:
+            json.dump(metadatos, archivo, ensure_ascii=False)
+
+        return f"Modelo ligero exportado en '{ruta}'."
+
+
+    def prediccion_modelo_lote(self, modelo, datos_nuevos):
+        '''Predice todos los partidos de datos_nuevos con una única llamada a predict_proba (ver modelo_ligero.prediccion_lote)'''
+        return prediccion_lote(modelo, datos_nuevos)
+
+
+    def prediccion_partidos(self, modelo, store, partidos, cache=None):
+        '''Crea los datos nuevos de partidos (lista de diccionarios o dataframe con las columnas de creacion_datos_nuevos_lote) y los
+        predice de una vez, con la misma salida que prediccion_modelo_lote. Con cache (cache_predicciones) solo se crean y predicen
+        los partidos que no se han predicho ya con este modelo y este store'''
+        store = store if isinstance(store, feature_store) else data_processing().creacion_feature_store(store)
+        if isinstance(partidos, pd.DataFrame):
+            partidos = partidos.to_dict('records')
+
+        def predecir(pendientes):
+            datos_nuevos = data_processing().creacion_datos_nuevos_lote(store, pd.DataFrame(pendientes))
+            return prediccion_lote(modelo, datos_nuevos).to_dict('records')
+
+        predicciones = predecir(partidos) if cache is None else cache.predecir(partidos, version_modelo(modelo, store), predecir)
+        return pd.DataFrame(predicciones)
+
     def prediccion_modelo(self, modelo, datos_nuevos):
-        resultado = modelo.predict(datos_nuevos)
-        probabilidades = modelo.predict_proba(datos_nuevos)
-        return print(f'El resultado del partido será {resultado[0]}. Las probabilidades son de X - {probabilidades[0][0]*100}%, 1 - {probabilidades[0][1]*100} y 2 - {probabilidades[0][2]*100}')
+        return mostrar_prediccion(modelo, datos_nuevos)
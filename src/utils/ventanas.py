@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def nombre_ventana(ventana):
+    '''Nombre de la ventana en las columnas de forma: 'u3' para la suma de los 3 últimos partidos y 'exp0.3' para la media con
+    decaimiento exponencial de parámetro 0.3'''
+    return f'u{ventana}' if isinstance(ventana, (int, np.integer)) else f'exp{ventana:g}'
+
+
+def ventana_de_nombre(nombre):
+    return int(nombre[1:]) if nombre.startswith('u') else float(nombre[3:])
+
+
+class ventanas_equipo():
+    '''Ventanas móviles por equipo sobre arrays de NumPy. Se ordenan una sola vez las entradas por equipo (de forma estable, así
+    que dentro de cada equipo se mantiene el orden en el que vienen) y sobre ese orden cualquier desplazamiento, suma de los k
+    anteriores o media exponencial es una operación vectorizada sobre todas las estadísticas a la vez. Los valores de cada
+    entrada son los de las filas de una matriz (n_entradas x n_estadisticas)'''
+
+    def __init__(self, equipos):
+        equipos = np.asarray(equipos)
+        self.orden = np.argsort(equipos, kind='stable')
+        equipos_ordenados = equipos[self.orden]
+
+        #Posición de cada entrada dentro de su equipo y número de entradas que le quedan por detrás
+        n = len(equipos)
+        inicio = np.r_[True, equipos_ordenados[1:] != equipos_ordenados[:-1]] if n else np.zeros(0, dtype=bool)
+        inicios = np.flatnonzero(inicio)
+        tamanos = np.diff(np.r_[inicios, n])
+        self.posicion = np.arange(n) - np.repeat(inicios, tamanos)
+        self.restantes = np.repeat(tamanos, tamanos) - self.posicion - 1
+
+    def ordenar(self, valores):
+        return np.asarray(valores, dtype=float).reshape(len(self.orden), -1)[self.orden]
+
+    def desordenar(self, valores_ordenados):
+        valores = np.empty_like(valores_ordenados)
+        valores[self.orden] = valores_ordenados
+        return valores
+
+    def desplazar_ordenados(self, valores_ordenados, k):
+        '''Valor de k entradas antes (k > 0) o después (k < 0) dentro del mismo equipo, NaN si no existe'''
+        desplazados = np.full_like(valores_ordenados, np.nan)
+        if k > 0:
+            validos = np.flatnonzero(self.posicion >= k)
+        else:
+            validos = np.flatnonzero(self.restantes >= -k)
+        desplazados[validos] = valores_ordenados[validos - k]
+        return desplazados
+
+    def suma_ordenados(self, valores_ordenados, k):
+        '''Suma de las k entradas anteriores, NaN si faltan entradas o alguna es NaN. Se suma en el mismo orden que
+        shift(1) + shift(2) + ... para dar exactamente el mismo resultado'''
+        suma = self.desplazar_ordenados(valores_ordenados, 1)
+        for j in range(2, k + 1):
+            suma = suma + self.desplazar_ordenados(valores_ordenados, j)
+        return suma
+
+    def media_exponencial_ordenados(self, valores_ordenados, alpha):
+        '''Media de las entradas anteriores con peso (1 - alpha)^j para la de j + 1 entradas antes. Los NaN no cuentan. Se recorre
+        por posición dentro del equipo, cada paso es una operación sobre todos los equipos y estadísticas a la vez'''
+        numerador = np.zeros_like(valores_ordenados)
+        denominador = np.zeros_like(valores_ordenados)
+        conocidos = ~np.isnan(valores_ordenados)
+        for posicion in range(1, int(self.posicion.max(initial=0)) + 1):
+            actuales = np.flatnonzero(self.posicion == posicion)
+            #Las entradas de esta posición siguen a las de la anterior, solo que algunos equipos ya no tienen tantas entradas
+            previas = actuales - 1
+            numerador[actuales] = np.where(conocidos[previas], valores_ordenados[previas], 0) + (1 - alpha) * numerador[previas]
+            denominador[actuales] = conocidos[previas] + (1 - alpha) * denominador[previas]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(denominador > 0, numerador / denominador, np.nan)
+
+    def calcular(self, valores, ventanas):
+        '''Para cada ventana (int: suma de los k anteriores, float: media exponencial con ese alpha) devuelve la matriz de resultados
+        en el orden original de las entradas. valores se ordena una única vez para todas las ventanas'''
+        valores_ordenados = self.ordenar(valores)
+        resultados = {}
+        for ventana in ventanas:
+            if isinstance(ventana, (int, np.integer)):
+                resultado = self.suma_ordenados(valores_ordenados, ventana)
+            else:
+                resultado = self.media_exponencial_ordenados(valores_ordenados, ventana)
+            resultados[nombre_ventana(ventana)] = self.desordenar(resultado)
+        return resultados